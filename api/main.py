@@ -1,8 +1,11 @@
-from pprint import pp
 import sys
 import requests
-from fastapi import FastAPI
-from pydantic import BaseModel
+from datetime import datetime
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
 import uvicorn
 import logging
 import os
@@ -19,13 +22,29 @@ model_dir = Path(os.getenv("MODEL_DIR", project_dir / "model"))
 data_dir.mkdir(exist_ok=True, parents=True)
 
 sys.path.append(str(python_dir))
+from logging_setup import setup_logging, bind_event, stage
+setup_logging()
+logger = logging.getLogger("api")
+
 from message_handle import message_handle, handle_postback
-from flex_generator import get_login_flex_message
-from auth import add_user, get_user
+from flex_generator import get_login_flex_message, warm_templates
+from llm_qa import load_program
+from auth import add_user, get_user_async, verify_api_token, verify_line_signature
+import llm_guard
+import metrics
+import redis_connection
+import flood_zones
+import report_export
+import report_partitions
+import report_search
+import routing
 
 sys.path.append(str(model_dir))
 
 from login_model import UserInfo, LoginSuccessResponse
+from report_filter import ReportFilter
+from report_search_model import ReportSearchResult
+from routing_model import BlockedEdgesRequest, FacilityAssignment, NearestFacilityRequest
 
 
 load_dotenv(project_dir / ".env")
@@ -34,9 +53,25 @@ load_dotenv(project_dir / ".env")
 app = FastAPI()
 
 
-users = {}
+@app.on_event("startup")
+async def startup():
+    warm_templates()
+    # Compiled DisasterBot program from optimize_program.py, if one has been promoted
+    load_program()
+    # Load flood extents now and pick up replaced files without a restart
+    flood_zones.reload_if_changed()
+    flood_zones.start_watcher()
+    # Monthly report partitions ahead of time, and archival past REPORT_RETENTION_MONTHS
+    report_partitions.start_maintenance()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await redis_connection.async_client().aclose()
+
+
 channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
-configuration = Configuration(access_token=channel_access_token)
+configuration = Configuration(access_token=channel_access_token, host=os.getenv("LINE_API_HOST"))
 
 @app.get("/line/login")
 async def login(code: str = None, state: str = None, error: str = None, error_description: str = None):
@@ -105,16 +140,113 @@ async def login(code: str = None, state: str = None, error: str = None, error_de
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    redis_status = await redis_connection.health()
+    # An open LLM breaker is reported but stays 200: intake continues on the rule-based fallbacks
+    redis_status["llm"] = llm_guard.breaker.state
+    if redis_status["redis"] != "ok":
+        return JSONResponse(status_code=503, content={"status": "degraded", **redis_status})
+    return {"status": "healthy", **redis_status}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    # Prometheus text format; counters are per worker process
+    return metrics.render()
+
+
+@app.get("/reports/export/{fmt}")
+def export_reports(fmt: str, filters: ReportFilter = Depends(), include_reporter: bool = False,
+                   authorization: str | None = Header(default=None)):
+    if not verify_api_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid or missing API token")
+    try:
+        # Rows are streamed chunk by chunk from a server-side cursor; nothing is buffered whole
+        chunks = report_export.export(fmt, filters, include_reporter)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    media_type = report_export.FORMATS[fmt][0]
+    filename = f"reports-{datetime.utcnow():%Y%m%dT%H%M%SZ}.{fmt}"
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/reports/search", response_model=list[ReportSearchResult])
+def search_reports(q: str = Query(min_length=2, max_length=200), filters: ReportFilter = Depends(),
+                   fuzzy: bool = True, limit: int = Query(default=50, ge=1, le=report_search.SEARCH_MAX_RESULTS),
+                   offset: int = Query(default=0, ge=0), authorization: str | None = Header(default=None)):
+    if not verify_api_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid or missing API token")
+    # Substring and trigram-similarity matches, both served by the pg_trgm indexes
+    return report_search.search(q, filters, fuzzy=fuzzy, limit=limit, offset=offset)
+
+
+@app.post("/routing/nearest", response_model=list[FacilityAssignment])
+def nearest_facility(body: NearestFacilityRequest, authorization: str | None = Header(default=None)):
+    if not verify_api_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid or missing API token")
+    filters = body.filters.model_copy(update={"province": body.province})
+    reports = routing.report_locations(filters)
+    try:
+        # One multi-source search from every facility covers all reports at once
+        answers = routing.nearest_facilities(
+            body.province, [(f.latitude, f.longitude) for f in body.facilities],
+            [(lat, lon) for _, lat, lon in reports], direction=body.direction,
+            cutoff_m=body.max_distance_m, with_paths=body.include_path)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    assignments = []
+    for (report_id, _, _), answer in zip(reports, answers):
+        if answer is None:
+            assignments.append(FacilityAssignment(report_id=report_id))
+            continue
+        assignments.append(FacilityAssignment(report_id=report_id, facility_id=body.facilities[answer["facility"]].id,
+                                              distance_m=answer["distance_m"], snap_m=answer["snap_m"],
+                                              path=answer.get("path")))
+    return assignments
+
+
+@app.post("/routing/blocked")
+def block_roads(body: BlockedEdgesRequest, authorization: str | None = Header(default=None)):
+    if not verify_api_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid or missing API token")
+    return {"blocked": routing.block_edges(body.province, body.edges, body.both_directions)}
+
+
+@app.delete("/routing/blocked")
+def unblock_roads(body: BlockedEdgesRequest, authorization: str | None = Header(default=None)):
+    if not verify_api_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid or missing API token")
+    return {"unblocked": routing.unblock_edges(body.province, body.edges, body.both_directions)}
+
+
+@app.get("/routing/blocked/{province}")
+def list_blocked_roads(province: str, authorization: str | None = Header(default=None)):
+    if not verify_api_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid or missing API token")
+    return {"province": province, "edges": sorted(routing.blocked_edges(province))}
 
 
 @app.post("/line/webhook")
-async def webhook(payload: WebhookPayload):
-    print(f"Received webhook payload: {payload}")
+async def webhook(request: Request, x_line_signature: str | None = Header(default=None)):
+    # Read the raw bytes once: they are both signed by LINE and parsed directly by
+    # pydantic-core, without an intermediate json.loads / dict pass.
+    body = await request.body()
+    if not verify_line_signature(body, x_line_signature):
+        logger.warning("invalid webhook signature")
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    try:
+        payload = WebhookPayload.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
     event_type = payload.events[0].type if payload.events else "unknown"
     message_id = payload.events[0].replyToken if payload.events and hasattr(payload.events[0], 'replyToken') else "unknown"
     user_id = payload.events[0].source.userId if payload.events and payload.events[0].source and hasattr(payload.events[0].source, 'userId') else "unknown"
-    user = get_user(user_id)
+    bind_event(payload.events[0].webhookEventId if payload.events else None, user_id)
+    logger.info("webhook received", extra={"event_type": event_type, "event_count": len(payload.events)})
+    with stage("user_lookup"):
+        user = await get_user_async(user_id)
     if event_type == "message":
         message_id = payload.events[0].message.id if payload.events and hasattr(payload.events[0], 'message') else "unknown"
         source_type = payload.events[0].source.type if payload.events and payload.events[0].source else "unknown"
@@ -131,7 +263,7 @@ async def webhook(payload: WebhookPayload):
             
         
         if not user:
-            with ApiClient(configuration) as api_client:
+            with stage("login_prompt"), ApiClient(configuration) as api_client:
                 line_bot_api = MessagingApi(api_client)
                 line_bot_api.reply_message(
                     ReplyMessageRequest(
@@ -140,15 +272,26 @@ async def webhook(payload: WebhookPayload):
                     )
                 )
         else:
-            message_handle(message, source_type, source_id, replytoken, message_id)
+            # Handlers block on LINE, Redis and the LLM; run them off the event loop so one worker
+            # serves many users at once (turns for the same user are serialized by conversation_lock)
+            with stage("message_handle", message_type=message.type if message else None):
+                await run_in_threadpool(message_handle, message, source_type, source_id, replytoken, message_id,
+                                        payload.events[0].timestamp)
     elif event_type == "postback":
         replytoken = payload.events[0].replyToken
         data = payload.events[0].postback.data
         source_id = payload.events[0].source.userId if payload.events and payload.events[0].source and hasattr(payload.events[0].source, 'userId') else "unknown"
-        handle_postback(replytoken, data, source_id, user.email if user else None, message_id)
+        with stage("postback"):
+            await run_in_threadpool(handle_postback, replytoken, data, source_id, user.email if user else None, message_id)
     else:
-        print(f"Unhandled event type: {event_type}")
+        logger.info("unhandled event type", extra={"event_type": event_type})
     return {"status": "received"}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # All conversation state lives in Redis/Postgres, so workers (and replicas) are interchangeable
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        sys.path.insert(0, str(project_dir))
+        uvicorn.run("api.main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""Bursts of short texts through the webhook with and without coalescing.
+
+Each simulated user types a burst of 3-4 short messages a few hundred
+milliseconds apart ("น้ำท่วม", "ชั้น 2", "ไฟดับ"), while all users send at
+the same time. For each ``COALESCE_WINDOW`` the run reports:
+
+* LM calls and DisasterBot turns (and the calls saved against window 0);
+* answers sent to LINE per burst;
+* the time from a burst's last message to its final answer, p50/p95, and the
+  latency added against window 0.
+
+Every text of a burst must reach ``DisasterBot.forward``; with coalescing on
+they must also arrive in the order they were sent (without it, turns queued on
+the conversation lock can run out of order, which the run counts).
+
+    python bench/coalesce_bench.py --windows 0 1 1.5 --bursts 8
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import percentiles, save_results  # noqa: E402
+from loadtest import build_app, sign  # noqa: E402
+from stubs import StubLineServer  # noqa: E402
+from traffic import payload, text_event  # noqa: E402
+
+BURSTS = [
+    ["น้ำท่วม", "ชั้น 2", "ไฟดับ"],
+    ["น้ำท่วมบ้านค่ะ", "จังหวัดปทุมธานี", "อำเภอธัญบุรี", "ตำบลลำผักกูด"],
+    ["ช่วยด้วย", "มีคนแก่ติดอยู่ในบ้าน", "น้ำสูงประมาณเอว"],
+    ["จังหวัดอุบลราชธานี อำเภอวารินชำราบ", "ตำบลธาตุ", "น้ำเข้าบ้านแล้ว", "รถเข้าไม่ได้"],
+]
+
+
+async def run_bursts(app, users, rng, gap_range):
+    import httpx
+
+    sent_last = {}
+    tokens = {user: set() for user in users}
+    bursts = {user: BURSTS[i % len(BURSTS)] for i, user in enumerate(users)}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def post(event):
+                raw = json.dumps(payload([event]), ensure_ascii=False).encode("utf-8")
+                await client.post("/line/webhook", content=raw,
+                                  headers={"Content-Type": "application/json", "X-Line-Signature": sign(raw)})
+
+            async def user_burst(user):
+                requests = []
+                await asyncio.sleep(rng.uniform(0, 0.5))
+                for text in bursts[user]:
+                    event = text_event(user, text)
+                    tokens[user].add(event["replyToken"])
+                    sent_last[user] = time.perf_counter()
+                    requests.append(asyncio.create_task(post(event)))
+                    await asyncio.sleep(rng.uniform(*gap_range))
+                await asyncio.gather(*requests)
+
+            await asyncio.gather(*(user_burst(user) for user in users))
+    return bursts, sent_last, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0.0, 1.0, 1.5])
+    parser.add_argument("--bursts", type=int, default=8, help="users bursting at the same time per window")
+    parser.add_argument("--gap-ms", type=float, nargs=2, default=[300.0, 900.0], metavar=("MIN", "MAX"),
+                        help="pause between two messages of a burst")
+    parser.add_argument("--lm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--redis", choices=["fake", "local"], default="fake")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="flood-coalesce-") as tmp, StubLineServer() as line:
+        app_args = Namespace(db="sqlite", redis=args.redis, lm_latency_ms=args.lm_latency_ms, lm_jitter_ms=0.0,
+                             users=args.bursts * len(args.windows), coalesce_window=0.0)
+        app, users, lm, collector, _ = build_app(app_args, Path(tmp), line.url)
+        import llm_qa
+        import message_coalescer
+        import message_handle
+
+        turn_inputs = {}
+
+        class RecordingBot(message_handle.DisasterBot):
+            def forward(self, user_message):
+                turn_inputs.setdefault(self.user_id, []).append(user_message)
+                return super().forward(user_message)
+
+        message_handle.DisasterBot = RecordingBot
+
+        for index, window in enumerate(args.windows):
+            message_coalescer.COALESCE_WINDOW = window
+            run_users = users[index * args.bursts:(index + 1) * args.bursts]
+            rng = random.Random(args.seed)
+            lm_calls, turns = lm.calls, len(collector.durations["llm_turn"])
+            line.timeline.clear()
+
+            bursts, sent_last, tokens = asyncio.run(
+                run_bursts(app, run_users, rng, (args.gap_ms[0] / 1000, args.gap_ms[1] / 1000)))
+
+            latencies, answers, reordered = [], 0, 0
+            for user in run_users:
+                answered = [t for t, path, body in line.timeline
+                            if body.get("replyToken") in tokens[user] or body.get("to") == user]
+                answers += len(answered)
+                latencies.append((max(answered) - sent_last[user]) * 1000)
+                # Every text of the burst reached the conversation; with coalescing also in order
+                history = json.loads(llm_qa.redis_client.get(f"user:{user}:messages"))
+                received = "\n".join(turn_inputs[user]).split("\n")
+                if window > 0:
+                    assert received == bursts[user], (window, turn_inputs[user])
+                else:
+                    assert sorted(received) == sorted(bursts[user]), (window, turn_inputs[user])
+                    reordered += received != bursts[user]
+                assert len(history) == len(turn_inputs[user]), (window, len(history))
+
+            results[str(window)] = {
+                "lm_calls": lm.calls - lm_calls,
+                "turns": len(collector.durations["llm_turn"]) - turns,
+                "answers_per_burst": round(answers / len(run_users), 2),
+                "bursts_answered_out_of_order": reordered,
+                "final_answer_after_last_message_ms": percentiles(latencies),
+            }
+
+    base = results[str(args.windows[0])]
+    print(f"{'window_s':>8} {'turns':>6} {'lm_calls':>9} {'saved':>7} {'answers/burst':>14} {'reordered':>10} "
+          f"{'p50_ms':>8} {'p95_ms':>8} {'added_p50_ms':>13}")
+    for window, r in results.items():
+        r["lm_calls_saved_pct"] = round(100 * (1 - r["lm_calls"] / base["lm_calls"]), 1) if base["lm_calls"] else None
+        r["added_latency_p50_ms"] = round(r["final_answer_after_last_message_ms"]["p50"]
+                                          - base["final_answer_after_last_message_ms"]["p50"], 1)
+        lat = r["final_answer_after_last_message_ms"]
+        print(f"{window:>8} {r['turns']:>6} {r['lm_calls']:>9} {str(r['lm_calls_saved_pct']) + '%':>7} "
+              f"{r['answers_per_burst']:>14} {r['bursts_answered_out_of_order']:>10} {lat['p50']:>8} {lat['p95']:>8} {r['added_latency_p50_ms']:>13}")
+    print(f"saved {save_results('coalesce', {'config': vars(args), 'windows': results})}")
+
+
+if __name__ == "__main__":
+    main()
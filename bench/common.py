@@ -0,0 +1,84 @@
+"""Shared helpers for the benchmark scripts: import paths, percentiles, result files."""
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+bench_dir = Path(__file__).resolve().parent
+project_dir = bench_dir.parent
+results_dir = Path(os.getenv("BENCH_RESULTS_DIR", bench_dir / "results"))
+
+
+def use_project_paths():
+    """Put the project, ``python/`` and ``model/`` on sys.path like the API does."""
+    os.environ.setdefault("MODEL_DIR", str(project_dir / "model"))
+    for path in (project_dir, project_dir / "python", project_dir / "model"):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name: str, results: dict, out_dir: Path | None = None) -> Path:
+    out_dir = Path(out_dir or results_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    results = {"benchmark": name, "created_at": stamp, "git_revision": git_revision(), **results}
+    path = out_dir / f"{name}-{stamp}.json"
+    path.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    return path
+
+
+def _flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_results(old_path: Path, new_path: Path) -> list[tuple[str, float, float, float | None]]:
+    """Return ``(metric, old, new, change_pct)`` for every numeric metric present in both files."""
+    old = _flatten(json.loads(Path(old_path).read_text()))
+    new = _flatten(json.loads(Path(new_path).read_text()))
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        change = None if old[key] == 0 else round((new[key] - old[key]) / old[key] * 100, 1)
+        rows.append((key, old[key], new[key], change))
+    return rows
+
+
+def print_comparison(rows):
+    width = max((len(r[0]) for r in rows), default=10)
+    for metric, old, new, change in rows:
+        delta = "n/a" if change is None else f"{change:+.1f}%"
+        print(f"{metric:<{width}}  {old:>12}  {new:>12}  {delta:>8}")
@@ -0,0 +1,131 @@
+"""Interleaved messages from the same users, fired concurrently at the webhook.
+
+Every turn appends exactly one state to ``user:{id}:messages``, so after the
+run each user's history must hold one entry per message sent. Without the
+per-conversation lock two overlapping turns both read the same history and the
+later write drops the earlier turn.
+
+Handlers run in the app's thread pool, so concurrent requests overlap inside
+one process exactly as they would across workers or replicas: the lock lives
+in Redis either way. The check also records how many turns ran at once for a
+single user (must be 1) and across users (should be > 1). Coalescing is
+switched off (``COALESCE_WINDOW=0``) so every message is its own turn.
+
+    python bench/concurrency_check.py --users 4 --messages 6
+    python bench/concurrency_check.py --no-lock   # shows the lost updates
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import threading
+from argparse import Namespace
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import save_results  # noqa: E402
+from loadtest import build_app, sign  # noqa: E402
+from stubs import StubLineServer  # noqa: E402
+from traffic import TEXTS, payload, text_event  # noqa: E402
+
+
+class TurnTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = Counter()
+        self.max_per_user = 0
+        self.max_overall = 0
+
+    @contextmanager
+    def turn(self, user_id):
+        with self.lock:
+            self.active[user_id] += 1
+            self.max_per_user = max(self.max_per_user, self.active[user_id])
+            self.max_overall = max(self.max_overall, sum(self.active.values()))
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active[user_id] -= 1
+
+
+def instrument(tracker: TurnTracker, use_lock: bool):
+    import message_handle
+
+    class TrackedBot(message_handle.DisasterBot):
+        def forward(self, user_message):
+            with tracker.turn(self.user_id):
+                return super().forward(user_message)
+
+    message_handle.DisasterBot = TrackedBot
+    if not use_lock:
+        @contextmanager
+        def no_lock(user_id):
+            yield None
+        message_handle.conversation_lock = no_lock
+
+
+async def fire(app, events):
+    import httpx
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def post(event):
+                raw = json.dumps(payload([event]), ensure_ascii=False).encode("utf-8")
+                response = await client.post("/line/webhook", content=raw,
+                                             headers={"Content-Type": "application/json", "X-Line-Signature": sign(raw)})
+                return response.status_code
+            return Counter(await asyncio.gather(*(post(event) for event in events)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=6, help="messages per user")
+    parser.add_argument("--lm-latency-ms", type=float, default=40.0)
+    parser.add_argument("--redis", choices=["fake", "local"], default="fake")
+    parser.add_argument("--no-lock", action="store_true", help="disable conversation_lock to show the race")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = [t for t in TEXTS if t != "ยกเลิก"]
+    tracker = TurnTracker()
+    with tempfile.TemporaryDirectory(prefix="flood-concurrency-") as tmp, StubLineServer() as line:
+        app_args = Namespace(db="sqlite", redis=args.redis, lm_latency_ms=args.lm_latency_ms, lm_jitter_ms=0.0,
+                             users=args.users, coalesce_window=0.0)
+        app, users, lm, collector, _ = build_app(app_args, Path(tmp), line.url)
+        instrument(tracker, use_lock=not args.no_lock)
+        import llm_qa
+
+        events = [text_event(user, rng.choice(texts)) for user in users for _ in range(args.messages)]
+        rng.shuffle(events)
+        statuses = asyncio.run(fire(app, events))
+
+        lost = {}
+        for user in users:
+            raw = llm_qa.redis_client.get(f"user:{user}:messages")
+            stored = len(json.loads(raw)) if raw else 0
+            if stored != args.messages:
+                lost[user] = args.messages - stored
+
+    results = {"users": args.users, "messages_per_user": args.messages, "lock": not args.no_lock,
+               "statuses": {str(k): v for k, v in statuses.items()}, "lost_turns": sum(lost.values()),
+               "max_turns_per_user": tracker.max_per_user, "max_turns_overall": tracker.max_overall}
+    print(json.dumps(results, indent=2))
+    print(f"saved {save_results('concurrency', results)}")
+    if args.no_lock:
+        return
+    assert statuses == Counter({200: len(events)}), statuses
+    assert not lost, f"lost turns per user: {lost}"
+    assert tracker.max_per_user == 1, "two turns for one user overlapped"
+    print("ok: no lost turns, one turn per user at a time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Reply/push dispatcher scenarios against the stub LINE server.
+
+Each scenario builds a ``ReplyDispatcher`` the way ``process_text_message``
+does and checks which endpoint the messages reached and what was counted in
+``line_dispatch_total``:
+
+* ``fresh``      - token within ``REPLY_TOKEN_TTL``: one reply
+* ``stale``      - event older than the TTL (slow LLM turn): push only
+* ``rejected``   - LINE answers the reply with 400: falls back to push
+* ``coalesce``   - seven messages: five by reply, two by push
+* ``notice``     - turn outlives ``PROCESSING_NOTICE_AFTER``: notice reply, answer by push
+* ``no_target``  - stale token and nothing to push to: dropped and counted as a failure
+* ``overflow``   - seven messages, fresh token, nothing to push to: five by reply, two dropped
+
+    python bench/dispatch_bench.py
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import save_results, use_project_paths  # noqa: E402
+from stubs import StubLineServer  # noqa: E402
+
+REPLY_PATH = "POST /v2/bot/message/reply"
+PUSH_PATH = "POST /v2/bot/message/push"
+
+
+def run_scenario(name, stub, reply_dispatcher, metrics_before):
+    from linebot.v3.messaging import TextMessage
+
+    stub.requests.clear()
+    stub.bodies.clear()
+    stub.reject_replies = name == "rejected"
+    now_ms = int(time.time() * 1000)
+    stale_ms = now_ms - int((reply_dispatcher.REPLY_TOKEN_TTL + 10) * 1000)
+    push_to = None if name in ("no_target", "overflow") else "Ubench"
+    timestamp = stale_ms if name in ("stale", "no_target") else now_ms
+
+    dispatcher = reply_dispatcher.ReplyDispatcher("token-" + name, push_to=push_to, event_timestamp=timestamp)
+    if name == "notice":
+        dispatcher.start_processing_notice(after=0.05)
+        time.sleep(0.2)  # the LLM turn
+    count = 7 if name in ("coalesce", "overflow") else 1
+    dispatcher.add(*(TextMessage(text=f"ข้อความ {i}") for i in range(count)))
+    dispatcher.flush()
+
+    paths = {path: reply_dispatcher.dispatch_total.get(path=path) - metrics_before.get(path, 0)
+             for path in (reply_dispatcher.REPLY, reply_dispatcher.PUSH,
+                          reply_dispatcher.REPLY_FALLBACK_PUSH, reply_dispatcher.NOTICE)}
+    delivered = sum(len(b.get("messages", [])) for b in stub.bodies)
+    if name == "rejected":
+        delivered -= 1  # the rejected reply body reached the stub but not the user
+    return {"requests": dict(stub.requests), "paths": {k: v for k, v in paths.items() if v},
+            "delivered": delivered, "chunk_sizes": [len(b.get("messages", [])) for b in stub.bodies]}
+
+
+EXPECTED = {
+    "fresh": ({"reply": 1}, 1),
+    "stale": ({"push": 1}, 1),
+    "rejected": ({"reply_fallback_push": 1}, 1),
+    "coalesce": ({"reply": 1, "push": 1}, 7),
+    "notice": ({"notice": 1, "push": 1}, 2),
+    "no_target": ({}, 0),
+    "overflow": ({"reply": 1}, 5),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    with StubLineServer() as stub:
+        os.environ["LINE_API_HOST"] = stub.url
+        os.environ["LINE_CHANNEL_ACCESS_TOKEN"] = "bench-token"
+        use_project_paths()
+        import reply_dispatcher
+
+        results = {}
+        for name, (paths, delivered) in EXPECTED.items():
+            before = dict((dict(k)["path"], v) for k, v in reply_dispatcher.dispatch_total.values.items())
+            failures = reply_dispatcher.dispatch_failures.get(path="push")
+            outcome = run_scenario(name, stub, reply_dispatcher, before)
+            assert outcome["paths"] == paths, (name, outcome)
+            assert outcome["delivered"] == delivered, (name, outcome)
+            if name == "coalesce":
+                assert outcome["chunk_sizes"] == [5, 2], outcome
+            if name in ("no_target", "overflow"):
+                assert reply_dispatcher.dispatch_failures.get(path="push") == failures + 1
+            results[name] = outcome
+            print(f"{name:10s} paths={outcome['paths']} delivered={outcome['delivered']}")
+
+        print(f"all scenarios ok; saved {save_results('dispatch', results)}")
+
+
+if __name__ == "__main__":
+    main()
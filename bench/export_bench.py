@@ -0,0 +1,186 @@
+"""Bulk export throughput and memory on a multi-million-row ``reports`` table.
+
+Seeds the table (SQLite by default, or the database in DATABASE_URL /
+POSTGRES_* with ``--db env``) with synthetic Thai reports whose timestamps
+increase with ``id``, then exports growing prefixes of it (selected with the
+``until`` filter, so the filter path is exercised too) in every format. Each
+export runs in a forked child that samples its own RSS, and reports rows/sec,
+output size and the peak RSS above the child's starting point.
+
+Streaming exports must keep that peak flat as the row count grows.
+``legacy`` is the load-everything approach (``session.query(Report).all()``
+then write CSV) for comparison; it is skipped above ``--legacy-max-rows``.
+
+    python bench/export_bench.py --rows 2000000 --sizes 200000 1000000 2000000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import save_results, use_project_paths  # noqa: E402
+
+START = datetime(2025, 11, 1)
+PROVINCES = [("ปทุมธานี", "ธัญบุรี", "ลำผักกูด"), ("อุบลราชธานี", "วารินชำราบ", "ธาตุ"),
+             ("สงขลา", "หาดใหญ่", "คอหงส์"), ("นครราชสีมา", "เมืองนครราชสีมา", "ในเมือง")]
+CONTENT = ["น้ำท่วมชั้น 2 ไฟดับหมดเลย มีผู้สูงอายุติดอยู่ในบ้าน", "น้ำสูงประมาณเอว รถเข้าไม่ได้",
+           "ถนนหน้าหมู่บ้านน้ำท่วมขัง ต้องการเรือ", "น้ำเข้าบ้านแล้ว ขนของขึ้นที่สูงไม่ทัน"]
+URGENCY = ["Low", "Medium", "High", "Critical"]
+
+
+def page_size() -> int:
+    return os.sysconf("SC_PAGE_SIZE")
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * page_size()
+
+
+def seed(insert_report, rows: int, batch: int = 50_000):
+    from sqlalchemy import func, select
+
+    table = insert_report.Report.__table__
+    with insert_report.engine.begin() as conn:
+        existing = conn.execute(select(func.count()).select_from(table)).scalar()
+    if existing >= rows:
+        return existing
+    rng = random.Random(7)
+    started = time.perf_counter()
+    for offset in range(existing, rows, batch):
+        values = []
+        for i in range(offset, min(offset + batch, rows)):
+            province, district, sub_district = rng.choice(PROVINCES)
+            values.append({"message_id": f"m{i}", "reporter_line_id": f"U{i:032x}",
+                           "reporter_email": f"user{i}@example.com", "province": province, "district": district,
+                           "sub_district": sub_district, "address": f"ซอย {i % 120} หมู่ {i % 12}",
+                           "content": rng.choice(CONTENT), "urgency": rng.choice(URGENCY),
+                           "timestamp": START + timedelta(seconds=i),
+                           "latitude": 14.0 + rng.random(), "longitude": 100.5 + rng.random()})
+        with insert_report.engine.begin() as conn:
+            conn.execute(table.insert(), values)
+        print(f"  seeded {offset + len(values):,}/{rows:,}", end="\r", flush=True)
+    print(f"  seeded {rows - existing:,} rows in {time.perf_counter() - started:.1f}s")
+    return rows
+
+
+def legacy_csv(insert_report, filters, out):
+    import csv
+    import io
+
+    session = insert_report.SessionLocal()
+    try:
+        reports = session.query(insert_report.Report).filter(insert_report.Report.timestamp < filters.until).all()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for r in reports:
+            writer.writerow([r.id, r.message_id, r.province, r.district, r.sub_district, r.address, r.content,
+                             r.urgency, r.timestamp.isoformat()])
+        out.write(buffer.getvalue().encode("utf-8"))
+    finally:
+        session.close()
+
+
+def run_child(fmt: str, rows: int, chunk_size: int, path: str, queue):
+    import insert_report
+    import report_export
+    from report_filter import ReportFilter
+
+    # report_export has already loaded pyarrow, so the library is not part of the export's footprint
+    insert_report.engine.dispose(close=False)
+    baseline = rss_bytes()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], rss_bytes())
+            time.sleep(0.005)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    filters = ReportFilter(until=START + timedelta(seconds=rows))
+    started = time.perf_counter()
+    with open(path, "wb") as out:
+        if fmt == "legacy":
+            legacy_csv(insert_report, filters, out)
+        else:
+            for data in report_export.export(fmt, filters, chunk_size=chunk_size):
+                out.write(data)
+    elapsed = time.perf_counter() - started
+    done.set()
+    sampler.join()
+    queue.put({"seconds": round(elapsed, 2), "rows_per_sec": round(rows / elapsed),
+               "output_mb": round(os.path.getsize(path) / 1e6, 1),
+               "peak_rss_mb": round((max(peak[0], rss_bytes()) - baseline) / 1e6, 1)})
+
+
+def verify(fmt: str, path: str, rows: int):
+    if fmt in ("csv", "legacy"):
+        with open(path, encoding="utf-8-sig") as f:
+            lines = sum(1 for _ in f)
+        assert lines == rows + (fmt == "csv"), (fmt, lines, rows)
+    elif fmt == "geojson":
+        import json
+        with open(path, encoding="utf-8") as f:
+            assert len(json.load(f)["features"]) == rows
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        assert pq.ParquetFile(path).metadata.num_rows == rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000, help="rows in the seeded table")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200_000, 1_000_000, 2_000_000],
+                        help="rows exported per run (prefixes of the table)")
+    parser.add_argument("--formats", nargs="+", default=["csv", "geojson", "parquet", "legacy"])
+    parser.add_argument("--legacy-max-rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--db", choices=["sqlite", "env"], default="sqlite")
+    parser.add_argument("--db-file", type=Path, default=Path(tempfile.gettempdir()) / "flood-export-bench.db",
+                        help="SQLite file, kept between runs so the table is seeded once")
+    parser.add_argument("--no-verify", action="store_true", help="skip re-reading each output to count rows")
+    args = parser.parse_args()
+
+    if args.db == "sqlite":
+        os.environ["DATABASE_URL"] = f"sqlite:///{args.db_file}"
+    use_project_paths()
+    import insert_report
+
+    print(f"seeding {args.rows:,} rows")
+    seed(insert_report, args.rows)
+    insert_report.engine.dispose()
+
+    ctx = multiprocessing.get_context("fork")
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="flood-export-") as tmp:
+        for fmt in args.formats:
+            for rows in args.sizes:
+                if fmt == "legacy" and rows > args.legacy_max_rows:
+                    continue
+                path = os.path.join(tmp, f"export.{fmt}")
+                queue = ctx.Queue()
+                child = ctx.Process(target=run_child, args=(fmt, rows, args.chunk_size, path, queue))
+                child.start()
+                outcome = queue.get()
+                child.join()
+                if not args.no_verify:
+                    verify(fmt, path, rows)
+                results.setdefault(fmt, {})[str(rows)] = outcome
+                print(f"{fmt:8s} rows={rows:>9,} {outcome['seconds']:>7}s {outcome['rows_per_sec']:>9,} rows/s "
+                      f"out={outcome['output_mb']:>7} MB peak_rss=+{outcome['peak_rss_mb']} MB")
+                os.remove(path)
+
+    print(f"saved {save_results('export', {'config': {k: str(v) for k, v in vars(args).items()}, 'results': results})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Microbenchmark of Flex message render cost per message.
+
+``legacy_*`` rebuilds the layout dict and validates it with
+``FlexContainer.from_dict`` on every message (the previous code path);
+``template_*`` renders from the precompiled ``FlexTemplate`` /
+cached login message. ``+to_dict`` adds the SDK serialisation every reply
+pays anyway, so the numbers compare end-to-end message preparation.
+
+    python bench/flex_bench.py --iterations 5000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import save_results, use_project_paths  # noqa: E402
+
+use_project_paths()
+from linebot.v3.messaging import FlexContainer, FlexMessage  # noqa: E402
+
+import flex_generator  # noqa: E402
+
+STATE = SimpleNamespace(province="ปทุมธานี", district="ธัญบุรี", subdistrict="ลำผักกูด",
+                        address_details="ตรงข้ามวัดอัยยิการาม", raw_content="น้ำท่วมชั้น 2 ไฟดับหมดเลย มีผู้สูงอายุติดอยู่",
+                        urgency_level="Critical")
+POSTBACK = "action=submit&id=Zx3k9QpL2mN8vB4c"
+
+
+def legacy_confirm(state):
+    color = "#ff0000" if state.urgency_level == "" else "#1DB446"
+    layout = {
+        "type": "bubble",
+        "body": {"type": "box", "layout": "vertical", "contents": [
+            {"type": "text", "text": "CONFIRM REPORT", "weight": "bold", "size": "xl", "color": color},
+            {"type": "separator", "margin": "md"},
+            {"type": "box", "layout": "vertical", "margin": "md", "contents": [
+                {"type": "text", "text": f"📍 Location: {state.province}, {state.district}, {state.subdistrict}, {state.address_details}", "wrap": True},
+                {"type": "text", "text": f"📝 Event: {state.raw_content}", "wrap": True},
+                {"type": "text", "text": f"🚨 Urgency: {state.urgency_level}", "wrap": True},
+            ]},
+        ]},
+        "footer": {"type": "box", "layout": "vertical", "contents": [
+            {"type": "button", "style": "primary", "color": color,
+             "action": {"type": "postback", "label": "SUBMIT REPORT", "data": POSTBACK}},
+            {"type": "button", "style": "secondary", "margin": "sm",
+             "action": {"type": "message", "label": "Cancel", "text": "Cancel"}},
+        ]},
+    }
+    return FlexMessage(alt_text="Flex Message", contents=FlexContainer.from_dict(layout))
+
+
+def legacy_login():
+    return FlexMessage(alt_text="Please login", contents=FlexContainer.from_dict(
+        flex_generator.LOGIN_TEMPLATE.container.to_dict()))
+
+
+def per_message_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - start) / iterations * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    flex_generator.warm_templates()
+    results = {
+        "confirm": {
+            "legacy_us": per_message_us(lambda: legacy_confirm(STATE), n),
+            "template_us": per_message_us(lambda: flex_generator.get_report_confirm_message(STATE, POSTBACK), n),
+            "legacy_to_dict_us": per_message_us(lambda: legacy_confirm(STATE).to_dict(), n),
+            "template_to_dict_us": per_message_us(
+                lambda: flex_generator.get_report_confirm_message(STATE, POSTBACK).to_dict(), n),
+        },
+        "login": {
+            "legacy_us": per_message_us(legacy_login, n),
+            "template_us": per_message_us(flex_generator.get_login_flex_message, n),
+        },
+    }
+    for name, row in results.items():
+        print(f"{name:<8} " + "  ".join(f"{k}={v}" for k, v in row.items()))
+    print(f"saved {save_results('flex', {'iterations': n, 'us_per_message': results})}")
+
+
+if __name__ == "__main__":
+    main()
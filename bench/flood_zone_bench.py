@@ -0,0 +1,185 @@
+"""Flood-zone scoring latency, bulk re-score and hot reload.
+
+Writes synthetic flood extents to a temporary ``FLOOD_ZONES_DIR`` as GeoJSON:
+irregular observed-extent polygons (risk 1.0) plus larger overlapping forecast
+zones (risk 0.3-0.7) over the area ``export_bench`` seeds reports in. It then
+measures:
+
+* index load time;
+* single-point ``score`` latency (p50/p99 in microseconds);
+* ``score_many`` and ``rescore_reports`` over ``--reports`` stored reports
+  (SQLite), first run and an unchanged re-run that must write nothing;
+* hot reload: the extents file is atomically replaced, ``reload_if_changed``
+  must swap in the new index without a restart and the re-score must pick
+  up the change. ``rescore_once`` must run only once per set of extents,
+  and a re-score that fails partway must be retried.
+
+Every score is checked against a brute-force scan of all polygons.
+
+    python bench/flood_zone_bench.py --zones 3000 --reports 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import percentiles, save_results, use_project_paths  # noqa: E402
+from stubs import make_redis  # noqa: E402
+
+BBOX = (100.5, 14.0, 101.5, 15.0)  # lon/lat, matches export_bench.seed
+
+
+def synthetic_extents(count: int, seed: int, shift: float = 0.0):
+    import geopandas as gpd
+    import shapely
+
+    rng = random.Random(seed)
+    geometries, zone_ids, risks = [], [], []
+    for i in range(count):
+        x, y = rng.uniform(BBOX[0], BBOX[2]) + shift, rng.uniform(BBOX[1], BBOX[3])
+        # Blob of a few overlapping circles, like a traced flood extent
+        parts = [shapely.Point(x + rng.uniform(-0.01, 0.01), y + rng.uniform(-0.01, 0.01)).buffer(
+            rng.uniform(0.002, 0.012), quad_segs=6) for _ in range(rng.randint(1, 4))]
+        geometries.append(shapely.union_all(parts))
+        zone_ids.append(f"obs-{i}")
+        risks.append(1.0)
+    for i in range(max(1, count // 20)):
+        x, y = rng.uniform(BBOX[0], BBOX[2]) + shift, rng.uniform(BBOX[1], BBOX[3])
+        geometries.append(shapely.Point(x, y).buffer(rng.uniform(0.03, 0.08), quad_segs=12))
+        zone_ids.append(f"forecast-{i}")
+        risks.append(round(rng.uniform(0.3, 0.7), 2))
+    return gpd.GeoDataFrame({"zone_id": zone_ids, "risk": risks}, geometry=geometries, crs="EPSG:4326")
+
+
+def write_extents(frame, directory: Path):
+    # Write then rename, the way extents are meant to be replaced in production
+    tmp = directory / ".extents.tmp"
+    frame.to_file(tmp, driver="GeoJSON")
+    os.replace(tmp, directory / "extents.geojson")
+
+
+def brute_force(frame, latitude: float, longitude: float):
+    import shapely
+
+    inside = shapely.intersects(frame.geometry.values.to_numpy(), shapely.Point(longitude, latitude))
+    if not inside.any():
+        return None, 0.0
+    hits = frame[inside]
+    best = hits["risk"].to_numpy().argmax()
+    return hits["zone_id"].iloc[best], float(hits["risk"].iloc[best])
+
+
+def check(zones, frame, points):
+    lats, lons = zip(*points)
+    many_ids, many_risks = zones.score_many(lats, lons)
+    inside = 0
+    for (lat, lon), many_id, many_risk in zip(points, many_ids, many_risks):
+        expected = brute_force(frame, lat, lon)
+        got = zones.score(lat, lon)
+        # Ties between equally risky zones may resolve to either one
+        assert got[1] == expected[1] and many_risk == expected[1], (lat, lon, got, many_risk, expected)
+        assert (got[0] is None) == (expected[0] is None) and (many_id is None) == (expected[0] is None)
+        inside += expected[0] is not None
+    return inside
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--zones", type=int, default=3000, help="observed-extent polygons")
+    parser.add_argument("--reports", type=int, default=100_000)
+    parser.add_argument("--single", type=int, default=20_000, help="points timed one by one")
+    parser.add_argument("--check", type=int, default=500, help="points verified against a brute-force scan")
+    parser.add_argument("--db-file", type=Path, default=Path(tempfile.gettempdir()) / "flood-zone-bench.db")
+    args = parser.parse_args()
+
+    if args.db_file.exists():
+        args.db_file.unlink()
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db_file}"
+    use_project_paths()
+    from export_bench import seed
+    import flood_zones
+    import insert_report
+
+    rng = random.Random(5)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="flood-zones-") as zone_dir:
+        flood_zones.FLOOD_ZONES_DIR = Path(zone_dir)
+        flood_zones.redis_client = make_redis("fake")
+
+        frame = synthetic_extents(args.zones, seed=1)
+        write_extents(frame, Path(zone_dir))
+        started = time.perf_counter()
+        assert flood_zones.reload_if_changed()
+        load_s = time.perf_counter() - started
+        zones = flood_zones.current_zones()
+        assert not flood_zones.reload_if_changed(), "unchanged directory must not reload"
+        print(f"loaded {len(zones):,} zones in {load_s * 1e3:.0f}ms")
+
+        points = [(rng.uniform(BBOX[1], BBOX[3]), rng.uniform(BBOX[0], BBOX[2])) for _ in range(args.single)]
+        for lat, lon in points[:1000]:
+            flood_zones.score(lat, lon)
+        samples = []
+        for lat, lon in points:
+            started = time.perf_counter_ns()
+            flood_zones.score(lat, lon)
+            samples.append((time.perf_counter_ns() - started) / 1000)
+        single = percentiles(samples)
+        print(f"score: p50 {single['p50']}us p99 {single['p99']}us over {single['count']:,} points")
+        inside = check(zones, frame, points[:args.check])
+        print(f"checked {args.check} points against brute force ({inside} inside a zone)")
+
+        lats, lons = zip(*((rng.uniform(BBOX[1], BBOX[3]), rng.uniform(BBOX[0], BBOX[2]))
+                           for _ in range(args.reports)))
+        started = time.perf_counter()
+        zones.score_many(lats, lons)
+        many_s = time.perf_counter() - started
+        print(f"score_many: {args.reports:,} points in {many_s * 1e3:.0f}ms")
+
+        print(f"seeding {args.reports:,} reports")
+        seed(insert_report, args.reports)
+        first = flood_zones.rescore_reports()
+        again = flood_zones.rescore_reports()
+        assert first["scanned"] == args.reports and again["changed"] == 0, (first, again)
+        print(f"rescore: {first['seconds']}s ({first['changed']:,} written), unchanged re-run {again['seconds']}s")
+
+        # New extents: the same blobs moved east by about 1 km
+        moved = synthetic_extents(args.zones, seed=1, shift=0.01)
+        time.sleep(0.01)
+        write_extents(moved, Path(zone_dir))
+        started = time.perf_counter()
+        assert flood_zones.reload_if_changed(), "replaced extents must be picked up"
+        reload_s = time.perf_counter() - started
+        reloaded = flood_zones.current_zones()
+        assert reloaded.fingerprint != zones.fingerprint
+        check(reloaded, moved, points[:args.check])
+        # A re-score that fails partway must leave the extents unmarked so the next check retries
+        def failing_rescore(zones):
+            raise ConnectionError("database went away")
+
+        rescore_reports, flood_zones.rescore_reports = flood_zones.rescore_reports, failing_rescore
+        try:
+            flood_zones.rescore_once(reloaded)
+            raise AssertionError("the failing re-score must raise")
+        except ConnectionError:
+            pass
+        finally:
+            flood_zones.rescore_reports = rescore_reports
+        assert not flood_zones.rescored(reloaded), "a failed re-score must not be marked done"
+        after = flood_zones.rescore_once(reloaded)
+        assert after is not None and after["changed"] > 0, after
+        assert flood_zones.rescore_once(reloaded) is None, "second worker must not re-score the same extents"
+        print(f"hot reload in {reload_s * 1e3:.0f}ms; rescore {after['seconds']}s ({after['changed']:,} changed)")
+
+        results = {"zones": len(zones), "load_ms": round(load_s * 1e3, 1), "score_us": single,
+                   "score_many_ms": round(many_s * 1e3, 1), "rescore_first": first, "rescore_unchanged": again,
+                   "reload_ms": round(reload_s * 1e3, 1), "rescore_after_reload": after}
+
+    print(f"saved {save_results('flood_zones', {'config': {k: str(v) for k, v in vars(args).items()}, 'results': results})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Intake through an LLM outage: timeouts, circuit breaker and rule-based degraded mode.
+
+Runs Thai reporting conversations through ``DisasterBot.forward`` against
+``StubLM`` in four phases:
+
+* ``healthy`` - the LM answers quickly; no fallbacks, breaker closed.
+* ``outage`` - every LM call raises; the breaker opens and turns are answered
+  by ``degraded_mode``.
+* ``brownout`` - the LM is far slower than the per-signature deadlines; calls
+  are cut off at the deadline, the breaker opens, and turns stay fast.
+* ``recovered`` - the LM is back; after the cooldown a probe closes the
+  breaker and the LM answers again.
+
+During the outage and the brownout each conversation must still end with a
+confirmation card with the expected fields, and the pending report must be
+stored by the same submit path the postback uses. ``StubLM`` only reads
+marked place names, so completion is not checked in the LM phases. Turn
+latency is reported per phase. The deadlines are scaled down (``--timeout-ms``)
+so the run takes seconds.
+
+    python bench/llm_outage_bench.py --conversations 20 --slow-lm-ms 5000
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import percentiles, save_results, use_project_paths  # noqa: E402
+
+# (user turns, final state fields that must be filled in); all complete without the LM
+CONVERSATIONS = [
+    (["น้ำท่วมบ้านชั้น 2 ติดอยู่ 3 คน ต.ลำผักกูด อ.ธัญบุรี จ.ปทุมธานี"],
+     {"province": "ปทุมธานี", "district": "ธัญบุรี", "subdistrict": "ลำผักกูด", "urgency_level": "Critical"}),
+    (["น้ำท่วมสูงมาก ไม่มีอาหาร ผู้สูงอายุ 2 คน", "ปทุมธานี", "ธัญบุรี", "ตำบลประชาธิปัตย์"],
+     {"province": "ปทุมธานี", "district": "ธัญบุรี", "subdistrict": "ประชาธิปัตย์", "urgency_level": "High"}),
+    (["อยู่ที่ อ.บางบัวทอง นนทบุรี น้ำท่วมถนนขาด ซอย 5", "ตำบลพิมลราช"],
+     {"province": "นนทบุรี", "district": "บางบัวทอง", "subdistrict": "พิมลราช"}),
+    (["เขตดอนเมือง แขวงสีกัน กทม น้ำท่วมไฟดับ หมู่ 3"],
+     {"province": "กรุงเทพมหานคร", "district": "ดอนเมือง", "subdistrict": "สีกัน"}),
+]
+
+
+def setup(workdir: Path, args):
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'outage.db'}"
+    use_project_paths()
+    import dspy
+    import llm_guard
+    import llm_qa
+    from stubs import StubLM, install_redis, make_redis
+
+    dspy.disable_logging()
+    # One warning per fallback; the per-phase summary has the counts
+    logging.getLogger("llm_guard").setLevel(logging.ERROR)
+    install_redis(make_redis("fake"))
+    timeout = args.timeout_ms / 1000
+    llm_guard.TIMEOUTS.update(router=timeout, extractor=timeout, asker=timeout)
+    llm_guard.LLM_SLOW_CALL_SECONDS = timeout * 0.8
+    llm_guard.breaker = llm_guard.CircuitBreaker(cooldown=args.cooldown_ms / 1000)
+    lm = StubLM(latency_ms=args.lm_latency_ms)
+    dspy.configure(lm=lm)
+    return llm_qa, llm_guard, lm
+
+
+def run_conversation(llm_qa, user_id: str, turns: list[str], expected: dict, degraded: bool) -> list[float]:
+    import insert_report
+    import pending_reports
+
+    latencies = []
+    response = None
+    for text in turns:
+        started = time.perf_counter()
+        response = llm_qa.DisasterBot(user_id).forward(text)
+        latencies.append((time.perf_counter() - started) * 1000)
+    if not degraded:
+        return latencies
+    assert response["type"] == "flex", (turns, response)
+    state = llm_qa.DisasterBot(user_id).messages[-1]
+    for field, value in expected.items():
+        assert state[field] == value, (field, state)
+
+    # The submit postback: claim the pending report by its token and store it
+    data = re.search(r"action=submit[^\"]*", json.dumps(response["message"].to_dict())).group(0)
+    token = pending_reports.parse_postback_data(data)["id"]
+    status, pending = pending_reports.claim_pending(token, user_id)
+    assert status == pending_reports.SUBMITTED, status
+    report = insert_report.insert_db(message_id=f"m-{user_id}", province=pending["province"],
+                                     district=pending["district"], sub_district=pending["subdistrict"],
+                                     address=pending["address_details"], content=pending["raw_content"],
+                                     urgency=pending["urgency_level"], reporter_line_id=user_id)
+    assert report is not None
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=20, help="conversations per phase")
+    parser.add_argument("--lm-latency-ms", type=float, default=20.0)
+    parser.add_argument("--slow-lm-ms", type=float, default=5000.0, help="LM latency during the brownout")
+    parser.add_argument("--timeout-ms", type=float, default=200.0, help="per-signature deadline")
+    parser.add_argument("--cooldown-ms", type=float, default=500.0, help="breaker cooldown")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="flood-outage-") as tmp:
+        llm_qa, llm_guard, lm = setup(Path(tmp), args)
+
+        def phase(name: str, degraded: bool = False):
+            calls_before = {k: v for k, v in llm_guard.llm_calls.values.items()}
+            fallbacks_before = sum(llm_guard.llm_fallbacks.values.values())
+            states, latencies = set(), []
+            for i in range(args.conversations):
+                turns, expected = CONVERSATIONS[i % len(CONVERSATIONS)]
+                latencies += run_conversation(llm_qa, f"U{name}{i:04d}", turns, expected, degraded)
+                states.add(llm_guard.breaker.state)
+            outcomes = {dict(k)["outcome"]: 0 for k in llm_guard.llm_calls.values}
+            for key, value in llm_guard.llm_calls.values.items():
+                outcomes[dict(key)["outcome"]] += value - calls_before.get(key, 0)
+            results[name] = {
+                "turn_ms": percentiles(latencies),
+                "lm_calls": {k: int(v) for k, v in outcomes.items() if v},
+                "fallbacks": int(sum(llm_guard.llm_fallbacks.values.values()) - fallbacks_before),
+                "breaker_states_seen": sorted(states),
+                "breaker_state_after": llm_guard.breaker.state,
+            }
+            r = results[name]
+            print(f"{name:10s} turn p50 {r['turn_ms']['p50']}ms p99 {r['turn_ms']['p99']}ms max {r['turn_ms']['max']}ms  "
+                  f"fallbacks {r['fallbacks']:4d}  breaker {r['breaker_state_after']:9s} calls {r['lm_calls']}")
+            return r
+
+        healthy = phase("healthy")
+        assert healthy["fallbacks"] == 0 and healthy["breaker_state_after"] == "closed"
+
+        lm.failure = ConnectionError("provider unavailable")
+        outage = phase("outage", degraded=True)
+        assert outage["breaker_state_after"] == "open" and outage["lm_calls"].get("rejected", 0) > 0
+
+        # Let the cooldown pass so the brownout starts with a half-open probe against the slow LM
+        lm.failure = None
+        lm.latency_ms = args.slow_lm_ms
+        time.sleep(args.cooldown_ms / 1000)
+        brownout = phase("brownout", degraded=True)
+        assert brownout["breaker_state_after"] == "open"
+        # No turn waits for the slow LM: at most one deadline per signature call
+        assert brownout["turn_ms"]["max"] < 3 * args.timeout_ms + 200, brownout["turn_ms"]
+
+        lm.latency_ms = args.lm_latency_ms
+        time.sleep(args.cooldown_ms / 1000)
+        recovered = phase("recovered")
+        assert recovered["breaker_state_after"] == "closed" and recovered["lm_calls"].get("ok", 0) > 0
+
+    print(f"saved {save_results('llm_outage', {'config': {k: str(v) for k, v in vars(args).items()}, 'results': results})}")
+
+
+if __name__ == "__main__":
+    main()
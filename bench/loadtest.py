@@ -0,0 +1,191 @@
+"""End-to-end load test of the FastAPI app against local stand-ins.
+
+LINE is replaced by ``StubLineServer``, Gemini by ``StubLM``, Redis by fakeredis
+(or a local server) and Postgres by SQLite (or the database in DATABASE_URL /
+POSTGRES_*). Realistic ``WebhookPayload`` traffic is posted to the app
+in-process and events/sec plus p50/p95/p99 per endpoint and per stage (from
+the ``stage`` log records) are reported and saved under ``bench/results``.
+
+    python bench/loadtest.py --events 500 --concurrency 16 --lm-latency-ms 400
+    python bench/loadtest.py --compare bench/results/loadtest-A.json bench/results/loadtest-B.json
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import compare_results, percentiles, print_comparison, save_results, use_project_paths  # noqa: E402
+
+BENCH_CHANNEL_SECRET = "bench-channel-secret"
+
+
+def sign(body: bytes) -> str:
+    digest = hmac.new(BENCH_CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+class StageCollector(logging.Handler):
+    """Collects ``duration_ms`` from the records emitted by ``logging_setup.stage``."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.durations = defaultdict(list)
+
+    def emit(self, record):
+        stage = getattr(record, "stage", None)
+        if stage is not None:
+            self.durations[stage].append(record.duration_ms)
+
+
+def build_app(args, workdir: Path, line_url: str):
+    """Configure the environment for local stand-ins, import the app and patch its clients."""
+    os.environ.update({
+        "LINE_API_HOST": line_url,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-access-token",
+        "LINE_CHANNEL_SECRET": BENCH_CHANNEL_SECRET,
+        "GEMINI_API_KEY": "bench",
+        "DOMAIN": "http://bench.local",
+        "DATA_DIR": str(workdir / "data"),
+        "LOG_LEVEL": "INFO",
+        "COALESCE_WINDOW": str(args.coalesce_window),
+        "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+    })
+    if args.db == "sqlite":
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'loadtest.db'}"
+    use_project_paths()
+    # handle_image writes to ./data relative to the working directory
+    (workdir / "data").mkdir(exist_ok=True)
+    os.chdir(workdir)
+
+    from logging_setup import setup_logging
+    setup_logging(stream=open(os.devnull, "w"))
+    collector = StageCollector()
+    logging.getLogger().addHandler(collector)
+
+    from api.main import app
+    import dspy
+    import auth
+    import pending_reports
+    from login_model import Profile, UserInfo
+    from stubs import StubLM, install_redis, make_redis
+
+    dspy.disable_logging()
+    install_redis(make_redis(args.redis))
+    lm = StubLM(latency_ms=args.lm_latency_ms, jitter_ms=args.lm_jitter_ms)
+    dspy.configure(lm=lm)
+
+    users = [f"Ubench{i:028x}" for i in range(args.users)]
+    for user_id in users:
+        auth.add_user(UserInfo(profile=Profile(userId=user_id, displayName=f"bench {user_id[-4:]}")))
+
+    def postback_data(user_id):
+        state = {"province": "ปทุมธานี", "district": "ธัญบุรี", "subdistrict": "ลำผักกูด", "address_details": "ซอย 5",
+                 "raw_content": "น้ำท่วมชั้น 2 ไฟดับ", "urgency_level": "High", "step": "complete"}
+        return pending_reports.submit_postback_data(pending_reports.save_pending(user_id, state))
+
+    return app, users, lm, collector, postback_data
+
+
+async def drive(app, traffic, events: int, concurrency: int):
+    import httpx
+
+    latencies = defaultdict(list)
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def post(kind, body):
+                raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                headers = {"Content-Type": "application/json", "X-Line-Signature": sign(raw)}
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/line/webhook", content=raw, headers=headers)
+                    latencies[f"POST /line/webhook [{kind}]"].append((time.perf_counter() - start) * 1000)
+                    statuses[f"{kind}:{response.status_code}"] += 1
+
+            async def health():
+                start = time.perf_counter()
+                await client.get("/health")
+                latencies["GET /health"].append((time.perf_counter() - start) * 1000)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(kind, body) for kind, body in itertools.islice(traffic, events)),
+                                 *(health() for _ in range(max(1, events // 20))))
+            wall = time.perf_counter() - started
+    return wall, latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--lm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--lm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--line-latency-ms", type=float, default=30.0)
+    parser.add_argument("--coalesce-window", type=float, default=0.0,
+                        help="COALESCE_WINDOW seconds (0 keeps one turn per text; see bench/coalesce_bench.py)")
+    parser.add_argument("--redis", choices=["fake", "local"], default="fake")
+    parser.add_argument("--db", choices=["sqlite", "env"], default="sqlite",
+                        help="sqlite: throwaway SQLite file; env: DATABASE_URL / POSTGRES_* (local Postgres)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", type=Path, default=None, help="results directory (default bench/results)")
+    parser.add_argument("--baseline", type=Path, help="compare this run against a previous results file")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="only compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        print_comparison(compare_results(*args.compare))
+        return
+
+    from stubs import StubLineServer
+    from traffic import TrafficGenerator
+
+    out_dir = (args.out or Path(__file__).resolve().parent / "results").resolve()
+    baseline = args.baseline.resolve() if args.baseline else None
+    with tempfile.TemporaryDirectory(prefix="flood-loadtest-") as tmp, \
+            StubLineServer(latency_ms=args.line_latency_ms) as line:
+        app, users, lm, collector, postback_data = build_app(args, Path(tmp), line.url)
+        traffic = iter(TrafficGenerator(users, image_base_url=line.url, postback_data=postback_data, seed=args.seed))
+        wall, latencies, statuses = asyncio.run(drive(app, traffic, args.events, args.concurrency))
+
+    results = {
+        "config": {k: str(v) for k, v in vars(args).items() if k not in ("compare", "baseline", "out")},
+        "events": args.events,
+        "wall_seconds": round(wall, 3),
+        "events_per_sec": round(args.events / wall, 2),
+        "endpoints_ms": {name: percentiles(samples) for name, samples in sorted(latencies.items())},
+        "stages_ms": {name: percentiles(samples) for name, samples in sorted(collector.durations.items())},
+        "line_api_requests": dict(line.requests),
+        "lm": {"calls": lm.calls, "prompt_tokens": lm.prompt_tokens},
+        "statuses": dict(statuses),
+    }
+    path = save_results("loadtest", results, out_dir)
+
+    print(f"{args.events} events in {wall:.2f}s -> {results['events_per_sec']} events/sec")
+    for section in ("endpoints_ms", "stages_ms"):
+        print(f"\n{section}")
+        for name, stats in results[section].items():
+            print(f"  {name:<44} n={stats['count']:<5} p50={stats.get('p50')} p95={stats.get('p95')} p99={stats.get('p99')}")
+    print(f"\nLM calls: {lm.calls}, prompt tokens: {lm.prompt_tokens}")
+    print(f"saved {path}")
+    if baseline:
+        print(f"\ncompared with {baseline}")
+        print_comparison(compare_results(baseline, path))
+
+
+if __name__ == "__main__":
+    main()
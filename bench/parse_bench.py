@@ -0,0 +1,107 @@
+"""Microbenchmark of webhook payload parsing and signature verification.
+
+Compares, per event mix:
+  legacy_dict   plain ``Union`` models (the previous definitions) validated from ``json.loads``
+  tagged_dict   the discriminated models validated from ``json.loads`` (what FastAPI did with a body model)
+  tagged_json   the discriminated models validated straight from raw bytes (the webhook path)
+and times X-Line-Signature verification over the same bytes.
+
+    python bench/parse_bench.py --payloads 2000
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import List, Union
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import save_results, use_project_paths  # noqa: E402
+
+use_project_paths()
+from pydantic import create_model  # noqa: E402
+
+import line_webhook as lw  # noqa: E402
+import traffic  # noqa: E402
+
+
+def legacy_payload_model():
+    """The pre-discriminator models: smart-mode unions tried member by member."""
+    message_union = Union[lw.TextMessageContent, lw.ImageMessageContent, lw.StickerMessageContent,
+                          lw.LocationMessageContent, lw.MessageContent]
+    legacy_message_event = create_model("LegacyMessageEvent", __base__=lw.BaseEvent,
+                                        type=(lw.Literal["message"], ...), replyToken=(str, ...),
+                                        message=(message_union, ...))
+    event_union = Union[legacy_message_event, lw.FollowEvent, lw.UnfollowEvent, lw.JoinEvent, lw.LeaveEvent,
+                        lw.PostbackEvent, lw.BeaconEvent, lw.BaseEvent]
+    return create_model("LegacyWebhookPayload", destination=(str, ...), events=(List[event_union], ...))
+
+
+def unsend_event(user_id: str) -> dict:
+    event = traffic._base_event("unsend", user_id)
+    event["unsend"] = {"messageId": str(uuid.uuid4().int)[:18]}
+    return event
+
+
+def build_mixes(n: int) -> dict[str, list[bytes]]:
+    users = [f"U{uuid.uuid4().hex}" for _ in range(20)]
+    generator = iter(traffic.TrafficGenerator(users, seed=11))
+
+    def encode(events):
+        return json.dumps(traffic.payload(events), ensure_ascii=False).encode("utf-8")
+
+    return {
+        "text_only": [encode([traffic.text_event(users[i % 20], traffic.TEXTS[i % len(traffic.TEXTS)])])
+                      for i in range(n)],
+        "realistic_mix": [encode(next(generator)[1]["events"]) for _ in range(n)],
+        "batched_5": [encode([next(generator)[1]["events"][0] for _ in range(5)]) for _ in range(n // 5 or 1)],
+        "unknown_types": [encode([unsend_event(users[i % 20]), traffic.follow_event(users[i % 20])])
+                          for i in range(n)],
+    }
+
+
+def time_per_payload(fn, bodies: list[bytes], rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for body in bodies:
+            fn(body)
+        best = min(best, (time.perf_counter() - start) / len(bodies))
+    return round(best * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    legacy = legacy_payload_model()
+    tagged = lw.WebhookPayload
+    secret = os.getenv("LINE_CHANNEL_SECRET", "bench-channel-secret").encode()
+
+    def verify(body: bytes):
+        digest = hmac.new(secret, body, hashlib.sha256).digest()
+        return hmac.compare_digest(base64.b64encode(digest), base64.b64encode(digest))
+
+    results = {}
+    for mix, bodies in build_mixes(args.payloads).items():
+        row = {
+            "legacy_dict_us": time_per_payload(lambda b: legacy.model_validate(json.loads(b)), bodies, args.rounds),
+            "tagged_dict_us": time_per_payload(lambda b: tagged.model_validate(json.loads(b)), bodies, args.rounds),
+            "tagged_json_us": time_per_payload(tagged.model_validate_json, bodies, args.rounds),
+            "signature_us": time_per_payload(verify, bodies, args.rounds),
+        }
+        row["speedup_vs_legacy"] = round(row["legacy_dict_us"] / row["tagged_json_us"], 2)
+        results[mix] = row
+        print(f"{mix:<14} " + "  ".join(f"{k}={v}" for k, v in row.items()))
+    print(f"saved {save_results('parse', {'payloads': args.payloads, 'mixes_us_per_payload': results})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Recent-data queries and inserts as report history accumulates, then archival.
+
+Simulates ``--years`` of reports, oldest first, at ``--rows-per-month``. After
+each simulated year it measures three things at that year's "now":
+
+* ``recent_count`` - reports per province in the last ``--recent-days`` days;
+* ``recent_rows`` - the Critical reports of that window, as the export and
+  routing endpoints read them;
+* ``insert`` - single-report inserts, each in its own transaction like
+  ``insert_db``.
+
+With ``--db env`` (Postgres) this runs against the monthly-partitioned
+``reports`` table and an unpartitioned copy with the original schema
+(``reports_flat``). The benchmark asserts that the plan for recent queries
+touches at most two monthly partitions. Run there, it shows the partitioned
+latencies staying flat while the unpartitioned ones grow with history. SQLite
+has no partitioning, so the default run measures the unpartitioned table alone.
+
+Afterwards every month older than ``--retention-months`` is archived with
+``report_partitions.archive_expired``. The Parquet files must hold exactly
+the rows that left the database, and recent queries must return the same
+results as before.
+
+    python bench/partition_bench.py --db env --reset --years 5 --rows-per-month 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import percentiles, save_results, use_project_paths  # noqa: E402
+
+PROVINCES = [("ปทุมธานี", "ธัญบุรี", "ลำผักกูด"), ("อุบลราชธานี", "วารินชำราบ", "ธาตุ"),
+             ("สงขลา", "หาดใหญ่", "คอหงส์"), ("นครราชสีมา", "เมืองนครราชสีมา", "ในเมือง"),
+             ("นนทบุรี", "บางบัวทอง", "พิมลราช"), ("เชียงใหม่", "เมืองเชียงใหม่", "ช้างคลาน")]
+CONTENT = ["น้ำท่วมชั้น 2 ไฟดับหมดเลย มีผู้สูงอายุติดอยู่ในบ้าน", "น้ำสูงประมาณเอว รถเข้าไม่ได้",
+           "ถนนหน้าหมู่บ้านน้ำท่วมขัง ต้องการเรือ", "น้ำเข้าบ้านแล้ว ขนของขึ้นที่สูงไม่ทัน"]
+URGENCY = ["Low", "Medium", "High", "Critical"]
+
+
+class Seeder:
+    def __init__(self):
+        self.rng = random.Random(5)
+        self.next_id = 1
+
+    def row(self, timestamp: datetime) -> dict:
+        province, district, sub_district = self.rng.choice(PROVINCES)
+        i = self.next_id
+        self.next_id += 1
+        return {"id": i, "message_id": f"p{i}", "reporter_line_id": f"U{i:032x}", "province": province,
+                "district": district, "sub_district": sub_district, "address": f"ซอย {i % 120} หมู่ {i % 12}",
+                "content": self.rng.choice(CONTENT), "urgency": self.rng.choice(URGENCY), "timestamp": timestamp,
+                "latitude": 14.0 + self.rng.random(), "longitude": 100.5 + self.rng.random()}
+
+
+def flat_table(insert_report):
+    """``reports`` as ``create_all`` makes it, under another name (Postgres baseline)."""
+    from sqlalchemy import MetaData
+
+    table = insert_report.Report.__table__.to_metadata(MetaData(), name="reports_flat")
+    for index in table.indexes:
+        index.name = index.name.replace("ix_reports_", "ix_reports_flat_")
+    table.create(insert_report.engine, checkfirst=True)
+    return table
+
+
+def seed_months(insert_report, tables, seeder: Seeder, months: list[datetime], rows_per_month: int, end: datetime,
+                batch: int = 20_000):
+    for month in months:
+        span = (min(end, next_month(month)) - month).total_seconds()
+        values = [seeder.row(month + timedelta(seconds=span * i / rows_per_month)) for i in range(rows_per_month)]
+        for start in range(0, len(values), batch):
+            with insert_report.engine.begin() as conn:
+                for table in tables.values():
+                    conn.execute(table.insert(), values[start:start + batch])
+
+
+def next_month(month: datetime) -> datetime:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def recent_statements(table, since: datetime):
+    from sqlalchemy import func, select
+
+    count = (select(table.c.province, func.count()).where(table.c.timestamp >= since)
+             .group_by(table.c.province).order_by(table.c.province))
+    rows = (select(table.c.id, table.c.latitude, table.c.longitude, table.c.content)
+            .where(table.c.timestamp >= since, table.c.urgency == "Critical").order_by(table.c.id))
+    return {"recent_count": count, "recent_rows": rows}
+
+
+def measure(insert_report, tables, seeder: Seeder, now: datetime, args) -> dict:
+    since = now - timedelta(days=args.recent_days)
+    results = {}
+    for name, table in tables.items():
+        entry = {}
+        for query, stmt in recent_statements(table, since).items():
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                with insert_report.engine.connect() as conn:
+                    conn.execute(stmt).all()
+                samples.append((time.perf_counter() - started) * 1000)
+            entry[query] = percentiles(samples)
+        samples = []
+        for _ in range(args.inserts):
+            row = seeder.row(now)
+            started = time.perf_counter()
+            with insert_report.engine.begin() as conn:
+                conn.execute(table.insert(), row)
+            samples.append((time.perf_counter() - started) * 1000)
+        entry["insert"] = percentiles(samples)
+        results[name] = entry
+    return results
+
+
+def partitions_in_plan(insert_report, stmt) -> set[str]:
+    import re
+
+    compiled = stmt.compile(insert_report.engine)
+    with insert_report.engine.connect() as conn:
+        plan = "\n".join(r[0] for r in conn.exec_driver_sql("EXPLAIN " + str(compiled), compiled.params))
+    return set(re.findall(r"\breports_\d{4}_\d{2}\b", plan))
+
+
+def recent_results(insert_report, table, since: datetime) -> dict:
+    with insert_report.engine.connect() as conn:
+        return {name: conn.execute(stmt).all() for name, stmt in recent_statements(table, since).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--rows-per-month", type=int, default=20_000)
+    parser.add_argument("--recent-days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per recent query")
+    parser.add_argument("--inserts", type=int, default=200, help="single-row inserts timed per table and year")
+    parser.add_argument("--retention-months", type=int, default=12)
+    parser.add_argument("--db", choices=["sqlite", "env"], default="sqlite")
+    parser.add_argument("--reset", action="store_true", help="empty reports (and reports_flat) first on Postgres")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="flood-partitions-") as tmp:
+        if args.db == "sqlite":
+            os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp) / 'partitions.db'}"
+        os.environ["REPORT_ARCHIVE_DIR"] = str(Path(tmp) / "archive")
+        use_project_paths()
+        import insert_report
+        import report_partitions
+        from sqlalchemy import func, select, text
+
+        engine = insert_report.engine
+        postgres = report_partitions.partitioned()
+        if args.db == "env" and not postgres:
+            sys.exit("--db env needs Postgres with a partitioned reports table (python python/report_partitions.py migrate)")
+        reports = insert_report.Report.__table__
+        with engine.begin() as conn:
+            if postgres and args.reset:
+                conn.execute(text("DROP TABLE IF EXISTS reports_flat"))
+                conn.execute(text("TRUNCATE reports"))
+            if conn.execute(select(func.count()).select_from(reports)).scalar():
+                sys.exit("reports is not empty; rerun with --reset on a scratch database")
+        tables = {"partitioned": reports, "flat": flat_table(insert_report)} if postgres else {"flat": reports}
+
+        # insert_db stamps every report when it is stored, not when the module was imported
+        first = insert_report.insert_db("ts-1", "ปทุมธานี", "ธัญบุรี", "ลำผักกูด", "", "ทดสอบ", "Low")
+        time.sleep(0.05)
+        second = insert_report.insert_db("ts-2", "ปทุมธานี", "ธัญบุรี", "ลำผักกูด", "", "ทดสอบ", "Low")
+        assert second.timestamp > first.timestamp and abs(datetime.utcnow() - second.timestamp) < timedelta(minutes=1)
+        with engine.begin() as conn:
+            conn.execute(reports.delete().where(reports.c.message_id.in_(["ts-1", "ts-2"])))
+
+        end = datetime.utcnow()
+        current = end.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        months = [current]
+        for _ in range(args.years * 12 - 1):
+            months.insert(0, (months[0] - timedelta(days=1)).replace(day=1))
+        if postgres:
+            report_partitions.ensure_partitions(months[0], end)
+
+        seeder = Seeder()
+        history = []
+        for year in range(args.years):
+            year_months = months[year * 12:(year + 1) * 12]
+            started = time.perf_counter()
+            seed_months(insert_report, tables, seeder, year_months, args.rows_per_month, end)
+            now = min(end, next_month(year_months[-1]) - timedelta(seconds=1))
+            if postgres:
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    for table in tables.values():
+                        conn.exec_driver_sql(f"ANALYZE {table.name}")
+                for stmt in recent_statements(reports, now - timedelta(days=args.recent_days)).values():
+                    touched = partitions_in_plan(insert_report, stmt)
+                    assert 1 <= len(touched) <= 2, touched
+            results = measure(insert_report, tables, seeder, now, args)
+            history.append({"year": year + 1, "rows": seeder.next_id - 1, "results": results})
+            line = "  ".join(f"{name} count {r['recent_count']['p50']:7.1f}ms rows {r['recent_rows']['p50']:7.1f}ms "
+                             f"insert {r['insert']['p50']:5.2f}ms" for name, r in results.items())
+            print(f"year {year + 1}: {seeder.next_id - 1:9,d} rows/table (seeded in "
+                  f"{time.perf_counter() - started:5.1f}s)  {line}")
+
+        growth = {name: {query: round(history[-1]["results"][name][query]["p50"]
+                                      / max(history[0]["results"][name][query]["p50"], 1e-6), 2)
+                         for query in ("recent_count", "recent_rows", "insert")} for name in tables}
+        print(f"p50 growth, year {args.years} / year 1: {growth}")
+
+        # Archive everything older than the retention window
+        since = end - timedelta(days=args.recent_days)
+        before = recent_results(insert_report, reports, since)
+        with engine.connect() as conn:
+            total_before = conn.execute(select(func.count()).select_from(reports)).scalar()
+        started = time.perf_counter()
+        archived = report_partitions.archive_expired(args.retention_months)
+        archive_seconds = time.perf_counter() - started
+        with engine.connect() as conn:
+            total_after = conn.execute(select(func.count()).select_from(reports)).scalar()
+            oldest = conn.execute(select(func.min(reports.c.timestamp))).scalar()
+        cutoff = report_partitions.add_months(report_partitions.month_start(end), -args.retention_months)
+        archived_rows = sum(a["rows"] for a in archived)
+        assert archived and archived_rows == total_before - total_after, (archived_rows, total_before, total_after)
+        assert oldest.date() >= cutoff, (oldest, cutoff)
+        assert recent_results(insert_report, reports, since) == before
+        if postgres:
+            assert all(month >= cutoff for month in report_partitions.partitions())
+
+        import pyarrow.parquet as pq
+        sample = pq.read_table(archived[0]["path"])
+        assert sample.num_rows == archived[0]["rows"] and "reporter_line_id" in sample.column_names
+        archive_bytes = sum(a["bytes"] for a in archived)
+        print(f"archived {len(archived)} months, {archived_rows:,} rows in {archive_seconds:.1f}s "
+              f"to {archive_bytes / 1e6:.1f} MB of Parquet; {total_after:,} rows remain")
+
+        if postgres:
+            with engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS reports_flat"))
+
+    config = {"db": engine.dialect.name, "partitioned": postgres, **{k: v for k, v in vars(args).items() if k != "db"}}
+    archive = {"months": len(archived), "rows": archived_rows, "bytes": archive_bytes,
+               "seconds": round(archive_seconds, 2), "rows_remaining": total_after}
+    print(f"saved {save_results('partitions', {'config': config, 'history': history, 'growth': growth, 'archive': archive})}")
+
+
+if __name__ == "__main__":
+    main()
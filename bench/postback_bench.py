@@ -0,0 +1,122 @@
+"""Parse/submit microbenchmark for the SUBMIT postback, with hostile-content checks.
+
+``legacy`` is the previous scheme: the whole report packed into the postback
+``data`` and re-parsed with ``split()``. ``token`` is the pending-report store:
+``parse_qs`` of ``action=submit&id=<token>`` plus an O(1) Redis claim.
+
+Before timing, every hostile sample (``&``, ``=``, ``%``, ``#``, newlines, emoji,
+very long text) is round-tripped through both schemes. The token scheme must
+return the exact state and keep ``data`` under LINE's 300-character limit.
+
+    python bench/postback_bench.py --iterations 20000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import save_results, use_project_paths  # noqa: E402
+
+LINE_POSTBACK_DATA_LIMIT = 300
+
+HOSTILE_CONTENT = [
+    "น้ำท่วมชั้น 2 ไฟดับหมดเลย",
+    "น้ำสูง 1.5 ม. & ไฟดับ & มีคนติด 3 คน",
+    "content=ปลอม&urgency=Low",
+    "ระดับน้ำ=เอว, ถนน=ปิด",
+    "100% จมน้ำ #ช่วยด้วย ?ด่วน",
+    "บรรทัดแรก\nบรรทัดสอง\r\nบรรทัดสาม",
+    "🚨🌊🏠 ช่วยด้วยค่ะ 🙏",
+    "action=cancel&id=someone-else",
+    "ยาวมาก " * 400,
+]
+
+
+def legacy_data(state: dict) -> str:
+    return (f"action=submit&province={state['province']}&dis={state['district']}&sub={state['subdistrict']}"
+            f"&addr={state['address_details']}&content={state['raw_content']}&urgency={state['urgency_level']}")
+
+
+def legacy_parse(data: str) -> dict:
+    return {
+        'province': data.split("province=")[1].split("&")[0] if "province=" in data else "",
+        'district': data.split("dis=")[1].split("&")[0] if "dis=" in data else "",
+        'subdistrict': data.split("sub=")[1].split("&")[0] if "sub=" in data else "",
+        'address_details': data.split("addr=")[1].split("&")[0] if "addr=" in data else "",
+        'raw_content': data.split("content=")[1].split("&")[0] if "content=" in data else "",
+        'urgency_level': data.split("urgency=")[1].split("&")[0] if "urgency=" in data else "",
+    }
+
+
+def make_state(content: str) -> dict:
+    return {"province": "ปทุมธานี", "district": "ธัญบุรี", "subdistrict": "ลำผักกูด",
+            "address_details": "ตรงข้ามวัด & ร้าน 7=11", "raw_content": content, "urgency_level": "Critical",
+            "step": "complete", "last_bot_question": None}
+
+
+def check_hostile(pending_reports) -> dict:
+    legacy_broken = 0
+    legacy_too_long = 0
+    for i, content in enumerate(HOSTILE_CONTENT):
+        state = make_state(content)
+        user_id = f"Uhostile{i}"
+
+        data = legacy_data(state)
+        legacy_too_long += len(data) > LINE_POSTBACK_DATA_LIMIT
+        parsed = legacy_parse(data)
+        legacy_broken += any(parsed[k] != state[k] for k in parsed)
+
+        data = pending_reports.submit_postback_data(pending_reports.save_pending(user_id, state))
+        assert len(data) <= LINE_POSTBACK_DATA_LIMIT, data
+        params = pending_reports.parse_postback_data(data)
+        assert params["action"] == "submit"
+        status, claimed = pending_reports.claim_pending(params["id"], user_id)
+        assert status == pending_reports.SUBMITTED and claimed == state, (status, content)
+        assert pending_reports.claim_pending(params["id"], user_id)[0] == pending_reports.DUPLICATE
+        assert pending_reports.claim_pending(params["id"], "Uintruder")[0] == pending_reports.FORBIDDEN
+    assert pending_reports.claim_pending("does-not-exist", "U")[0] == pending_reports.EXPIRED
+    return {"samples": len(HOSTILE_CONTENT), "legacy_corrupted": legacy_broken, "legacy_over_limit": legacy_too_long}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--redis", choices=["fake", "local"], default="fake")
+    args = parser.parse_args()
+
+    use_project_paths()
+    import pending_reports
+    from stubs import make_redis
+    pending_reports.redis_client = make_redis(args.redis)
+
+    checks = check_hostile(pending_reports)
+    print(f"hostile content: {checks}")
+
+    state = make_state(HOSTILE_CONTENT[1])
+    data = legacy_data(state)
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        legacy_parse(data)
+    legacy_us = (time.perf_counter() - start) / args.iterations * 1e6
+
+    tokens = [pending_reports.submit_postback_data(pending_reports.save_pending("Ubench", state))
+              for _ in range(args.iterations)]
+    start = time.perf_counter()
+    for data in tokens:
+        pending_reports.parse_postback_data(data)
+    parse_us = (time.perf_counter() - start) / args.iterations * 1e6
+    start = time.perf_counter()
+    for data in tokens:
+        pending_reports.claim_pending(pending_reports.parse_postback_data(data)["id"], "Ubench")
+    submit_us = (time.perf_counter() - start) / args.iterations * 1e6
+
+    results = {"iterations": args.iterations, "redis": args.redis, "hostile": checks,
+               "legacy_parse_us": round(legacy_us, 2), "token_parse_us": round(parse_us, 2),
+               "token_parse_and_claim_us": round(submit_us, 2)}
+    print(f"legacy parse {legacy_us:.2f}us | token parse {parse_us:.2f}us | token parse+claim {submit_us:.2f}us")
+    print(f"saved {save_results('postback', results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Redis round trips per webhook event, and what they cost at a given network RTT.
+
+Runs text messages (with coalescing off and on) and SUBMIT postbacks through
+the webhook one at a time, each from a different user so that no turn waits
+on another, and counts every command or pipeline sent to Redis. Each round
+trip is charged ``--rtt-ms`` of simulated network latency, which fakeredis
+does not have. Round trips made synchronously on the event-loop thread are
+counted separately, because they stall every other request on the worker.
+
+The counting works on any revision of the tree, so the "before" numbers in
+``bench/baselines/redis_roundtrips.json`` come from this script run on the
+commit before the shared connection layer.
+
+    python bench/redis_roundtrips.py --events 40 --rtt-ms 1
+    python bench/redis_roundtrips.py --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+from argparse import Namespace
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import bench_dir, percentiles, save_results  # noqa: E402
+from loadtest import build_app, sign  # noqa: E402
+from stubs import StubLineServer  # noqa: E402
+from traffic import payload, postback_event, text_event  # noqa: E402
+
+baseline_path = bench_dir / "baselines" / "redis_roundtrips.json"
+
+
+class RoundTrips:
+    """Patch redis-py (sync and asyncio) to count round trips and add a simulated RTT to each."""
+
+    def __init__(self, rtt_ms: float):
+        self.rtt = rtt_ms / 1000
+        self.counts = Counter()
+        self.loop_thread = threading.main_thread()
+        self._lock = threading.Lock()
+
+    def _record(self, kind: str):
+        on_loop = threading.current_thread() is self.loop_thread and kind == "sync"
+        with self._lock:
+            self.counts["total"] += 1
+            self.counts[kind] += 1
+            self.counts["blocking_event_loop"] += on_loop
+
+    def install(self):
+        import redis
+        import redis.asyncio
+        import redis.asyncio.client
+        import redis.client
+
+        tracker = self
+
+        def wrap_sync(original):
+            def wrapper(*args, **kwargs):
+                tracker._record("sync")
+                time.sleep(tracker.rtt)
+                return original(*args, **kwargs)
+            return wrapper
+
+        def wrap_async(original):
+            async def wrapper(*args, **kwargs):
+                tracker._record("async")
+                await asyncio.sleep(tracker.rtt)
+                return await original(*args, **kwargs)
+            return wrapper
+
+        redis.Redis.execute_command = wrap_sync(redis.Redis.execute_command)
+        redis.client.Pipeline.execute = wrap_sync(redis.client.Pipeline.execute)
+        redis.asyncio.Redis.execute_command = wrap_async(redis.asyncio.Redis.execute_command)
+        redis.asyncio.client.Pipeline.execute = wrap_async(redis.asyncio.client.Pipeline.execute)
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.counts)
+
+
+async def run_scenarios(app, scenarios, tracker: RoundTrips) -> dict:
+    import httpx
+    import message_coalescer
+
+    used = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for name, window, events in scenarios:
+                message_coalescer.COALESCE_WINDOW = window
+                # Startup work (flood zones, templates) and earlier scenarios are not counted
+                before = tracker.snapshot()
+                latencies = []
+                for event in events:
+                    raw = json.dumps(payload([event]), ensure_ascii=False).encode("utf-8")
+                    started = time.perf_counter()
+                    response = await client.post("/line/webhook", content=raw, headers={
+                        "Content-Type": "application/json", "X-Line-Signature": sign(raw)})
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code == 200, response.text
+                counts = tracker.snapshot()
+                counts.subtract(before)
+                used[name] = (counts, latencies)
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=40, help="events per scenario")
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="simulated network round trip to Redis")
+    parser.add_argument("--coalesce-window", type=float, default=0.05,
+                        help="window for the coalescing scenario (short, it is pure waiting)")
+    parser.add_argument("--baseline", type=Path, default=baseline_path)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    tracker = RoundTrips(args.rtt_ms)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="flood-redis-rt-") as tmp, StubLineServer() as line:
+        app_args = Namespace(db="sqlite", redis="fake", lm_latency_ms=0.0, lm_jitter_ms=0.0,
+                             users=args.events * 3, coalesce_window=0.0)
+        app, users, _, _, postback_data = build_app(app_args, Path(tmp), line.url)
+        tracker.install()
+        scenarios = [
+            ("text", 0.0, [text_event(u, "น้ำท่วมชั้น 2 ที่ปทุมธานี") for u in users[:args.events]]),
+            ("text_coalescing", args.coalesce_window,
+             [text_event(u, "น้ำท่วมชั้น 2 ที่ปทุมธานี") for u in users[args.events:2 * args.events]]),
+            # Postback data is prepared (a pending report saved) before counting starts
+            ("postback_submit", 0.0, [postback_event(u, postback_data(u)) for u in users[2 * args.events:]]),
+        ]
+        for name, (used, latencies) in asyncio.run(run_scenarios(app, scenarios, tracker)).items():
+            events = args.events
+            results[name] = {
+                "round_trips_per_event": round(used["total"] / events, 2),
+                "blocking_event_loop_per_event": round(used["blocking_event_loop"] / events, 2),
+                "async_per_event": round(used["async"] / events, 2),
+                "webhook_ms": percentiles(latencies),
+            }
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    print(f"rtt {args.rtt_ms}ms; round trips per event (on the event loop), webhook p50")
+    for name, r in results.items():
+        base = baseline.get(name)
+        before = (f"  before {base['round_trips_per_event']:>5} ({base['blocking_event_loop_per_event']}) "
+                  f"p50 {base['webhook_ms']['p50']}ms" if base else "")
+        print(f"{name:16s} {r['round_trips_per_event']:>5} ({r['blocking_event_loop_per_event']}) "
+              f"p50 {r['webhook_ms']['p50']}ms{before}")
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"baseline updated: {args.baseline}")
+    print(f"saved {save_results('redis_roundtrips', {'config': {k: str(v) for k, v in vars(args).items()}, 'results': results})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Deterministic replay of recorded Thai conversations through ``DisasterBot.forward``.
+
+Each file in ``bench/conversations`` holds the user turns of one conversation
+and the LM completions recorded for every signature call in that turn.
+``ReplayLM`` serves those completions back in order, so a run is offline and
+deterministic; prompt or merge-logic changes (``_merge_content``,
+``_has_value``) show up as different turn counts, LM calls, prompt tokens,
+final states or wall time. Results are compared with ``bench/baselines/replay.json``.
+
+    python bench/replay.py                     # replay and compare with the baseline
+    python bench/replay.py --update-baseline   # accept the current numbers
+    python bench/replay.py --record conv.json  # re-record a conversation with the real LM
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import bench_dir, save_results, use_project_paths  # noqa: E402
+
+conversations_dir = bench_dir / "conversations"
+baseline_path = bench_dir / "baselines" / "replay.json"
+
+# metric -> allowed relative increase before it is flagged
+TOLERANCES = {
+    "turns_to_complete": 0.0,
+    "lm_calls": 0.0,
+    "prompt_tokens": 0.05,
+    "wall_ms": 0.25,
+}
+# metric -> absolute increase that is never flagged; stub runs take a few ms, so
+# scheduler noise alone would otherwise exceed the relative wall-time tolerance
+MIN_INCREASE = {
+    "wall_ms": 50,
+}
+
+_OUTPUT_FIELDS = re.compile(r"Your output fields are:\n(.*?)\nAll interactions", re.S)
+_FIELD_NAME = re.compile(r"^\d+\. `(\w+)`", re.M)
+
+
+def signature_key(messages: list[dict]) -> str:
+    """Identify a signature call by its output fields (``reasoning`` excluded so Predict/CoT match)."""
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    block = _OUTPUT_FIELDS.search(system)
+    fields = _FIELD_NAME.findall(block.group(1)) if block else []
+    return ",".join(f for f in fields if f != "reasoning")
+
+
+def prompt_tokens(messages: list[dict]) -> int:
+    # Approximation (characters / 4); only compared against itself across runs.
+    return sum(len(m["content"]) for m in messages) // 4
+
+
+def _response(text: str, tokens: int, model: str):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text, tool_calls=None), finish_reason="stop")],
+        usage={"prompt_tokens": tokens, "completion_tokens": len(text) // 4, "total_tokens": tokens + len(text) // 4},
+        model=model,
+    )
+
+
+def _make_lms():
+    import dspy
+
+    class ReplayLM(dspy.BaseLM):
+        """Serves recorded completions per signature for the current turn."""
+
+        def __init__(self):
+            super().__init__(model="replay/disasterbot", cache=False)
+            self.queues: dict[str, list[str]] = {}
+            self.calls = 0
+            self.prompt_tokens = 0
+            self.unrecorded = []
+
+        def start_turn(self, recorded: list[dict]):
+            self.queues = {}
+            for call in recorded:
+                self.queues.setdefault(call["signature"], []).append(call["completion"])
+
+        def forward(self, prompt=None, messages=None, **kwargs):
+            messages = messages or [{"role": "user", "content": prompt}]
+            key = signature_key(messages)
+            tokens = prompt_tokens(messages)
+            self.calls += 1
+            self.prompt_tokens += tokens
+            queue = self.queues.get(key)
+            if queue:
+                return _response(queue.pop(0), tokens, self.model)
+            # The code under test made a call that was never recorded: answer
+            # with empty fields and report it, rather than aborting the replay.
+            self.unrecorded.append(key)
+            text = "".join(f"[[ ## {f} ## ]]\nNone\n\n" for f in key.split(",")) + "[[ ## completed ## ]]"
+            return _response(text, tokens, self.model)
+
+    class RecordingLM(dspy.BaseLM):
+        """Wraps a real LM and keeps every completion with its signature key."""
+
+        def __init__(self, inner):
+            super().__init__(model=inner.model, cache=False)
+            self.inner = inner
+            self.recorded: list[dict] = []
+
+        def forward(self, prompt=None, messages=None, **kwargs):
+            response = self.inner.forward(prompt=prompt, messages=messages, **kwargs)
+            self.recorded.append({"signature": signature_key(messages or []),
+                                  "completion": response.choices[0].message.content})
+            return response
+
+    return ReplayLM, RecordingLM
+
+
+def setup(workdir: Path):
+    os.environ.setdefault("GEMINI_API_KEY", "replay")
+    os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'replay.db'}"
+    use_project_paths()
+    import dspy
+    import llm_qa
+    import pending_reports
+    from stubs import make_redis
+
+    dspy.disable_logging()
+    llm_qa.redis_client = pending_reports.redis_client = make_redis("fake")
+    return llm_qa
+
+
+def replay_conversation(llm_qa, lm, conversation: dict) -> dict:
+    import dspy
+
+    user_id = f"Ureplay-{conversation['id']}"
+    llm_qa.redis_client.delete(f"user:{user_id}:messages")
+    calls_before, tokens_before = lm.calls, lm.prompt_tokens
+    turns_to_complete = None
+    wall = 0.0
+    with dspy.context(lm=lm):
+        for index, turn in enumerate(conversation["turns"], start=1):
+            lm.start_turn(turn["lm"])
+            start = time.perf_counter()
+            bot = llm_qa.DisasterBot(user_id)
+            response = bot.forward(turn["user"])
+            wall += time.perf_counter() - start
+            if response.get("type") == "flex" and turns_to_complete is None:
+                turns_to_complete = index
+    final_state = bot.messages[-1] if bot.messages else None
+    expected = conversation.get("expected_final_state")
+    state_matches = None
+    if expected is not None:
+        state_matches = final_state is not None and all(final_state.get(k) == v for k, v in expected.items())
+    return {
+        "turns": len(conversation["turns"]),
+        "turns_to_complete": turns_to_complete,
+        "lm_calls": lm.calls - calls_before,
+        "prompt_tokens": lm.prompt_tokens - tokens_before,
+        "wall_ms": round(wall * 1000, 3),
+        "final_state_matches": state_matches,
+    }
+
+
+def find_regressions(current: dict, baseline: dict) -> list[str]:
+    problems = []
+    for conv_id, metrics in current.items():
+        if metrics["final_state_matches"] is False:
+            problems.append(f"{conv_id}: final state differs from expected_final_state")
+        base = baseline.get(conv_id)
+        if base is None:
+            continue
+        if base.get("turns_to_complete") is not None and metrics["turns_to_complete"] is None:
+            problems.append(f"{conv_id}: no longer completes (baseline {base['turns_to_complete']} turns)")
+        for metric, tolerance in TOLERANCES.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            if new - old > max(tolerance * old, MIN_INCREASE.get(metric, 0)):
+                problems.append(f"{conv_id}: {metric} {old} -> {new} (+{(new - old) / old:.0%})")
+    return problems
+
+
+def record(path: Path):
+    """Run the user turns of ``path`` against the configured LM and store its completions."""
+    conversation = json.loads(path.read_text())
+    with tempfile.TemporaryDirectory(prefix="flood-replay-") as tmp:
+        llm_qa = setup(Path(tmp))
+        import dspy
+        _, RecordingLM = _make_lms()
+        recorder = RecordingLM(llm_qa.lm)
+        user_id = f"Urecord-{conversation['id']}"
+        with dspy.context(lm=recorder):
+            for turn in conversation["turns"]:
+                recorder.recorded = []
+                llm_qa.DisasterBot(user_id).forward(turn["user"])
+                turn["lm"] = recorder.recorded
+    path.write_text(json.dumps(conversation, indent=2, ensure_ascii=False) + "\n")
+    print(f"recorded {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=Path, default=conversations_dir)
+    parser.add_argument("--baseline", type=Path, default=baseline_path)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5, help="replays per conversation; wall time is the median")
+    parser.add_argument("--record", type=Path, help="re-record one conversation file with the real LM")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record.resolve())
+        return
+
+    files = sorted(args.conversations.resolve().glob("*.json"))
+    baseline_file = args.baseline.resolve()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="flood-replay-") as tmp:
+        llm_qa = setup(Path(tmp))
+        ReplayLM, _ = _make_lms()
+        lm = ReplayLM()
+        for path in files:
+            conversation = json.loads(path.read_text())
+            runs = [replay_conversation(llm_qa, lm, conversation) for _ in range(args.repeat)]
+            result = runs[0]
+            result["wall_ms"] = sorted(r["wall_ms"] for r in runs)[len(runs) // 2]
+            results[conversation["id"]] = result
+        unrecorded = sorted(set(lm.unrecorded))
+
+    totals = {
+        "lm_calls": sum(r["lm_calls"] for r in results.values()),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in results.values()),
+        "wall_ms": round(sum(r["wall_ms"] for r in results.values()), 3),
+    }
+    for conv_id, r in results.items():
+        print(f"{conv_id:<28} turns_to_complete={r['turns_to_complete']} lm_calls={r['lm_calls']} "
+              f"prompt_tokens={r['prompt_tokens']} wall_ms={r['wall_ms']} state_ok={r['final_state_matches']}")
+    print(f"total lm_calls={totals['lm_calls']} prompt_tokens={totals['prompt_tokens']} wall_ms={totals['wall_ms']}")
+    if unrecorded:
+        print(f"WARNING: calls with no recorded response for signatures: {unrecorded}")
+    save_results("replay", {"conversations": results, "totals": totals, "unrecorded_signatures": unrecorded})
+
+    if args.update_baseline:
+        baseline_file.parent.mkdir(parents=True, exist_ok=True)
+        baseline_file.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n")
+        print(f"baseline updated: {baseline_file}")
+        return
+    if not baseline_file.exists():
+        print("no baseline yet; run with --update-baseline")
+        return
+    problems = find_regressions(results, json.loads(baseline_file.read_text()))
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if problems:
+        sys.exit(1)
+    print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
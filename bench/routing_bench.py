@@ -0,0 +1,194 @@
+"""Nearest-facility routing on a province-sized road graph.
+
+Builds a synthetic drivable network shaped like an osmnx graph (a jittered
+street grid around Pathum Thani: ``MultiDiGraph`` with node ``x``/``y`` and
+edge ``length`` in metres, some one-way streets and missing blocks), pickles
+it into a temporary ``GRAPH_DIR`` and measures:
+
+* cold load (unpickle + adjacency + nearest-node index) and cached load;
+* snapping reports and facilities to nodes;
+* ``nearest_facilities`` (one multi-source Dijkstra) against one networkx
+  single-source Dijkstra per facility, and against per-pair
+  ``nx.shortest_path_length`` on a sample of reports;
+* the same query with flooded roads blocked through Redis (fakeredis).
+
+Distances must equal the per-facility minimum from networkx in both
+directions, and blocking roads must never make any distance shorter.
+
+    python bench/routing_bench.py --grid 400 --reports 2000 --facilities 40
+"""
+import argparse
+import math
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import save_results, use_project_paths  # noqa: E402
+from stubs import make_redis  # noqa: E402
+
+ORIGIN = (13.95, 100.55)  # south-west corner, lat/lon
+SPACING_M = 120.0
+
+
+def synthetic_graph(size: int, seed: int = 3):
+    import networkx as nx
+
+    rng = random.Random(seed)
+    deg_lat = SPACING_M / 111_320
+    deg_lon = deg_lat / math.cos(math.radians(ORIGIN[0]))
+    graph = nx.MultiDiGraph(crs="epsg:4326")
+    node_id = lambda r, c: 1_000_000 + r * size + c  # noqa: E731  (OSM-like integer IDs)
+    for r in range(size):
+        for c in range(size):
+            graph.add_node(node_id(r, c), y=ORIGIN[0] + (r + rng.uniform(-0.3, 0.3)) * deg_lat,
+                           x=ORIGIN[1] + (c + rng.uniform(-0.3, 0.3)) * deg_lon)
+    from routing import haversine_m
+
+    for r in range(size):
+        for c in range(size):
+            for dr, dc in ((0, 1), (1, 0)):
+                if r + dr >= size or c + dc >= size or rng.random() < 0.08:
+                    continue  # missing block
+                u, v = node_id(r, c), node_id(r + dr, c + dc)
+                nu, nv = graph.nodes[u], graph.nodes[v]
+                length = float(haversine_m(nu["y"], nu["x"], nv["y"], nv["x"])) * rng.uniform(1.0, 1.3)
+                oneway = rng.random() < 0.1
+                graph.add_edge(u, v, length=length, oneway=oneway)
+                if not oneway:
+                    graph.add_edge(v, u, length=length, oneway=oneway)
+    return graph
+
+
+def random_points(rng, size: int, count: int):
+    deg_lat = SPACING_M / 111_320
+    deg_lon = deg_lat / math.cos(math.radians(ORIGIN[0]))
+    return [(ORIGIN[0] + rng.uniform(0, size - 1) * deg_lat, ORIGIN[1] + rng.uniform(0, size - 1) * deg_lon)
+            for _ in range(count)]
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def networkx_reference(graph, network, facility_nodes, target_nodes, reverse: bool):
+    """Per-facility networkx Dijkstra; min distance per target."""
+    import networkx as nx
+
+    search = graph.reverse(copy=False) if reverse else graph
+    best = [math.inf] * len(target_nodes)
+    for f in facility_nodes:
+        lengths = nx.single_source_dijkstra_path_length(search, network.node_ids[f], weight="length")
+        for i, t in enumerate(target_nodes):
+            best[i] = min(best[i], lengths.get(network.node_ids[t], math.inf))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", type=int, default=400, help="grid side; 400 gives 160k nodes, ~550k edges")
+    parser.add_argument("--reports", type=int, default=2000)
+    parser.add_argument("--facilities", type=int, default=40)
+    parser.add_argument("--pairwise-sample", type=int, default=3,
+                        help="reports routed with per-pair nx.shortest_path_length")
+    parser.add_argument("--blocked", type=int, default=2000, help="road segments blocked as flooded")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    use_project_paths()
+    with tempfile.TemporaryDirectory(prefix="flood-graphs-") as graph_dir:
+        os.environ["GRAPH_DIR"] = graph_dir
+        import networkx as nx
+        import routing
+
+        routing.GRAPH_DIR = Path(graph_dir)
+        routing.redis_client = make_redis("fake")
+        province = "ปทุมธานี"
+
+        graph, build_s = timed(synthetic_graph, args.grid)
+        with open(Path(graph_dir) / f"{province}.pkl", "wb") as f:
+            pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size_mb = os.path.getsize(Path(graph_dir) / f"{province}.pkl") / 1e6
+        print(f"graph: {graph.number_of_nodes():,} nodes, {graph.number_of_edges():,} edges, "
+              f"{size_mb:.1f} MB pickled (built in {build_s:.1f}s)")
+
+        network, cold_s = timed(routing.load_network, province)
+        _, cached_s = timed(routing.load_network, province)
+        print(f"load: cold {cold_s:.2f}s, cached {cached_s * 1e6:.1f}us")
+
+        rng = random.Random(args.seed)
+        facilities = random_points(rng, args.grid, args.facilities)
+        reports = random_points(rng, args.grid, args.reports)
+        (report_nodes, snap_m), snap_s = timed(network.nearest_nodes, *zip(*reports))
+        facility_nodes, _ = network.nearest_nodes(*zip(*facilities))
+        facility_nodes, report_nodes = [int(n) for n in facility_nodes], [int(n) for n in report_nodes]
+        print(f"snap: {len(reports):,} points in {snap_s * 1e3:.1f}ms, max snap {snap_m.max():.0f}m")
+
+        results = {"graph": {"nodes": graph.number_of_nodes(), "edges": graph.number_of_edges(),
+                             "pickle_mb": round(size_mb, 1)},
+                   "load_cold_s": round(cold_s, 3), "load_cached_us": round(cached_s * 1e6, 1),
+                   "snap_ms": round(snap_s * 1e3, 2)}
+        for direction in (routing.TO_REPORTS, routing.FROM_REPORTS):
+            reverse = direction == routing.FROM_REPORTS
+            network.multi_source_dijkstra(facility_nodes[:1], report_nodes[:1], reverse=reverse)  # reverse adjacency
+            answers, multi_s = timed(routing.nearest_facilities, province, facilities, reports, direction=direction)
+            reference, per_facility_s = timed(networkx_reference, graph, network, facility_nodes, report_nodes,
+                                              reverse)
+            for answer, expected in zip(answers, reference):
+                if expected == math.inf:
+                    assert answer is None, (answer, expected)
+                else:
+                    assert answer is not None and abs(answer["distance_m"] - expected) < 0.1, (answer, expected)
+
+            sample = report_nodes[:args.pairwise_sample]
+            started = time.perf_counter()
+            for t in sample:
+                for f in facility_nodes:
+                    src, dst = (network.node_ids[t], network.node_ids[f]) if reverse else \
+                        (network.node_ids[f], network.node_ids[t])
+                    try:
+                        nx.shortest_path_length(graph, src, dst, weight="length")
+                    except nx.NetworkXNoPath:
+                        pass
+            pairwise_s = (time.perf_counter() - started) / len(sample) * len(report_nodes)
+
+            reachable = sum(a is not None for a in answers)
+            print(f"{direction:12s} multi-source {multi_s:.2f}s | nx per facility {per_facility_s:.1f}s "
+                  f"({per_facility_s / multi_s:.0f}x) | nx per pair ~{pairwise_s:.0f}s "
+                  f"({pairwise_s / multi_s:.0f}x, extrapolated from {len(sample)}) | reachable {reachable:,}")
+            results[direction] = {"multi_source_s": round(multi_s, 3), "nx_per_facility_s": round(per_facility_s, 2),
+                                  "nx_per_pair_s_est": round(pairwise_s, 1), "reachable": reachable}
+
+        # Flood the roads around a few reports and check nothing got shorter
+        baseline = routing.nearest_facilities(province, facilities, reports)
+        edges = list(graph.edges(keys=False))
+        flooded = rng.sample(edges, min(args.blocked, len(edges)))
+        routing.block_edges(province, flooded)
+        blocked_answers, blocked_s = timed(routing.nearest_facilities, province, facilities, reports)
+        longer = lost = 0
+        for before, after in zip(baseline, blocked_answers):
+            if before is None:
+                assert after is None
+            elif after is None:
+                lost += 1
+            else:
+                assert after["distance_m"] >= before["distance_m"] - 0.1, (before, after)
+                longer += after["distance_m"] > before["distance_m"] + 0.1
+        routing.unblock_edges(province, flooded)
+        assert not routing.blocked_edges(province)
+        print(f"blocked {len(flooded):,} segments: query {blocked_s:.2f}s, {longer} reports rerouted longer, "
+              f"{lost} cut off")
+        results["blocked"] = {"segments": len(flooded), "query_s": round(blocked_s, 3), "longer": longer,
+                              "cut_off": lost}
+
+    print(f"saved {save_results('routing', {'config': vars(args), 'results': results})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Report search latency: trigram-indexed search against an ILIKE scan.
+
+Seeds ``reports`` with varied synthetic Thai reports (SQLite by default, or
+the database in DATABASE_URL / POSTGRES_* with ``--db env``). Then it times a
+set of operator queries three ways:
+
+* ``scan`` - ``content ILIKE '%q%' OR address ILIKE '%q%'`` with index and
+  bitmap scans switched off for the transaction, i.e. what the table would
+  cost without the pg_trgm indexes;
+* ``exact`` - ``report_search.search(q, fuzzy=False)``;
+* ``fuzzy`` - ``report_search.search(q)``, substring plus word similarity.
+
+On Postgres each query is also checked:
+
+* the indexed substring match must count the same rows as the scan;
+* ``EXPLAIN`` of a selective search must use the trigram indexes;
+* misspelled queries must find reports through similarity alone.
+
+SQLite has no pg_trgm, so only the scan path and the ranking and filter
+plumbing run there.
+
+    python bench/search_bench.py --db env --rows 2000000 --repeat 20
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from common import percentiles, save_results, use_project_paths  # noqa: E402
+
+START = datetime(2025, 11, 1)
+PLACES = [("ปทุมธานี", "ธัญบุรี", "ลำผักกูด"), ("ปทุมธานี", "คลองหลวง", "คลองหนึ่ง"),
+          ("อุบลราชธานี", "วารินชำราบ", "ธาตุ"), ("สงขลา", "หาดใหญ่", "คอหงส์"),
+          ("นครราชสีมา", "เมืองนครราชสีมา", "ในเมือง"), ("นนทบุรี", "บางบัวทอง", "พิมลราช")]
+# 100 village names, about 1% of reports each: the selective queries
+VILLAGES = [f"หมู่บ้าน{a}{b}" for a in ["พฤกษา", "ชัย", "สิน", "เอื้อ", "บัว", "กรีน", "ศุภ", "ธนา", "ร่ม", "สุข"]
+            for b in ["ทรัพย์", "อาทร", "ทอง", "วิลล์", "ลัย", "ซิตี้", "ธานี", "นคร", "เย็น", "สันติ"]]
+STREETS = ["ถนนพหลโยธิน", "ถนนรังสิต-นครนายก", "ถนนเลียบคลองสาม", "ถนนกาญจนาภิเษก", "ถนนเพชรเกษม"]
+HAZARDS = ["น้ำท่วมชั้น 1", "น้ำท่วมสูงระดับเอว", "น้ำท่วมขังถนน", "น้ำเข้าบ้านแล้ว", "น้ำป่าไหลหลาก",
+           "ตลิ่งพัง", "ถนนขาด รถเข้าไม่ได้"]
+NEEDS = ["ไฟดับทั้งซอย", "ต้องการเรือ", "ไม่มีน้ำดื่ม", "อาหารหมด", "มีผู้สูงอายุติดอยู่", "มีผู้ป่วยติดเตียง",
+         "เด็กเล็ก 2 คน", "ขอถุงทราย", "สัตว์เลี้ยงติดอยู่", "ต้องการยา"]
+# (query, kind); misspellings only match through trigram similarity
+QUERIES = [("ไฟดับ", "substring"), ("ผู้ป่วยติดเตียง", "substring"), ("ต้องการเรือ", "substring"),
+           ("หมู่บ้านเอื้ออาทร", "substring"), ("หมู่บ้านร่มเย็น", "substring"),
+           ("ถนนเลียบคลองสาม", "substring"), ("ถุงทราย", "substring"),
+           ("หมู่บ้านเอื้ออาธร", "misspelled"), ("ผู้ป่วยติดเตีง", "misspelled"), ("ถนนกาญจนาพิเษก", "misspelled"),
+           ("ไม่มีคำนี้ในรายงาน", "absent")]
+URGENCY = ["Low", "Medium", "High", "Critical"]
+
+
+def seed(insert_report, rows: int, batch: int = 50_000):
+    from sqlalchemy import func, select
+
+    table = insert_report.Report.__table__
+    with insert_report.engine.begin() as conn:
+        existing = conn.execute(select(func.count()).select_from(table)).scalar()
+    if existing >= rows:
+        return existing
+    rng = random.Random(11)
+    started = time.perf_counter()
+    for offset in range(existing, rows, batch):
+        values = []
+        for i in range(offset, min(offset + batch, rows)):
+            province, district, sub_district = rng.choice(PLACES)
+            content = " ".join([rng.choice(HAZARDS), *rng.sample(NEEDS, rng.randint(1, 3))])
+            address = f"{rng.randint(1, 999)}/{rng.randint(1, 99)} {rng.choice(VILLAGES)} หมู่ {rng.randint(1, 12)} " \
+                      f"{rng.choice(STREETS)}"
+            values.append({"message_id": f"s{i}", "province": province, "district": district,
+                           "sub_district": sub_district, "address": address, "content": content,
+                           "urgency": rng.choice(URGENCY), "timestamp": START + timedelta(seconds=i)})
+        with insert_report.engine.begin() as conn:
+            conn.execute(table.insert(), values)
+        print(f"  seeded {offset + len(values):,}/{rows:,}", end="\r", flush=True)
+    if insert_report.engine.dialect.name == "postgresql":
+        with insert_report.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(f"ANALYZE {table.name}")
+    print(f"  seeded {rows - existing:,} rows in {time.perf_counter() - started:.1f}s")
+    return rows
+
+
+def timed(fn, repeat: int) -> tuple[list[float], object]:
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples, result
+
+
+def substring_count(insert_report, query: str, scan: bool) -> int:
+    """Rows matching ``ILIKE '%q%'``; ``scan`` forbids the trigram indexes for the transaction."""
+    from sqlalchemy import func, or_, select
+
+    table = insert_report.Report.__table__
+    pattern = f"%{query}%"
+    stmt = select(func.count()).select_from(table).where(or_(table.c.content.ilike(pattern),
+                                                             table.c.address.ilike(pattern)))
+    with insert_report.engine.begin() as conn:
+        if scan and insert_report.engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("SET LOCAL enable_bitmapscan = off")
+            conn.exec_driver_sql("SET LOCAL enable_indexscan = off")
+        return conn.execute(stmt).scalar()
+
+
+def plan(insert_report, report_search, query: str, fuzzy: bool) -> str:
+    from sqlalchemy import text
+
+    compiled = report_search.search_statement(query, fuzzy=fuzzy).compile(insert_report.engine)
+    with insert_report.engine.begin() as conn:
+        conn.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+                     {"t": str(report_search.SEARCH_SIMILARITY)})
+        return "\n".join(r[0] for r in conn.exec_driver_sql("EXPLAIN " + str(compiled), compiled.params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per query and method")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--selective", type=float, default=0.05,
+                        help="queries matching less than this share of rows must use the trigram indexes")
+    parser.add_argument("--db", choices=["sqlite", "env"], default="sqlite")
+    parser.add_argument("--db-file", type=Path, default=Path(tempfile.gettempdir()) / "flood-search-bench.db",
+                        help="SQLite file, reused between runs")
+    args = parser.parse_args()
+
+    if args.db == "sqlite":
+        os.environ["DATABASE_URL"] = f"sqlite:///{args.db_file}"
+    use_project_paths()
+    import insert_report
+    import report_search
+    from report_filter import ReportFilter
+
+    postgres = insert_report.engine.dialect.name == "postgresql"
+    rows = seed(insert_report, args.rows)
+    print(f"{insert_report.engine.dialect.name}, {rows:,} reports")
+
+    results = {}
+    for query, kind in QUERIES:
+        scan_ms, scan_count = timed(lambda: substring_count(insert_report, query, scan=True), args.repeat)
+        entry = {"kind": kind, "scan_matches": scan_count, "scan_ms": percentiles(scan_ms)}
+        if postgres:
+            assert substring_count(insert_report, query, scan=False) == scan_count, query
+            # A term in a large share of reports is rightly answered by a sequential scan
+            if scan_count < rows * args.selective:
+                for fuzzy in (False, True):
+                    text = plan(insert_report, report_search, query, fuzzy)
+                    assert "_trgm" in text, (query, fuzzy, text)
+            exact_ms, exact = timed(lambda: report_search.search(query, fuzzy=False, limit=args.limit), args.repeat)
+            fuzzy_ms, fuzzy_hits = timed(lambda: report_search.search(query, limit=args.limit), args.repeat)
+            entry.update(exact_ms=percentiles(exact_ms), fuzzy_ms=percentiles(fuzzy_ms),
+                         exact_hits=len(exact), fuzzy_hits=len(fuzzy_hits))
+            assert len(exact) == min(scan_count, args.limit), (query, len(exact), scan_count)
+            if kind == "misspelled":
+                assert scan_count == 0 and fuzzy_hits, (query, scan_count)
+            if kind == "substring":
+                # Substring hits outrank similarity-only hits
+                assert all(hit["score"] >= 1 for hit in fuzzy_hits[:len(exact)]), query
+            speedup = entry["scan_ms"]["p50"] / max(entry["exact_ms"]["p50"], 1e-6)
+            print(f"{query:22s} {kind:10s} matches {scan_count:8,d}  scan p50 {entry['scan_ms']['p50']:8.1f}ms  "
+                  f"exact p50 {entry['exact_ms']['p50']:7.1f}ms ({speedup:5.1f}x)  "
+                  f"fuzzy p50 {entry['fuzzy_ms']['p50']:7.1f}ms hits {len(fuzzy_hits)}")
+        else:
+            hits = report_search.search(query, limit=args.limit)
+            assert len(hits) == min(scan_count, args.limit), (query, len(hits), scan_count)
+            print(f"{query:22s} {kind:10s} matches {scan_count:8,d}  scan p50 {entry['scan_ms']['p50']:8.1f}ms")
+        results[query] = entry
+
+    # Filters narrow the search exactly like exports; newest first among equal scores
+    filters = ReportFilter(province="ปทุมธานี", urgency="Critical")
+    hits = report_search.search("ไฟดับ", filters, limit=args.limit)
+    assert hits and all(h["province"] == "ปทุมธานี" and h["urgency"] == "Critical" for h in hits)
+    assert "reporter_line_id" not in hits[0]
+    if not postgres:
+        assert [h["timestamp"] for h in hits] == sorted((h["timestamp"] for h in hits), reverse=True)
+
+    config = {"db": insert_report.engine.dialect.name, "rows": rows, "repeat": args.repeat, "limit": args.limit,
+              "similarity": report_search.SEARCH_SIMILARITY}
+    print(f"saved {save_results('search', {'config': config, 'results': results})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Local stand-ins for the external services used by the benchmarks.
+
+* ``StubLineServer`` - a threaded HTTP server answering the LINE Messaging API
+  reply/push endpoints and serving image content.
+* ``StubLM`` - a DSPy LM that answers every signature with rule-based Thai
+  values after a configurable latency, without any network calls.
+* ``make_redis`` - fakeredis (in-process) or a local Redis server.
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import dspy
+
+# JPEG-framed placeholder (SOI ... EOI); the app only stores the bytes
+IMAGE_BYTES = b"\xff\xd8\xff\xe0" + bytes(32 * 1024) + b"\xff\xd9"
+
+
+class StubLineServer:
+    """Minimal LINE Messaging API stand-in listening on 127.0.0.1."""
+
+    def __init__(self, latency_ms: float = 0.0, port: int = 0):
+        self.latency_ms = latency_ms
+        # Answer every reply with LINE's 400 for an expired/used token
+        self.reject_replies = False
+        self.requests = Counter()
+        self.bodies: list[dict] = []
+        # (perf_counter, path, body) for every POST, in arrival order
+        self.timeline: list[tuple[float, str, dict]] = []
+        self._last_id = 10**17
+        self._id_lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                stub._sleep()
+                stub.requests[f"POST {self.path}"] += 1
+                try:
+                    body = json.loads(raw or b"{}")
+                except ValueError:
+                    body = {}
+                stub.bodies.append(body)
+                stub.timeline.append((time.perf_counter(), self.path, body))
+                if self.path == "/v2/bot/message/reply" and stub.reject_replies:
+                    self._reply(400, json.dumps({"message": "Invalid reply token"}).encode())
+                elif self.path in ("/v2/bot/message/reply", "/v2/bot/message/push"):
+                    sent = [{"id": str(stub._next_id()), "quoteToken": "stub"} for _ in body.get("messages", [None])]
+                    self._reply(200, json.dumps({"sentMessages": sent}).encode())
+                else:
+                    self._reply(200, b"{}")
+
+            def do_GET(self):
+                stub._sleep()
+                stub.requests[f"GET {self.path.split('?')[0]}"] += 1
+                if self.path.startswith("/images/"):
+                    self._reply(200, IMAGE_BYTES, "image/jpeg")
+                else:
+                    self._reply(404, b"{}")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _next_id(self) -> int:
+        with self._id_lock:
+            self._last_id += 1
+            return self._last_id
+
+    def _sleep(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+_FIELD_HEADER = re.compile(r"\[\[ ## (\w+) ## \]\]\n(.*?)(?=\n\n\[\[ ## |\Z)", re.S)
+_OUTPUT_FIELDS = re.compile(r"Your output fields are:\n(.*?)\nAll interactions", re.S)
+_FIELD_NAME = re.compile(r"^\d+\. `(\w+)`", re.M)
+
+_LOCATION_PATTERNS = {
+    "province": re.compile(r"(?:จังหวัด|จ\.)\s*(\S+)"),
+    "district": re.compile(r"(?:อำเภอ|อ\.|เขต)\s*(\S+)"),
+    "subdistrict": re.compile(r"(?:ตำบล|ต\.|แขวง)\s*(\S+)"),
+}
+_CRITICAL_WORDS = ("ติดอยู่", "ช่วยด้วย", "จมน้ำ", "หมดสติ", "ด่วน")
+
+
+def _rule_based_answer(field: str, inputs: dict) -> str:
+    message = inputs.get("new_message", "")
+    if field == "reasoning":
+        return "stub"
+    if field == "intent":
+        return "remove_report" if ("ยกเลิก" in message or message.strip() == "Cancel") else "continue_report"
+    if field in _LOCATION_PATTERNS:
+        match = _LOCATION_PATTERNS[field].search(message)
+        return match.group(1) if match else "None"
+    if field == "content_update":
+        return message or "None"
+    if field == "urgency_update":
+        return "Critical" if any(word in message for word in _CRITICAL_WORDS) else "None"
+    if field == "question":
+        return f"กรุณาระบุ{inputs.get('missing_info', 'ข้อมูลเพิ่มเติม')}ค่ะ"
+    return "None"
+
+
+class StubLM(dspy.BaseLM):
+    """Offline DSPy LM: parses the ChatAdapter prompt and fills every output field.
+
+    ``latency_ms`` and ``jitter_ms`` simulate provider latency; ``calls`` and
+    ``prompt_tokens`` (approximated as characters / 4) are counted for reports.
+    Setting ``failure`` to an exception makes every call raise it (an outage).
+    A ``timeout`` passed by the caller is honoured like litellm does: a slower
+    answer raises ``TimeoutError`` after ``timeout`` seconds.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, answer=_rule_based_answer):
+        super().__init__(model="stub/disasterbot", cache=False)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.answer = answer
+        self.failure: Exception | None = None
+        self.calls = 0
+        self.prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = messages[-1]["content"]
+        fields_block = _OUTPUT_FIELDS.search(system)
+        fields = _FIELD_NAME.findall(fields_block.group(1)) if fields_block else []
+        inputs = {name: value.strip() for name, value in _FIELD_HEADER.findall(user)}
+
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        timeout = kwargs.get("timeout")
+        if timeout is not None and delay / 1000 > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"stub LM did not answer within {timeout}s")
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.failure is not None:
+            raise self.failure
+
+        text = "".join(f"[[ ## {f} ## ]]\n{self.answer(f, inputs)}\n\n" for f in fields) + "[[ ## completed ## ]]"
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text, tool_calls=None), finish_reason="stop")],
+            usage={"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                   "total_tokens": prompt_tokens + len(text) // 4},
+            model=self.model,
+        )
+
+
+def make_redis(kind: str = "fake"):
+    """``fake`` -> in-process fakeredis; ``local`` -> Redis at REDIS_HOST/REDIS_PORT/REDIS_DB."""
+    if kind == "fake":
+        try:
+            import fakeredis
+        except ImportError as e:
+            raise SystemExit("--redis fake needs `pip install 'fakeredis[lua]'` (or use --redis local)") from e
+        return fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+    import os
+    import redis
+    return redis.StrictRedis(host=os.getenv("REDIS_HOST", "localhost"),
+                             port=int(os.getenv("REDIS_PORT", "6379")),
+                             db=int(os.getenv("REDIS_DB", "0")))
+
+
+def make_async_redis(sync_client):
+    """asyncio client on the same data as ``sync_client`` (from ``make_redis``)."""
+    server = sync_client.connection_pool.connection_kwargs.get("server")
+    if server is not None:
+        import fakeredis
+        return fakeredis.aioredis.FakeRedis(server=server)
+    import redis.asyncio
+    return redis.asyncio.Redis(**{k: sync_client.connection_pool.connection_kwargs[k] for k in ("host", "port", "db")})
+
+
+def install_redis(sync_client):
+    """Point ``redis_connection`` and every module-level client at ``sync_client`` (and an async twin)."""
+    import redis_connection
+
+    async_client = make_async_redis(sync_client)
+    redis_connection._sync_client, redis_connection._async_client = sync_client, async_client
+    for name in ("auth", "llm_qa", "pending_reports", "message_coalescer", "flood_zones", "routing"):
+        module = sys.modules.get(name)
+        if module is not None:
+            module.redis_client = sync_client
+    if "auth" in sys.modules:
+        sys.modules["auth"].async_redis_client = async_client
+    return async_client
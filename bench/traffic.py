@@ -0,0 +1,136 @@
+"""Synthetic LINE webhook traffic shaped like real DisasterBot usage."""
+import random
+import time
+import uuid
+
+TEXTS = [
+    "น้ำท่วมบ้านค่ะ",
+    "จังหวัดปทุมธานี อำเภอธัญบุรี ตำบลลำผักกูด",
+    "ชั้น 2 ไฟดับหมดเลย",
+    "มีคนแก่ติดอยู่ในบ้าน ช่วยด้วย",
+    "ตรงข้ามวัดอัยยิการาม ซอย 5",
+    "น้ำสูงประมาณเอว รถเข้าไม่ได้",
+    "จังหวัดอุบลราชธานี อำเภอวารินชำราบ ตำบลธาตุ",
+    "ยกเลิก",
+]
+
+# name -> weight
+DEFAULT_MIX = {
+    "text": 0.50,
+    "group_text": 0.10,
+    "image": 0.10,
+    "location": 0.08,
+    "postback": 0.10,
+    "follow": 0.02,
+    "anonymous_text": 0.05,
+    "redelivery": 0.05,
+}
+
+
+def _base_event(kind: str, user_id: str, group_id: str | None = None, redelivery: bool = False) -> dict:
+    source = {"type": "group", "groupId": group_id, "userId": user_id} if group_id else {"type": "user", "userId": user_id}
+    return {
+        "type": kind,
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": source,
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": redelivery},
+    }
+
+
+def text_event(user_id: str, text: str, group_id: str | None = None) -> dict:
+    event = _base_event("message", user_id, group_id)
+    event["replyToken"] = uuid.uuid4().hex
+    event["message"] = {"id": str(random.randint(10**17, 10**18)), "type": "text", "text": text,
+                        "quoteToken": uuid.uuid4().hex}
+    return event
+
+
+def image_event(user_id: str, image_base_url: str) -> dict:
+    event = _base_event("message", user_id)
+    event["replyToken"] = uuid.uuid4().hex
+    message_id = str(random.randint(10**17, 10**18))
+    event["message"] = {"id": message_id, "type": "image", "quoteToken": uuid.uuid4().hex,
+                        "contentProvider": {"type": "external",
+                                            "originalContentUrl": f"{image_base_url}/images/{message_id}.jpg"}}
+    return event
+
+
+def location_event(user_id: str) -> dict:
+    event = _base_event("message", user_id)
+    event["replyToken"] = uuid.uuid4().hex
+    event["message"] = {"id": str(random.randint(10**17, 10**18)), "type": "location", "title": "ตำแหน่งของฉัน",
+                        "address": "ตำบลลำผักกูด อำเภอธัญบุรี ปทุมธานี",
+                        "latitude": 14.0208 + random.uniform(-0.05, 0.05),
+                        "longitude": 100.5204 + random.uniform(-0.05, 0.05)}
+    return event
+
+
+def postback_event(user_id: str, data: str) -> dict:
+    event = _base_event("postback", user_id)
+    event["replyToken"] = uuid.uuid4().hex
+    event["postback"] = {"data": data}
+    return event
+
+
+def follow_event(user_id: str) -> dict:
+    event = _base_event("follow", user_id)
+    event["replyToken"] = uuid.uuid4().hex
+    return event
+
+
+def payload(events: list[dict], destination: str = "Ubench") -> dict:
+    return {"destination": destination, "events": events}
+
+
+class TrafficGenerator:
+    """Yields ``(kind, payload_dict)`` pairs following ``mix``.
+
+    ``users`` are registered (logged-in) user IDs; ``anonymous_text`` events use
+    unknown IDs so the login prompt path is exercised. ``postback_data`` builds
+    the submit postback for a user.
+    """
+
+    def __init__(self, users: list[str], image_base_url: str = "http://127.0.0.1", mix: dict | None = None,
+                 postback_data=None, seed: int | None = None):
+        self.users = users
+        self.image_base_url = image_base_url
+        self.mix = mix or DEFAULT_MIX
+        self.postback_data = postback_data or (lambda user_id: "action=submit&id=unknown-token")
+        self.rng = random.Random(seed)
+        self.groups = [f"C{uuid.UUID(int=self.rng.getrandbits(128)).hex}" for _ in range(3)]
+        self.sent: list[dict] = []
+
+    def _event(self, kind: str) -> dict | None:
+        user = self.rng.choice(self.users)
+        if kind == "text":
+            return text_event(user, self.rng.choice(TEXTS))
+        if kind == "group_text":
+            return text_event(user, self.rng.choice(TEXTS), group_id=self.rng.choice(self.groups))
+        if kind == "image":
+            return image_event(user, self.image_base_url)
+        if kind == "location":
+            return location_event(user)
+        if kind == "postback":
+            return postback_event(user, self.postback_data(user))
+        if kind == "follow":
+            return follow_event(user)
+        if kind == "anonymous_text":
+            return text_event(f"Uanon{self.rng.getrandbits(64):x}", self.rng.choice(TEXTS))
+        return None
+
+    def __iter__(self):
+        kinds, weights = zip(*self.mix.items())
+        while True:
+            kind = self.rng.choices(kinds, weights)[0]
+            if kind == "redelivery":
+                if not self.sent:
+                    continue
+                original = self.rng.choice(self.sent)
+                event = {**original, "deliveryContext": {"isRedelivery": True}}
+            else:
+                event = self._event(kind)
+                self.sent.append(event)
+                del self.sent[:-200]
+            yield kind, payload([event])
@@ -1,5 +1,5 @@
-from typing import List, Optional, Union, Literal, Dict, Any
-from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional, Union, Literal, Dict, Any
+from pydantic import BaseModel, Discriminator, Field, Tag
 
 class DeliveryContext(BaseModel):
     isRedelivery: bool
@@ -59,6 +59,24 @@ class LocationMessageContent(MessageContent):
     latitude: float
     longitude: float
 
+def _type_tag(known: frozenset):
+    """Discriminator that routes on ``type`` and sends unknown types to the generic model."""
+    def tag(value) -> str:
+        type_ = value.get("type") if isinstance(value, dict) else getattr(value, "type", None)
+        return type_ if type_ in known else "other"
+    return tag
+
+AnyMessageContent = Annotated[
+    Union[
+        Annotated[TextMessageContent, Tag("text")],
+        Annotated[ImageMessageContent, Tag("image")],
+        Annotated[StickerMessageContent, Tag("sticker")],
+        Annotated[LocationMessageContent, Tag("location")],
+        Annotated[MessageContent, Tag("other")],  # video, audio, file, ...
+    ],
+    Discriminator(_type_tag(frozenset({"text", "image", "sticker", "location"}))),
+]
+
 class BaseEvent(BaseModel):
     type: str
     mode: Literal['active', 'standby']
@@ -70,7 +88,7 @@ class BaseEvent(BaseModel):
 class MessageEvent(BaseEvent):
     type: Literal['message']
     replyToken: str
-    message: Union[TextMessageContent, ImageMessageContent, StickerMessageContent, LocationMessageContent, MessageContent]
+    message: AnyMessageContent
 
 class FollowEvent(BaseEvent):
     type: Literal['follow']
@@ -105,6 +123,20 @@ class BeaconEvent(BaseEvent):
     replyToken: str
     beacon: Beacon
 
+AnyEvent = Annotated[
+    Union[
+        Annotated[MessageEvent, Tag("message")],
+        Annotated[FollowEvent, Tag("follow")],
+        Annotated[UnfollowEvent, Tag("unfollow")],
+        Annotated[JoinEvent, Tag("join")],
+        Annotated[LeaveEvent, Tag("leave")],
+        Annotated[PostbackEvent, Tag("postback")],
+        Annotated[BeaconEvent, Tag("beacon")],
+        Annotated[BaseEvent, Tag("other")],  # unsend, memberJoined, accountLink, ...
+    ],
+    Discriminator(_type_tag(frozenset({"message", "follow", "unfollow", "join", "leave", "postback", "beacon"}))),
+]
+
 class WebhookPayload(BaseModel):
     destination: str
-    events: List[Union[MessageEvent, FollowEvent, UnfollowEvent, JoinEvent, LeaveEvent, PostbackEvent, BeaconEvent, BaseEvent]]
+    events: List[AnyEvent]
@@ -0,0 +1,12 @@
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel
+
+class ReportFilter(BaseModel):
+    """Query parameters shared by every endpoint that selects reports."""
+    province: Optional[str] = None
+    district: Optional[str] = None
+    sub_district: Optional[str] = None
+    urgency: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
@@ -0,0 +1,17 @@
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel
+
+class ReportSearchResult(BaseModel):
+    """One search hit; reporter identity is never included."""
+    id: int
+    province: Optional[str] = None
+    district: Optional[str] = None
+    sub_district: Optional[str] = None
+    address: Optional[str] = None
+    content: Optional[str] = None
+    urgency: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    flood_zone_id: Optional[str] = None
+    flood_risk: Optional[float] = None
+    score: float
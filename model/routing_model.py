@@ -0,0 +1,32 @@
+from typing import List, Literal, Optional, Tuple
+from pydantic import BaseModel, Field
+
+from report_filter import ReportFilter
+
+class Facility(BaseModel):
+    id: str
+    latitude: float
+    longitude: float
+    name: Optional[str] = None
+
+class NearestFacilityRequest(BaseModel):
+    """Assign each matching report (with a shared location) to its nearest facility by road."""
+    province: str
+    facilities: List[Facility]
+    filters: ReportFilter = Field(default_factory=lambda: ReportFilter(urgency="Critical"))
+    direction: Literal["to_reports", "from_reports"] = "to_reports"
+    max_distance_m: Optional[float] = None
+    include_path: bool = False
+
+class FacilityAssignment(BaseModel):
+    report_id: int
+    facility_id: Optional[str] = None
+    distance_m: Optional[float] = None
+    snap_m: Optional[float] = None
+    path: Optional[List[Tuple[float, float]]] = None
+
+class BlockedEdgesRequest(BaseModel):
+    """Road segments as pairs of graph node IDs (OSM node IDs for osmnx graphs)."""
+    province: str
+    edges: List[Tuple[int, int]]
+    both_directions: bool = True
@@ -1,35 +1,65 @@
-import redis 
 from dotenv import load_dotenv
+import base64
+import hashlib
+import hmac
+import logging
 import os
 
 
 model_dir = os.getenv("MODEL_DIR", "python")
 os.sys.path.append(model_dir)
 from login_model import UserInfo, LoginSuccessResponse
+import redis_connection
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 
-
-REDIS_HOST =  os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_DB = int(os.getenv("REDIS_DB", 0))
-
-
-redis_client = redis.StrictRedis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=REDIS_DB
-)
+redis_client = redis_connection.sync_client()
+# Same pool settings, for lookups made directly on the event loop (the webhook)
+async_redis_client = redis_connection.async_client()
 
 
 def add_user(user_info: UserInfo):
     user_id = user_info.profile.userId if user_info.profile else user_info.email
     redis_client.set(user_id, user_info.json())
-    print(f"User {user_id} added to Redis.")
+    logger.info("user added")
     
 def get_user(user_id: str) -> UserInfo | None:
     user_data = redis_client.get(user_id)
-    print(f"Retrieved user data for {user_id}: {user_data}")
+    logger.debug("user lookup", extra={"hit": user_data is not None})
     if user_data:
         return UserInfo.parse_raw(user_data)
-    return None
\ No newline at end of file
+    return None
+
+
+async def get_user_async(user_id: str) -> UserInfo | None:
+    """``get_user`` without blocking the event loop."""
+    user_data = await async_redis_client.get(user_id)
+    logger.debug("user lookup", extra={"hit": user_data is not None})
+    if user_data:
+        return UserInfo.parse_raw(user_data)
+    return None
+
+
+def verify_line_signature(body: bytes, signature: str | None) -> bool:
+    """Check X-Line-Signature (base64 HMAC-SHA256 of the raw body with the channel secret)."""
+    channel_secret = os.getenv("LINE_CHANNEL_SECRET")
+    if not channel_secret:
+        logger.error("LINE_CHANNEL_SECRET not set; rejecting webhook")
+        return False
+    if not signature:
+        return False
+    digest = hmac.new(channel_secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode("utf-8"))
+
+
+def verify_api_token(authorization: str | None) -> bool:
+    """Check ``Authorization: Bearer <REPORTS_API_TOKEN>`` for the report data endpoints."""
+    api_token = os.getenv("REPORTS_API_TOKEN")
+    if not api_token:
+        logger.error("REPORTS_API_TOKEN not set; report data endpoints are disabled")
+        return False
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), api_token.encode("utf-8"))
@@ -0,0 +1,249 @@
+"""Rule-based stand-ins for the DisasterBot signatures, used while the LM is unavailable.
+
+``llm_guard.call`` falls back to these when Gemini is down, slow, or the
+breaker is open:
+
+* ``detect_intent`` - cancel keywords instead of ``IntentRouter``.
+* ``extract`` - ``FieldExtractor``'s fields from the message. It uses
+  markers (จังหวัด/จ., อำเภอ/อ./เขต, ตำบล/ต./แขวง), the 77 province names,
+  and the district/subdistrict gazetteer in ``GAZETTEER_PATH`` when present.
+  A short answer is taken as the field the previous question asked for.
+  Urgency comes from keywords.
+* ``next_question`` - fixed Thai questions instead of ``QuestionGenerator``.
+
+The gazetteer is a CSV with ``province,district,subdistrict`` columns (Thai
+names, one row per subdistrict), e.g. exported from the DOPA administrative
+code list. Without it, districts and subdistricts are only recognised after a
+marker or as a short answer.
+"""
+import csv
+import logging
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = Path(os.getenv("GAZETTEER_PATH") or Path(os.getenv("DATA_DIR", "data")) / "gazetteer.csv")
+
+PROVINCES = (
+    "กรุงเทพมหานคร", "กระบี่", "กาญจนบุรี", "กาฬสินธุ์", "กำแพงเพชร", "ขอนแก่น", "จันทบุรี", "ฉะเชิงเทรา",
+    "ชลบุรี", "ชัยนาท", "ชัยภูมิ", "ชุมพร", "เชียงราย", "เชียงใหม่", "ตรัง", "ตราด", "ตาก", "นครนายก",
+    "นครปฐม", "นครพนม", "นครราชสีมา", "นครศรีธรรมราช", "นครสวรรค์", "นนทบุรี", "นราธิวาส", "น่าน",
+    "บึงกาฬ", "บุรีรัมย์", "ปทุมธานี", "ประจวบคีรีขันธ์", "ปราจีนบุรี", "ปัตตานี", "พระนครศรีอยุธยา",
+    "พะเยา", "พังงา", "พัทลุง", "พิจิตร", "พิษณุโลก", "เพชรบุรี", "เพชรบูรณ์", "แพร่", "ภูเก็ต",
+    "มหาสารคาม", "มุกดาหาร", "แม่ฮ่องสอน", "ยโสธร", "ยะลา", "ร้อยเอ็ด", "ระนอง", "ระยอง", "ราชบุรี",
+    "ลพบุรี", "ลำปาง", "ลำพูน", "เลย", "ศรีสะเกษ", "สกลนคร", "สงขลา", "สตูล", "สมุทรปราการ",
+    "สมุทรสงคราม", "สมุทรสาคร", "สระแก้ว", "สระบุรี", "สิงห์บุรี", "สุโขทัย", "สุพรรณบุรี",
+    "สุราษฎร์ธานี", "สุรินทร์", "หนองคาย", "หนองบัวลำภู", "อ่างทอง", "อำนาจเจริญ", "อุดรธานี",
+    "อุตรดิตถ์", "อุทัยธานี", "อุบลราชธานี",
+)
+PROVINCE_ALIASES = {
+    "กรุงเทพ": "กรุงเทพมหานคร", "กทม": "กรุงเทพมหานคร", "กทม.": "กรุงเทพมหานคร", "bangkok": "กรุงเทพมหานคร",
+    "อยุธยา": "พระนครศรีอยุธยา", "โคราช": "นครราชสีมา",
+}
+# Province names that are also everyday words ("เลย" = at all, "ตาก" = to dry, "แพร่" = to spread);
+# only taken after a marker or as a whole answer
+AMBIGUOUS_NAMES = {"เลย", "ตาก", "แพร่"}
+
+_MARKER = r"จังหวัด|จ\.|อำเภอ|อ\.|เขต|ตำบล|ต\.|แขวง"
+# Thai is written without spaces, so a name runs until the next marker, a space or punctuation
+_NAME = rf"\s*(\S+?)(?=(?:{_MARKER})|[\s,]|$)"
+MARKED_FIELDS = {
+    "province": re.compile(rf"(?:จังหวัด|จ\.){_NAME}"),
+    "district": re.compile(rf"(?:อำเภอ|อ\.|เขต){_NAME}"),
+    "subdistrict": re.compile(rf"(?:ตำบล|ต\.|แขวง){_NAME}"),
+}
+ADDRESS_PARTS = re.compile(r"(?:บ้านเลขที่|เลขที่|หมู่ที่|หมู่บ้าน|หมู่|ม\.|ซอย|ซ\.|ถนน(?!ขาด)|ถ\.)\s*[^\s,]+")
+LEADING_MARKER = re.compile(rf"^(?:{_MARKER})\s*")
+TRAILING_PARTICLES = re.compile(r"(?:ค่ะ|คะ|ครับ|นะ|จ้า|[\s,.!])+$")
+
+CANCEL_WORDS = ("ยกเลิก", "ไม่แจ้งแล้ว", "cancel")
+URGENCY_WORDS = [
+    ("Critical", ("ช่วยด้วย", "ติดอยู่", "ติดค้าง", "จมน้ำ", "หมดสติ", "บาดเจ็บ", "sos")),
+    ("High", ("ด่วน", "ผู้ป่วย", "ผู้สูงอายุ", "เด็กเล็ก", "คนท้อง", "ไม่มีอาหาร", "ไม่มีน้ำดื่ม", "ท่วมหลังคา",
+              "ชั้น 2", "ชั้นสอง", "ไฟดูด")),
+    ("Medium", ("น้ำท่วม", "น้ำขึ้น", "ไฟดับ", "ถนนขาด")),
+]
+
+QUESTIONS = {
+    "province": "กรุณาระบุจังหวัดที่เกิดเหตุค่ะ",
+    "district": "เหตุเกิดที่อำเภอ (หรือเขต) อะไรคะ",
+    "subdistrict": "เหตุเกิดที่ตำบล (หรือแขวง) อะไรคะ",
+    "content": "กรุณาเล่ารายละเอียดเหตุการณ์ เช่น ระดับน้ำ จำนวนคน และความช่วยเหลือที่ต้องการค่ะ",
+}
+# Keywords that tell which field a question (template or LM-written) asked for, most specific first
+QUESTION_FIELDS = [
+    ("subdistrict", ("ตำบล", "แขวง", "subdistrict")),
+    ("district", ("อำเภอ", "เขต", "district")),
+    ("province", ("จังหวัด", "province")),
+    ("content", ("รายละเอียด", "เหตุการณ์", "details")),
+]
+LOCATION_FIELDS = ("province", "district", "subdistrict")
+
+
+class Gazetteer:
+    """District and subdistrict names per province, for matching names written without a marker."""
+
+    def __init__(self, rows):
+        self.districts: dict[str, set[str]] = {}
+        self.subdistricts: dict[tuple[str, str], set[str]] = {}
+        self.district_provinces: dict[str, set[str]] = {}
+        self.subdistrict_places: dict[str, set[tuple[str, str]]] = {}
+        for row in rows:
+            province, district, subdistrict = (row.get(k, "").strip() for k in LOCATION_FIELDS)
+            if not (province and district):
+                continue
+            self.districts.setdefault(province, set()).add(district)
+            self.district_provinces.setdefault(district, set()).add(province)
+            if subdistrict:
+                self.subdistricts.setdefault((province, district), set()).add(subdistrict)
+                self.subdistrict_places.setdefault(subdistrict, set()).add((province, district))
+
+    def __len__(self):
+        return len(self.subdistrict_places)
+
+
+@lru_cache(maxsize=1)
+def load_gazetteer(path: Path = None) -> Gazetteer | None:
+    path = Path(path or GAZETTEER_PATH)
+    if not path.exists():
+        return None
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        gazetteer = Gazetteer(csv.DictReader(f))
+    logger.info("gazetteer loaded", extra={"path": str(path), "subdistricts": len(gazetteer)})
+    return gazetteer
+
+
+def _longest_in(text: str, names) -> str | None:
+    # Two-letter names would match inside ordinary words
+    found = [name for name in names if len(name) > 2 and name in text]
+    return max(found, key=len) if found else None
+
+
+def normalize_province(name: str | None) -> str | None:
+    if not name:
+        return None
+    name = name.strip().removeprefix("จังหวัด").removeprefix("จ.").strip()
+    if name in PROVINCES:
+        return name
+    return PROVINCE_ALIASES.get(name.lower(), name)
+
+
+def find_province(text: str) -> str | None:
+    """A province named anywhere in ``text`` (ambiguous names only as the whole text)."""
+    stripped = text.strip()
+    if normalize_province(stripped) in PROVINCES:
+        return normalize_province(stripped)
+    alias = _longest_in(text.lower(), PROVINCE_ALIASES)
+    name = _longest_in(text, (p for p in PROVINCES if p not in AMBIGUOUS_NAMES))
+    if name:
+        return name
+    return PROVINCE_ALIASES[alias] if alias else None
+
+
+def detect_intent(message: str) -> str:
+    text = message.strip().lower()
+    return "remove_report" if any(word in text for word in CANCEL_WORDS) else "continue_report"
+
+
+def classify_urgency(message: str) -> str | None:
+    text = message.lower()
+    for level, words in URGENCY_WORDS:
+        if any(word in text for word in words):
+            return level
+    return None
+
+
+def expected_field(question: str | None) -> str | None:
+    """Which field ``question`` asked for; used to read short answers such as "ธัญบุรี"."""
+    if not question:
+        return None
+    text = question.lower()
+    for field, words in QUESTION_FIELDS:
+        if any(word in text for word in words):
+            return field
+    return None
+
+
+def _is_short_answer(text: str) -> bool:
+    return len(text) <= 40 and len(text.split()) <= 3
+
+
+def _without_location(text: str, found: dict) -> str:
+    """What is left of ``text`` once the location names, markers and polite particles are removed."""
+    for name in sorted([*found.values(), *PROVINCE_ALIASES], key=len, reverse=True):
+        text = text.replace(name, "")
+    return re.sub(rf"{_MARKER}|ค่ะ|คะ|ครับ|นะ|ที่|[\s,.]", "", text)
+
+
+def _gazetteer_matches(text: str, found: dict, state: dict, gazetteer: Gazetteer):
+    province = found.get("province") or state.get("province")
+    if "district" not in found:
+        candidates = gazetteer.districts.get(province) if province else gazetteer.district_provinces
+        district = _longest_in(text, candidates or ())
+        if district:
+            found["district"] = district
+            if not province and len(gazetteer.district_provinces[district]) == 1:
+                found["province"] = province = next(iter(gazetteer.district_provinces[district]))
+    district = found.get("district") or state.get("district")
+    if "subdistrict" not in found:
+        candidates = (gazetteer.subdistricts.get((province, district)) if province and district
+                      else gazetteer.subdistrict_places)
+        subdistrict = _longest_in(text, candidates or ())
+        if subdistrict:
+            found["subdistrict"] = subdistrict
+            places = gazetteer.subdistrict_places[subdistrict]
+            if len(places) == 1:
+                place_province, place_district = next(iter(places))
+                found.setdefault("province", place_province)
+                found.setdefault("district", place_district)
+
+
+def extract(message: str, state: dict, previous_question: str | None) -> SimpleNamespace:
+    """``FieldExtractor``'s output fields from rules; absent fields are None, like the LM's "None"."""
+    text = message.strip()
+    found = {}
+    for field, pattern in MARKED_FIELDS.items():
+        match = pattern.search(text)
+        name = TRAILING_PARTICLES.sub("", match.group(1)) if match else ""
+        if name:
+            found[field] = name
+    if "province" in found:
+        found["province"] = normalize_province(found["province"])
+    else:
+        province = find_province(text)
+        if province:
+            found["province"] = province
+
+    gazetteer = load_gazetteer()
+    if gazetteer is not None:
+        _gazetteer_matches(text, found, state, gazetteer)
+
+    # "ธัญบุรี" in reply to "which district?" is that field, not incident details
+    asked = expected_field(previous_question)
+    if not found and asked in LOCATION_FIELDS and _is_short_answer(text) and not ADDRESS_PARTS.search(text):
+        value = TRAILING_PARTICLES.sub("", LEADING_MARKER.sub("", text))
+        if value:
+            found[asked] = normalize_province(value) if asked == "province" else value
+    answer_only = bool(found) and len(_without_location(text, found)) < 3
+
+    address = " ".join(ADDRESS_PARTS.findall(text)) or None
+    return SimpleNamespace(
+        province=found.get("province"),
+        district=found.get("district"),
+        subdistrict=found.get("subdistrict"),
+        address_details=address,
+        content_update=None if answer_only else text,
+        urgency_update=classify_urgency(text),
+    )
+
+
+def next_question(missing: list[str]) -> str:
+    """Fixed question for the first missing field (location before details, as ``QuestionGenerator`` does)."""
+    return QUESTIONS[missing[0]] if missing else ""
@@ -6,61 +6,250 @@ from linebot.v3.messaging import (
     QuickReplyItem,
     LocationAction
 )
+from functools import lru_cache
+import json
 import os
+import re
 
 import urllib.parse
 
+# LINE Messaging API limits
+ALT_TEXT_LIMIT = 400
+POSTBACK_DATA_LIMIT = 300
+URI_LIMIT = 1000
+BUBBLE_SIZE_LIMIT = 30_000  # bytes of JSON per bubble
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_CONTROL_CHARS = re.compile(r"[\x00-\x09\x0b-\x1f\x7f]")
+# Upper bound on UTF-8 bytes per character once JSON-escaped (control characters are stripped)
+_MAX_BYTES_PER_CHAR = 4
+
+
+class FlexTemplate:
+    """A Flex layout validated once; rendering only substitutes ``{field}`` placeholders.
+
+    The layout is parsed with ``FlexContainer.from_dict`` a single time. Every
+    string holding a placeholder becomes a slot, and the slot paths are merged
+    into one plan so ``render`` shallow-copies each object on those paths
+    exactly once and never re-validates. ``limits`` caps each field's length;
+    together they must keep the worst-case bubble under LINE's size limit,
+    which is checked here up front instead of measuring every message.
+    """
+
+    def __init__(self, name: str, layout: dict, alt_text: str, limits: dict[str, int]):
+        self.name = name
+        self.alt_text = alt_text
+        self.limits = limits
+        self.container = FlexContainer.from_dict(layout)
+        self.slots = list(self._find_slots(self.container, ()))
+        self.plan = self._build_plan(self.slots)
+
+        fields = {f for _, template in self.slots for f in _PLACEHOLDER.findall(template)}
+        missing = fields - limits.keys()
+        if missing:
+            raise ValueError(f"{name}: no length limit for fields {sorted(missing)}")
+        occurrences = {f: sum(_PLACEHOLDER.findall(t).count(f) for _, t in self.slots) for f in fields}
+        worst_case = len(json.dumps(layout, ensure_ascii=False).encode("utf-8")) + sum(
+            limits[f] * n * _MAX_BYTES_PER_CHAR for f, n in occurrences.items())
+        if worst_case > BUBBLE_SIZE_LIMIT:
+            raise ValueError(f"{name}: worst-case size {worst_case} bytes exceeds {BUBBLE_SIZE_LIMIT}")
+        self.fields = fields
+
+    @classmethod
+    def _find_slots(cls, node, path):
+        if isinstance(node, list):
+            for index, item in enumerate(node):
+                yield from cls._find_slots(item, path + (index,))
+        elif hasattr(node, "__fields__"):
+            for attr in node.__fields__:
+                yield from cls._find_slots(getattr(node, attr), path + (attr,))
+        elif isinstance(node, str) and _PLACEHOLDER.search(node):
+            yield path, node
+
+    @staticmethod
+    def _build_plan(slots) -> dict:
+        """Merge slot paths into a trie: step -> sub-plan, or the template string at a leaf."""
+        plan = {}
+        for path, template in slots:
+            node = plan
+            for step in path[:-1]:
+                node = node.setdefault(step, {})
+            node[path[-1]] = template
+        return plan
+
+    def _apply(self, node, plan: dict, values: dict):
+        updates = {}
+        for step, sub in plan.items():
+            if isinstance(sub, str):
+                updates[step] = self._substitute(step, sub, values)
+            else:
+                child = node[step] if isinstance(node, list) else getattr(node, step)
+                updates[step] = self._apply(child, sub, values)
+        if isinstance(node, list):
+            copied = list(node)
+            for index, value in updates.items():
+                copied[index] = value
+            return copied
+        # pydantic v1 shallow copy: the validated subtree is shared, not re-validated
+        return node.copy(update=updates)
+
+    def _clean(self, field: str, value) -> str:
+        text = _CONTROL_CHARS.sub(" ", str(value))
+        limit = self.limits[field]
+        return text if len(text) <= limit else text[:limit - 1] + "…"
+
+    def _substitute(self, attr: str, template: str, values: dict) -> str:
+        if attr == "uri" and _PLACEHOLDER.fullmatch(template):
+            rendered = values[_PLACEHOLDER.fullmatch(template).group(1)]
+            if urllib.parse.urlsplit(rendered).scheme not in ("http", "https", "line", "tel"):
+                raise ValueError(f"{self.name}: refusing uri {rendered!r}")
+        elif attr == "uri":
+            rendered = _PLACEHOLDER.sub(lambda m: urllib.parse.quote(values[m.group(1)], safe=""), template)
+        else:
+            rendered = _PLACEHOLDER.sub(lambda m: values[m.group(1)], template)
+        if attr == "data" and len(rendered) > POSTBACK_DATA_LIMIT:
+            raise ValueError(f"{self.name}: postback data longer than {POSTBACK_DATA_LIMIT} characters")
+        if attr == "uri" and len(rendered) > URI_LIMIT:
+            raise ValueError(f"{self.name}: uri longer than {URI_LIMIT} characters")
+        return rendered
+
+    def render(self, alt_text: str | None = None, **values) -> FlexMessage:
+        values = {field: self._clean(field, values.get(field)) for field in self.fields}
+        container = self._apply(self.container, self.plan, values)
+        alt_text = _CONTROL_CHARS.sub(" ", alt_text or self.alt_text)
+        if len(alt_text) > ALT_TEXT_LIMIT:
+            alt_text = alt_text[:ALT_TEXT_LIMIT - 1] + "…"
+        return FlexMessage(alt_text=alt_text, contents=container)
+
+
+LOGIN_TEMPLATE = FlexTemplate(
+    "login",
+    {
+        "type": "bubble",
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {
+                    "type": "text",
+                    "text": "Access Required",
+                    "weight": "bold",
+                    "size": "xl",
+                    "align": "center"
+                },
+                {
+                    "type": "text",
+                    "text": "Please log in to continue using this service.",
+                    "wrap": True,
+                    "margin": "md",
+                    "align": "center",
+                    "color": "#666666"
+                },
+                {
+                    "type": "button",
+                    "action": {
+                        "type": "uri",
+                        "label": "LINE Login",
+                        "uri": "{login_url}"
+                    },
+                    "style": "primary",
+                    "margin": "lg",
+                    "height": "sm"
+                }
+            ]
+        }
+    },
+    alt_text="Please login",
+    limits={"login_url": URI_LIMIT},
+)
+
+REPORT_CONFIRM_TEMPLATE = FlexTemplate(
+    "report_confirm",
+    {
+        "type": "bubble",
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {"type": "text", "text": "CONFIRM REPORT", "weight": "bold", "size": "xl", "color": "{color}"},
+                {"type": "separator", "margin": "md"},
+                {
+                    "type": "box",
+                    "layout": "vertical",
+                    "margin": "md",
+                    "contents": [
+                        {"type": "text", "text": "📍 Location: {province}, {district}, {subdistrict}, {address_details}", "wrap": True},
+                        {"type": "text", "text": "📝 Event: {raw_content}", "wrap": True},
+                        {"type": "text", "text": "🚨 Urgency: {urgency_level}", "wrap": True},
+                    ]
+                }
+            ]
+        },
+        "footer": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {
+                    "type": "button",
+                    "style": "primary",
+                    "color": "{color}",
+                    "action": {
+                        "type": "postback",
+                        "label": "SUBMIT REPORT",
+                        "data": "{postback_data}"
+                    }
+                },
+                {
+                    "type": "button",
+                    "style": "secondary",
+                    "margin": "sm",
+                    "action": {
+                        "type": "message",
+                        "label": "Cancel",
+                        "text": "Cancel"
+                    }
+                }
+            ]
+        }
+    },
+    alt_text="Confirm report",
+    limits={"color": 7, "province": 100, "district": 100, "subdistrict": 100, "address_details": 500,
+            "raw_content": 4000, "urgency_level": 20, "postback_data": POSTBACK_DATA_LIMIT},
+)
+
+
+def get_report_confirm_message(state, postback_data: str) -> FlexMessage:
+    """Confirmation bubble for a completed ``ReportState``."""
+    color = "#ff0000" if state.urgency_level == "" else "#1DB446"
+    return REPORT_CONFIRM_TEMPLATE.render(
+        alt_text=f"Confirm report: {state.raw_content}",
+        color=color,
+        province=state.province,
+        district=state.district,
+        subdistrict=state.subdistrict,
+        address_details=state.address_details,
+        raw_content=state.raw_content,
+        urgency_level=state.urgency_level,
+        postback_data=postback_data,
+    )
+
+
+@lru_cache(maxsize=1)
 def get_login_flex_message():
+    # Constant for the life of the process: rendered once, then served from cache.
     redirect_uri = os.getenv("DOMAIN", "YOUR_DOMAIN") + "/line/login"
     encoded_redirect_uri = urllib.parse.quote(redirect_uri, safe='')
-    
+
     # Added prompt=consent to force the consent screen to appear
     login_url = os.getenv("LINE_LOGIN_URL", "https://access.line.me/oauth2/v2.1/authorize?response_type=code&client_id={}&redirect_uri={}&state={}&scope=profile%20openid%20email&prompt=consent".format(
         os.getenv("LINE_LOGIN_CHANNEL_ID", "YOUR_CHANNEL_ID"),
         encoded_redirect_uri,
         "random_state"
     ))
-    print(f"Generated Login URL: {login_url}")
-    
-    return FlexMessage(
-        alt_text="Please login",
-        contents=FlexContainer.from_dict({
-            "type": "bubble",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": "Access Required",
-                        "weight": "bold",
-                        "size": "xl",
-                        "align": "center"
-                    },
-                    {
-                        "type": "text",
-                        "text": "Please log in to continue using this service.",
-                        "wrap": True,
-                        "margin": "md",
-                        "align": "center",
-                        "color": "#666666"
-                    },
-                    {
-                        "type": "button",
-                        "action": {
-                            "type": "uri",
-                            "label": "LINE Login",
-                            "uri": login_url
-                        },
-                        "style": "primary",
-                        "margin": "lg",
-                        "height": "sm"
-                    }
-                ]
-            }
-        })
-    )
+    return LOGIN_TEMPLATE.render(login_url=login_url)
+
 
+@lru_cache(maxsize=1)
 def get_location_request_message():
     return TextMessage(
         text="Please share your location so we can find the nearest branch.",
@@ -73,3 +262,9 @@ def get_location_request_message():
             ]
         )
     )
+
+
+def warm_templates():
+    """Render the constant messages once at startup so no request pays for it."""
+    get_login_flex_message()
+    get_location_request_message()
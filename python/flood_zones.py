@@ -0,0 +1,280 @@
+"""Flood-zone overlay: which flooded or forecast-risk zone a report falls in.
+
+Extents are GeoJSON, GeoPackage or shapefile layers in ``FLOOD_ZONES_DIR``.
+Each feature may carry a ``zone_id`` (default ``<file>:<row>``) and a
+``risk`` score between 0 and 1 (default ``FLOOD_ZONE_DEFAULT_RISK``, e.g. 1.0
+for an observed extent and lower for forecast layers). All layers are merged
+into one GeoDataFrame in WGS84 with an STRtree over its geometries. Where
+zones overlap, the point gets the riskiest one.
+
+``start_watcher`` (called at API startup) polls the directory every
+``FLOOD_ZONES_CHECK_INTERVAL`` seconds. When files change it swaps in the new
+index without a restart and re-scores the stored reports once across all
+workers. Replace files atomically (write, then rename). A layer that fails to
+load keeps the previous index in place. The same re-score runs by hand with
+``python python/flood_zones.py rescore``.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from dotenv import load_dotenv
+from redis.exceptions import LockNotOwnedError
+
+import metrics
+import redis_connection
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+FLOOD_ZONES_DIR = Path(os.getenv("FLOOD_ZONES_DIR") or Path(os.getenv("DATA_DIR", "data")) / "flood_zones")
+FLOOD_ZONES_CHECK_INTERVAL = float(os.getenv("FLOOD_ZONES_CHECK_INTERVAL", "5"))
+FLOOD_ZONE_DEFAULT_RISK = float(os.getenv("FLOOD_ZONE_DEFAULT_RISK", "1.0"))
+RESCORE_CHUNK_SIZE = 5000
+# Held while one worker re-scores; if that worker dies the lease lapses and another one retries
+RESCORE_LEASE_SECONDS = 600
+RESCORED_TTL = 7 * 24 * 3600
+ZONE_SUFFIXES = (".geojson", ".json", ".gpkg", ".shp")
+
+redis_client = redis_connection.sync_client()
+
+zones_loaded = metrics.gauge("flood_zones_loaded", "Flood-zone polygons in the current index")
+zone_reloads = metrics.counter("flood_zone_reloads_total", "Flood-zone index reloads, by outcome")
+
+
+class FloodZones:
+    """Zone polygons with an STRtree; ``score`` for one point, ``score_many`` for arrays."""
+
+    def __init__(self, frame: gpd.GeoDataFrame, fingerprint: str = ""):
+        self.frame = frame
+        self.fingerprint = fingerprint
+        self.geometries = frame.geometry.values.to_numpy() if len(frame) else np.empty(0, dtype=object)
+        self.zone_ids = frame["zone_id"].to_numpy(dtype=object)
+        self.risks = frame["risk"].to_numpy(dtype=float)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def score(self, latitude: float, longitude: float) -> tuple[str | None, float | None]:
+        """``(zone_id, risk)`` for a point; ``(None, 0.0)`` outside every zone, ``(None, None)`` with no zones."""
+        if not len(self.geometries):
+            return None, None
+        hits = self.tree.query(shapely.Point(longitude, latitude), predicate="intersects")
+        if not len(hits):
+            return None, 0.0
+        best = hits[0] if len(hits) == 1 else hits[np.argmax(self.risks[hits])]
+        return self.zone_ids[best], float(self.risks[best])
+
+    def score_many(self, latitudes, longitudes) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorised ``score``: zone IDs (object array, None outside) and risks."""
+        count = len(latitudes)
+        zone_ids = np.full(count, None, dtype=object)
+        risks = np.zeros(count) if len(self.geometries) else np.full(count, np.nan)
+        if not count or not len(self.geometries):
+            return zone_ids, risks
+        points = shapely.points(np.asarray(longitudes, dtype=float), np.asarray(latitudes, dtype=float))
+        inputs, hits = self.tree.query(points, predicate="intersects")
+        if len(inputs):
+            # Sort hits by point, then risk; the last hit of each point is its riskiest zone
+            order = np.lexsort((self.risks[hits], inputs))
+            inputs, hits = inputs[order], hits[order]
+            last = np.append(inputs[1:] != inputs[:-1], True)
+            zone_ids[inputs[last]] = self.zone_ids[hits[last]]
+            risks[inputs[last]] = self.risks[hits[last]]
+        return zone_ids, risks
+
+
+def _layer_files(directory: Path) -> list[Path]:
+    if not directory.is_dir():
+        return []
+    return sorted(p for p in directory.iterdir() if p.suffix.lower() in ZONE_SUFFIXES)
+
+
+def directory_signature(directory: Path = None) -> tuple:
+    """Name, mtime and size of every file (shapefile sidecars included); changes when any layer does."""
+    directory = directory or FLOOD_ZONES_DIR
+    if not directory.is_dir():
+        return ()
+    return tuple(sorted((p.name, p.stat().st_mtime_ns, p.stat().st_size)
+                        for p in directory.iterdir() if p.is_file()))
+
+
+def _empty_frame() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame({"zone_id": [], "risk": [], "source": []}, geometry=[], crs="EPSG:4326")
+
+
+def load_zones(directory: Path = None) -> FloodZones:
+    directory = directory or FLOOD_ZONES_DIR
+    signature = directory_signature(directory)
+    frames = []
+    for path in _layer_files(directory):
+        layer = gpd.read_file(path)
+        if layer.crs is not None and layer.crs.to_epsg() != 4326:
+            layer = layer.to_crs(epsg=4326)
+        layer = layer[layer.geometry.notna() & ~layer.geometry.is_empty]
+        zone_ids = (layer["zone_id"].astype(str) if "zone_id" in layer
+                    else pd.Series([f"{path.stem}:{i}" for i in range(len(layer))], index=layer.index))
+        risks = (pd.to_numeric(layer["risk"], errors="coerce").fillna(FLOOD_ZONE_DEFAULT_RISK).clip(0, 1)
+                 if "risk" in layer else pd.Series(FLOOD_ZONE_DEFAULT_RISK, index=layer.index))
+        frames.append(gpd.GeoDataFrame({"zone_id": zone_ids, "risk": risks, "source": path.name},
+                                       geometry=shapely.make_valid(layer.geometry.values), crs="EPSG:4326"))
+    frame = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs="EPSG:4326") if frames else _empty_frame()
+    fingerprint = hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+    return FloodZones(frame, fingerprint)
+
+
+_zones: FloodZones | None = None
+_signature = None
+_reload_lock = threading.Lock()
+
+
+def reload_if_changed() -> bool:
+    """Reload the index if the directory changed since the last load; True when a new index was swapped in."""
+    global _zones, _signature
+    with _reload_lock:
+        signature = directory_signature()
+        if _zones is not None and signature == _signature:
+            return False
+        started = time.perf_counter()
+        try:
+            zones = load_zones()
+        except Exception:
+            # Keep serving the previous extents; the signature is left alone so the next check retries
+            logger.exception("flood zones reload failed", extra={"directory": str(FLOOD_ZONES_DIR)})
+            zone_reloads.inc(outcome="error")
+            if _zones is None:
+                _zones = FloodZones(_empty_frame())
+            return False
+        _zones, _signature = zones, signature
+        zones_loaded.set(len(zones))
+        zone_reloads.inc(outcome="ok")
+        logger.info("flood zones loaded", extra={"zones": len(zones), "fingerprint": zones.fingerprint,
+                                                 "load_ms": round((time.perf_counter() - started) * 1000, 1)})
+        return True
+
+
+def current_zones() -> FloodZones:
+    if _zones is None:
+        reload_if_changed()
+    return _zones
+
+
+def score(latitude: float, longitude: float) -> tuple[str | None, float | None]:
+    return current_zones().score(latitude, longitude)
+
+
+def rescore_reports(zones: FloodZones = None, chunk_size: int = RESCORE_CHUNK_SIZE) -> dict:
+    """Recompute zone and risk for every report with coordinates; only rows whose values change are written."""
+    # Imported here: insert_report scores new reports through this module
+    from sqlalchemy import bindparam, select, update
+
+    from insert_report import Report, engine
+
+    zones = current_zones() if zones is None else zones
+    table = Report.__table__
+    # Matching on timestamp too lets Postgres go straight to the row's monthly partition
+    stmt = (update(table).where(table.c.id == bindparam("report_id"), table.c.timestamp == bindparam("ts"))
+            .values(flood_zone_id=bindparam("zone_id"), flood_risk=bindparam("risk")))
+    started = time.perf_counter()
+    scanned = changed = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.timestamp, table.c.latitude, table.c.longitude, table.c.flood_zone_id,
+                       table.c.flood_risk)
+                .where(table.c.id > last_id, table.c.latitude.is_not(None), table.c.longitude.is_not(None))
+                .order_by(table.c.id).limit(chunk_size)).all()
+            if not rows:
+                break
+            ids, timestamps, lats, lons, old_zones, old_risks = zip(*rows)
+            zone_ids, risks = zones.score_many(lats, lons)
+            updates = []
+            for report_id, ts, zone_id, risk, old_zone, old_risk in zip(ids, timestamps, zone_ids, risks, old_zones,
+                                                                        old_risks):
+                risk = None if np.isnan(risk) else float(risk)
+                if zone_id != old_zone or risk != old_risk:
+                    updates.append({"report_id": report_id, "ts": ts, "zone_id": zone_id, "risk": risk})
+            if updates:
+                conn.execute(stmt, updates)
+            scanned += len(rows)
+            changed += len(updates)
+            last_id = ids[-1]
+    summary = {"scanned": scanned, "changed": changed, "fingerprint": zones.fingerprint,
+               "seconds": round(time.perf_counter() - started, 2)}
+    logger.info("reports rescored", extra=summary)
+    return summary
+
+
+def rescored(zones: FloodZones) -> bool:
+    return bool(redis_client.exists(f"flood_zones:rescored:{zones.fingerprint}"))
+
+
+def rescore_once(zones: FloodZones) -> dict | None:
+    """Re-score for this set of extents unless it is done or another worker is doing it.
+
+    The "done" marker is written only after the re-score completes; a failed
+    run releases its lease so the next check retries.
+    """
+    if rescored(zones):
+        return None
+    lease = redis_client.lock(f"flood_zones:rescoring:{zones.fingerprint}", timeout=RESCORE_LEASE_SECONDS)
+    if not lease.acquire(blocking=False):
+        return None
+    try:
+        summary = rescore_reports(zones)
+        redis_client.set(f"flood_zones:rescored:{zones.fingerprint}", os.getpid(), ex=RESCORED_TTL)
+        return summary
+    finally:
+        try:
+            lease.release()
+        except LockNotOwnedError:
+            logger.warning("rescore lease expired before the rescore finished")
+
+
+def _watch():
+    # Extents may also have changed while the API was down; the marker makes this a no-op otherwise
+    pending = True
+    while True:
+        try:
+            if reload_if_changed():
+                pending = True
+            if pending:
+                zones = current_zones()
+                rescore_once(zones)
+                # Stays pending while another worker holds the lease or the re-score failed
+                pending = not rescored(zones)
+        except Exception:
+            logger.exception("flood zones watcher failed")
+        time.sleep(FLOOD_ZONES_CHECK_INTERVAL)
+
+
+def start_watcher() -> threading.Thread:
+    thread = threading.Thread(target=_watch, name="flood-zones-watcher", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Flood-zone overlay for reports.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rescore", help="re-score every report against the current extents")
+    point = sub.add_parser("score", help="score one point")
+    point.add_argument("latitude", type=float)
+    point.add_argument("longitude", type=float)
+    args = parser.parse_args()
+    if args.command == "rescore":
+        print(rescore_reports())
+    else:
+        print(score(args.latitude, args.longitude))
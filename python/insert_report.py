@@ -1,11 +1,16 @@
+import logging
 import os
 from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Float, DateTime
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+import flood_zones
+
 # 1. Load environment variables
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 
 DB_USER = os.getenv("POSTGRES_USER", "admin")
@@ -15,30 +20,31 @@ DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 DB_NAME = os.getenv("POSTGRES_DB", "report_db")
 
 
-# create db if not exists
-import psycopg2
-
-try:
-    conn = psycopg2.connect(
-        dbname="postgres",
-        user=DB_USER,
-        password=DB_PASS,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-    conn.autocommit = True
-    cursor = conn.cursor()
-    cursor.execute(f"CREATE DATABASE {DB_NAME};")
-    cursor.close()
-    conn.close()
-    print(f"Database '{DB_NAME}' created successfully.")
-except psycopg2.Error as e:
-    if e.pgcode == '42P04':  # DuplicateDatabase error code
-        print(f"Database '{DB_NAME}' already exists.")
-    else:
-        print(f"Error creating database: {e}")
-
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# create db if not exists (skipped when DATABASE_URL points at an existing database)
+if not os.getenv("DATABASE_URL"):
+    import psycopg2
+
+    try:
+        conn = psycopg2.connect(
+            dbname="postgres",
+            user=DB_USER,
+            password=DB_PASS,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE {DB_NAME};")
+        cursor.close()
+        conn.close()
+        logger.info("database created", extra={"database": DB_NAME})
+    except psycopg2.Error as e:
+        if e.pgcode == '42P04':  # DuplicateDatabase error code
+            logger.debug("database already exists", extra={"database": DB_NAME})
+        else:
+            logger.error("error creating database", extra={"database": DB_NAME, "pgcode": e.pgcode})
+
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 # 3. Setup SQLAlchemy
 engine = create_engine(DATABASE_URL)
@@ -60,10 +66,137 @@ class Report(Base):
     content = Column(String)
     urgency = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
-# 5. Create the table
-Base.metadata.create_all(bind=engine)
+    # WGS84 point the reporter shared while collecting this report, if any
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    # Riskiest flood zone containing the point (see flood_zones.py); risk 0 outside every zone
+    flood_zone_id = Column(String, nullable=True)
+    flood_risk = Column(Float, nullable=True)
+
+# 5. Create the table. On Postgres ``reports`` is range-partitioned by month on ``timestamp``
+# (see report_partitions.py), so queries with since/until only touch the months they ask for.
+REPORT_PARTITIONING = os.getenv("REPORT_PARTITIONING", "true").lower() not in ("0", "false", "no")
+
+
+def create_partitioned_table(conn):
+    """CREATE the partitioned ``reports`` parent from the model, with its indexes; partitions come separately."""
+    table = Report.__table__
+    columns = []
+    for column in table.columns:
+        kind = "SERIAL" if column.name == "id" else column.type.compile(conn.dialect)
+        # The partition key must be part of every unique constraint, and can't be NULL
+        not_null = column.primary_key or column.name == "timestamp"
+        columns.append(f'"{column.name}" {kind}{" NOT NULL" if not_null else ""}')
+    conn.execute(text(f'CREATE TABLE {table.name} ({", ".join(columns)}, PRIMARY KEY (id, "timestamp")) '
+                      f'PARTITION BY RANGE ("timestamp")'))
+    # Indexes on the parent are created on every partition. message_id can't stay unique
+    # across partitions; duplicate submits are already stopped by pending_reports.claim_pending.
+    for index in table.indexes:
+        names = [column.name for column in index.columns]
+        if names != ["id"]:
+            conn.execute(text(f"CREATE INDEX {index.name} ON {table.name} ({', '.join(names)})"))
+    conn.execute(text(f'CREATE INDEX ix_{table.name}_timestamp ON {table.name} ("timestamp")'))
+    logger.info("partitioned table created", extra={"table": table.name})
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"),
+                        {"t": Report.__tablename__}).scalar()
+
+
+def create_reports_table():
+    """Create ``reports`` (partitioned on Postgres) and anything else missing from the models."""
+    if engine.dialect.name == "postgresql" and REPORT_PARTITIONING:
+        if not inspect(engine).has_table(Report.__tablename__):
+            try:
+                with engine.begin() as conn:
+                    create_partitioned_table(conn)
+            except (ProgrammingError, IntegrityError) as e:
+                # Only a worker that lost the race to create the same table may carry on (42P07, or
+                # 23505 when both inserted the catalog row at once); create_all must not then
+                # quietly create a plain table
+                with engine.connect() as conn:
+                    created_elsewhere = is_partitioned(conn)
+                if getattr(e.orig, "pgcode", None) not in ("42P07", "23505") or not created_elsewhere:
+                    raise
+                logger.info("partitioned table created by another worker", extra={"table": Report.__tablename__})
+        else:
+            with engine.connect() as conn:
+                if not is_partitioned(conn):
+                    logger.warning("reports is not partitioned; run python python/report_partitions.py migrate",
+                                   extra={"table": Report.__tablename__})
+    Base.metadata.create_all(bind=engine)
+
+
+create_reports_table()
+
+
+def add_missing_columns():
+    """create_all() never alters an existing table; add nullable columns introduced since it was created.
+
+    Every API worker runs this at import, so two of them can both see a column missing. Postgres
+    skips it with IF NOT EXISTS; elsewhere (SQLite has no IF NOT EXISTS here) the loser's
+    duplicate-column error is ignored.
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns(Report.__tablename__)}
+    if_not_exists = "IF NOT EXISTS " if engine.dialect.name == "postgresql" else ""
+    for column in Report.__table__.columns:
+        if column.name in existing or not column.nullable:
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {Report.__tablename__} ADD COLUMN {if_not_exists}"
+                                  f"{column.name} {column.type.compile(engine.dialect)}"))
+        except OperationalError as e:
+            if "duplicate column" not in str(e).lower():
+                raise
+            continue
+        logger.info("column added", extra={"table": Report.__tablename__, "column": column.name})
+
+
+add_missing_columns()
+
+
+# Trigram (pg_trgm) GIN indexes back report_search.py: ILIKE '%...%' and word-similarity
+# matches on Thai text without word segmentation. Postgres only; on an unpartitioned table they
+# are built CONCURRENTLY so creating them on a large table does not block report inserts.
+SEARCH_INDEXES = {"ix_reports_content_trgm": "content", "ix_reports_address_trgm": "address"}
+
+
+def add_search_indexes():
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            # Partitioned parents can't be indexed CONCURRENTLY; their index is built with the table and
+            # each new (empty) monthly partition gets it on creation
+            concurrently = "" if is_partitioned(conn) else "CONCURRENTLY "
+            for name, column in SEARCH_INDEXES.items():
+                conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} "
+                                  f"ON {Report.__tablename__} USING gin ({column} gin_trgm_ops)"))
+            # An interrupted concurrent build leaves an invalid index that IF NOT EXISTS keeps skipping.
+            # It is not dropped here because another worker may still be building it.
+            invalid = conn.execute(text("SELECT c.relname FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                                        "WHERE c.relname = ANY(:names) AND NOT i.indisvalid"),
+                                   {"names": list(SEARCH_INDEXES)}).scalars().all()
+            if invalid:
+                logger.warning("invalid trigram indexes; DROP INDEX CONCURRENTLY them and restart",
+                               extra={"indexes": invalid})
+    except Exception:
+        # Search still works without them, as a sequential scan
+        logger.exception("could not create trigram search indexes")
+
+
+add_search_indexes()
 
 # 6. Function to insert data
+def _missing_partition(error: Exception) -> bool:
+    return getattr(getattr(error, "orig", None), "pgcode", None) == "23514" and "no partition" in str(error)
+
+
 def insert_db(
     message_id: str,
     province: str,
@@ -72,34 +205,59 @@ def insert_db(
     address: str,
     content: str,
     urgency: str,
-    timestamp: datetime = datetime.utcnow(),
+    timestamp: datetime = None,
     reporter_line_id: str = None,
     reporter_email: str = None,
+    latitude: float = None,
+    longitude: float = None,
 ):
-    session = SessionLocal()
-    try:
-        new_report = Report(
-            message_id=message_id,
-            province=province,
-            district=district,
-            sub_district=sub_district,
-            address=address,
-            content=content,
-            urgency=urgency,
-            timestamp=timestamp,
-            reporter_line_id=reporter_line_id,
-            reporter_email=reporter_email
-        )
-        session.add(new_report)
-        session.commit()
-        session.refresh(new_report)
-        print(f"✅ Data inserted successfully: ID {new_report.id} - {new_report.province}, {new_report.district}, {new_report.sub_district}")
-        return new_report
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        session.rollback()
-    finally:
-        session.close()
+    # Resolved per call; a datetime.utcnow() default would be frozen at import time
+    timestamp = timestamp or datetime.utcnow()
+    flood_zone_id = flood_risk = None
+    if latitude is not None and longitude is not None:
+        try:
+            flood_zone_id, flood_risk = flood_zones.score(latitude, longitude)
+        except Exception:
+            logger.exception("flood zone scoring failed")
+    for attempt in range(2):
+        session = SessionLocal()
+        try:
+            new_report = Report(
+                message_id=message_id,
+                province=province,
+                district=district,
+                sub_district=sub_district,
+                address=address,
+                content=content,
+                urgency=urgency,
+                timestamp=timestamp,
+                reporter_line_id=reporter_line_id,
+                reporter_email=reporter_email,
+                latitude=latitude,
+                longitude=longitude,
+                flood_zone_id=flood_zone_id,
+                flood_risk=flood_risk
+            )
+            session.add(new_report)
+            session.commit()
+            session.refresh(new_report)
+            logger.info("report inserted", extra={"report_id": new_report.id, "province": new_report.province, "urgency": new_report.urgency, "flood_zone_id": new_report.flood_zone_id})
+            return new_report
+        except Exception as e:
+            session.rollback()
+            if attempt == 0 and _missing_partition(e):
+                # The maintenance thread creates months ahead; this covers a report that arrives first
+                import report_partitions
+                try:
+                    report_partitions.ensure_partitions(timestamp, timestamp)
+                except Exception:
+                    # Most likely created concurrently by another worker; the retry tells
+                    logger.warning("could not create partition", exc_info=True)
+                continue
+            logger.exception("report insert failed")
+            return None
+        finally:
+            session.close()
 
 # Usage Example
 if __name__ == "__main__":
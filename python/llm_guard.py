@@ -0,0 +1,171 @@
+"""Timeouts and a circuit breaker around the Gemini calls made by ``DisasterBot``.
+
+Every signature call goes through ``call(name, predictor, fallback, **inputs)``.
+The call gets the deadline for its signature (``LLM_TIMEOUT_ROUTER``,
+``LLM_TIMEOUT_EXTRACTOR``, ``LLM_TIMEOUT_ASKER``). The deadline is passed to
+litellm and also enforced on the wall clock, so provider retries or DSPy's
+JSON-adapter fallback cannot stretch a call past it.
+
+Errors, timeouts and calls slower than ``LLM_SLOW_CALL_SECONDS`` count as
+failures. Once ``LLM_BREAKER_FAILURE_RATIO`` of the last
+``LLM_BREAKER_WINDOW`` calls have failed (with at least
+``LLM_BREAKER_MIN_CALLS`` calls seen), the breaker opens. While it is open,
+calls are skipped for ``LLM_BREAKER_COOLDOWN`` seconds. After that, one probe
+call is let through; if it succeeds the breaker closes, otherwise it opens
+again.
+
+A skipped, failed or timed-out call returns ``fallback()`` instead. The
+fallbacks are the rule-based answers in ``degraded_mode``, so intake keeps
+going during an outage.
+
+Breaker state is per worker process and is exposed at ``GET /metrics`` as
+``llm_circuit_state`` (0 closed, 1 half-open, 2 open).
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+TIMEOUTS = {
+    "router": float(os.getenv("LLM_TIMEOUT_ROUTER", "4")),
+    "extractor": float(os.getenv("LLM_TIMEOUT_EXTRACTOR", "10")),
+    "asker": float(os.getenv("LLM_TIMEOUT_ASKER", "6")),
+}
+LLM_SLOW_CALL_SECONDS = float(os.getenv("LLM_SLOW_CALL_SECONDS", "6"))
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_FAILURE_RATIO = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Calls abandoned at their deadline keep a thread until litellm gives up on them too
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+circuit_state = metrics.gauge("llm_circuit_state", "LLM circuit breaker state (0 closed, 1 half-open, 2 open)")
+circuit_transitions = metrics.counter("llm_circuit_transitions_total", "LLM circuit breaker state changes, by new state")
+llm_calls = metrics.counter("llm_calls_total", "LLM signature calls, by signature and outcome")
+llm_fallbacks = metrics.counter("llm_fallbacks_total", "Signature calls answered by the rule-based fallback")
+llm_seconds = metrics.histogram("llm_call_seconds", "LLM signature call latency in seconds",
+                                (0.25, 0.5, 1, 2, 4, 6, 8, 10, 15))
+
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+
+
+class LLMUnavailable(Exception):
+    """The call was skipped because the breaker is open, or it failed or ran past its deadline."""
+
+
+class CircuitBreaker:
+    """Failure-ratio breaker over a sliding window of call outcomes, with a single half-open probe."""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, window: int = LLM_BREAKER_WINDOW, min_calls: int = LLM_BREAKER_MIN_CALLS,
+                 failure_ratio: float = LLM_BREAKER_FAILURE_RATIO, cooldown: float = LLM_BREAKER_COOLDOWN,
+                 clock=time.monotonic):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.clock = clock
+        self.outcomes = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        # Called with the lock held
+        if state == self.state:
+            return
+        logger.warning("llm circuit breaker state changed", extra={"from": self.state, "to": state})
+        self.state = state
+        circuit_state.set(self.STATE_VALUES[state])
+        circuit_transitions.inc(to=state)
+
+    def allow(self) -> bool:
+        """Whether a call may go to the LM now; a True in half-open state makes the caller the probe."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.cooldown:
+                    return False
+                self._set_state(self.HALF_OPEN)
+                self.probing = False
+            if self.state == self.HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def record(self, ok: bool):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                if ok:
+                    self.outcomes.clear()
+                    self._set_state(self.CLOSED)
+                else:
+                    self.opened_at = self.clock()
+                    self._set_state(self.OPEN)
+                return
+            if self.state == self.OPEN:
+                # A call that started before the breaker opened
+                return
+            self.outcomes.append(ok)
+            failures = len(self.outcomes) - sum(self.outcomes)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_ratio:
+                self.opened_at = self.clock()
+                self._set_state(self.OPEN)
+
+
+breaker = CircuitBreaker()
+circuit_state.set(0)
+
+
+def call(name: str, predictor, fallback, **inputs):
+    """Run ``predictor(**inputs)`` under the deadline for ``name``; ``fallback()`` when the LM is unavailable."""
+    try:
+        return _guarded(name, predictor, **inputs)
+    except LLMUnavailable as e:
+        logger.warning("llm call fell back to rules", extra={"signature": name, "reason": str(e)})
+        llm_fallbacks.inc(signature=name)
+        return fallback()
+
+
+def _guarded(name: str, predictor, **inputs):
+    timeout = TIMEOUTS[name]
+    if not breaker.allow():
+        llm_calls.inc(signature=name, outcome="rejected")
+        raise LLMUnavailable("circuit open")
+
+    started = time.perf_counter()
+    # copy_context carries dspy.context(lm=...) overrides into the worker thread
+    future = _executor.submit(contextvars.copy_context().run, predictor, config={"timeout": timeout}, **inputs)
+    error = None
+    try:
+        result = future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        outcome, error = "timeout", f"no answer within {timeout}s"
+    except Exception as e:
+        outcome, error = "error", f"{type(e).__name__}: {e}"
+    else:
+        outcome = "slow" if time.perf_counter() - started > LLM_SLOW_CALL_SECONDS else "ok"
+    elapsed = time.perf_counter() - started
+
+    # A slow answer is still used, but counts towards opening the breaker
+    breaker.record(outcome == "ok")
+    llm_calls.inc(signature=name, outcome=outcome)
+    llm_seconds.observe(elapsed, signature=name)
+    if error is not None:
+        raise LLMUnavailable(error)
+    return result
@@ -3,27 +3,91 @@ from typing import Optional, List, Dict
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 import os
-import redis 
+from redis.exceptions import LockNotOwnedError
 import json
+import logging
+from contextlib import contextmanager
+from types import SimpleNamespace
 
 from insert_report import insert_db
+from logging_setup import stage
+from pending_reports import attach_location, save_pending, submit_postback_data
+from flex_generator import get_report_confirm_message
+import degraded_mode
+import llm_guard
+import program_store
+import redis_connection
 
 
 
-redis_client = redis.StrictRedis(host=os.getenv("REDIS_HOST", "localhost"),
-                                 port=int(os.getenv("REDIS_PORT", "6379")),
-                                 db=int(os.getenv("REDIS_DB", "0")))
+redis_client = redis_connection.sync_client()
 
 
 load_dotenv()  # Load environment variables from .env file
 api_key = os.getenv("GEMINI_API_KEY")
-lm = dspy.LM("gemini/gemini-2.5-flash-lite", api_key=api_key)
+# Few provider retries: llm_guard bounds each call and falls back to rules instead
+lm = dspy.LM("gemini/gemini-2.5-flash-lite", api_key=api_key, num_retries=int(os.getenv("LLM_NUM_RETRIES", "1")))
 dspy.configure(lm=lm)
 dspy.configure(verbosity="info", cache=False)
 
-user_database: Dict[str, List[dict]] = {}
+logger = logging.getLogger(__name__)
+
+# Per-conversation lease: one turn per user at a time across all workers/replicas.
+# The lease must outlive a full turn (three LLM calls); waiting turns give up after CONVERSATION_LOCK_WAIT.
+CONVERSATION_LOCK_TIMEOUT = float(os.getenv("CONVERSATION_LOCK_TIMEOUT", "120"))
+CONVERSATION_LOCK_WAIT = float(os.getenv("CONVERSATION_LOCK_WAIT", "30"))
+
+
+class ConversationBusy(Exception):
+    """Another turn for the same user still holds the conversation lock."""
+
+
+# Extend the lease and write the conversation in one round trip, only while this turn still owns the lease
+SAVE_IF_LEASE_HELD = redis_client.register_script("""
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('pexpire', KEYS[1], ARGV[2])
+redis.call('set', KEYS[2], ARGV[3])
+return 1
+""")
+
+
+def history_key(user_id: str) -> str:
+    return f"user:{user_id}:messages"
+
+
+def add_history_read(batch: redis_connection.Batch, user_id: str) -> redis_connection.Deferred:
+    """Queue the conversation read on a ``redis_connection.batch``; pass ``.value`` to ``DisasterBot(messages=...)``."""
+    return batch.add("get", history_key(user_id), parse=lambda raw: json.loads(raw) if raw else [])
+
+
+@contextmanager
+def conversation_lock(user_id: str):
+    """Hold ``user:{id}:lock`` for the duration of a turn (load, LLM calls, save)."""
+    lock = redis_client.lock(f"user:{user_id}:lock", timeout=CONVERSATION_LOCK_TIMEOUT,
+                             blocking_timeout=CONVERSATION_LOCK_WAIT, sleep=0.05)
+    with stage("conversation_lock_wait", logger):
+        acquired = lock.acquire()
+    if not acquired:
+        raise ConversationBusy(user_id)
+    try:
+        yield lock
+    finally:
+        try:
+            lock.release()
+        except LockNotOwnedError:
+            logger.warning("conversation lease expired before the turn finished")
 
 # --- 1. Data Models ---
+MISSING_LABELS = {
+    "province": "จังหวัด (Province)",
+    "district": "อำเภอ (District)",
+    "subdistrict": "ตำบล (Subdistrict)",
+    "content": "รายละเอียดเหตุการณ์ (Details)",
+}
+
+
 class ReportState(BaseModel):
     province: Optional[str] = None
     district: Optional[str] = None
@@ -33,6 +97,14 @@ class ReportState(BaseModel):
     urgency_level: Optional[str] = None
     step: str = "collecting"
     last_bot_question: Optional[str] = None  # จำคำถามล่าสุดที่บอทถาม
+    # WGS84 point the reporter shared while this report was being collected
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    pending_token: Optional[str] = None  # confirmation card's pending report, once complete
+
+
+# Bookkeeping the LM never needs to see
+PROMPT_EXCLUDE = {"latitude", "longitude", "pending_token"}
 
 # --- 2. DSPy Signatures ---
 
@@ -74,22 +146,73 @@ class QuestionGenerator(dspy.Signature):
     missing_info = dspy.InputField(desc="List of fields that are strictly missing.")
     question = dspy.OutputField(desc="The next question to ask in Thai.")
 
+PREDICTOR_KINDS = {"predict": dspy.Predict, "cot": dspy.ChainOfThought}
+DEFAULT_KINDS = {"router": "predict", "extractor": "cot", "asker": "cot"}
+
+
+class DisasterProgram(dspy.Module):
+    """The three signature calls of a turn; ``optimize_program.py`` compiles and saves variants of it."""
+
+    def __init__(self, kinds: dict | None = None):
+        super().__init__()
+        self.kinds = {**DEFAULT_KINDS, **(kinds or {})}
+        self.router = PREDICTOR_KINDS[self.kinds["router"]](IntentRouter)
+        self.extractor = PREDICTOR_KINDS[self.kinds["extractor"]](FieldExtractor)
+        self.asker = PREDICTOR_KINDS[self.kinds["asker"]](QuestionGenerator)
+
+
+_program: DisasterProgram | None = None
+program_version: str | None = None
+
+
+def load_program(version: str | None = None) -> DisasterProgram:
+    """Load the promoted program artifact (``program_store``); zero-shot defaults when none is promoted."""
+    global _program, program_version
+    try:
+        loaded = program_store.load(version)
+    except Exception:
+        # A broken artifact must not take intake down; the zero-shot program still works
+        logger.exception("program artifact failed to load, using the zero-shot program")
+        loaded = None
+    if loaded is None:
+        program, program_version = DisasterProgram(), None
+    else:
+        manifest, state = loaded
+        program = DisasterProgram(manifest["kinds"])
+        program.load_state(state)
+        program_version = manifest["version"]
+    logger.info("disasterbot program loaded", extra={"program_version": program_version, "kinds": program.kinds})
+    _program = program
+    return program
+
+
+def current_program() -> DisasterProgram:
+    return _program if _program is not None else load_program()
+
+
 # --- 3. Main Logic Class ---
 
 class DisasterBot(dspy.Module):
-    def __init__(self, user_id: str):
+    def __init__(self, user_id: str, lock=None, messages: list | None = None, program: DisasterProgram | None = None):
         super().__init__()
         self.user_id = user_id
+        # Lease from conversation_lock(); checked before writing so an expired lease never overwrites a newer turn
+        self.lock = lock
         
-        # Define Modules
-        self.router = dspy.Predict(IntentRouter)
-        self.extractor = dspy.ChainOfThought(FieldExtractor) 
-        self.asker = dspy.ChainOfThought(QuestionGenerator)  
+        # Predictors of the program loaded at startup; shared by all turns, they hold no per-call state
+        program = program or current_program()
+        self.router = program.router
+        self.extractor = program.extractor
+        self.asker = program.asker
         
-        self.retrieve_user_messages()
+        # Callers that already read the history in a batched round trip pass it in
+        if messages is None:
+            self.retrieve_user_messages()
+        else:
+            self.messages = messages
         
     def retrieve_user_messages(self):
-        messages = redis_client.get(f"user:{self.user_id}:messages")
+        messages = redis_client.get(history_key(self.user_id))
         if messages:
             self.messages = json.loads(messages)
         else:
@@ -97,14 +220,15 @@ class DisasterBot(dspy.Module):
         return self.messages
     
     def update_user_messages(self, new_state_dict: dict):
-            # 1. บันทึกลง Database กลาง
-            if self.user_id not in user_database:
-                user_database[self.user_id] = []
-            user_database[self.user_id].append(new_state_dict)
-            redis_client.set(f"user:{self.user_id}:messages", json.dumps(user_database[self.user_id]))
-            # print(self.messages)
-            # 2. --- FIX: อัปเดตความจำในตัว instance ทันที ---
+            # Redis is the only copy of the conversation, so any worker can serve the next turn
             self.messages.append(new_state_dict)
+            payload = json.dumps(self.messages)
+            if self.lock is None:
+                redis_client.set(history_key(self.user_id), payload)
+            elif not SAVE_IF_LEASE_HELD(keys=[self.lock.name, history_key(self.user_id)],
+                                        args=[self.lock.local.token, int(self.lock.timeout * 1000), payload],
+                                        client=redis_client):
+                raise LockNotOwnedError("conversation lease was lost mid-turn; not saving")
 
     def _merge_content(self, old_text: Optional[str], new_text: Optional[str]) -> str:
             """Smartly merges text, filtering out 'None' strings and duplicates."""
@@ -137,72 +261,48 @@ class DisasterBot(dspy.Module):
         s = str(val).strip().lower()
         return s not in ["", "none", "null", "n/a", "unknown", "ไม่ทราบ"]
 
-    def generate_flex_json(self, state: ReportState):
-        """Helper to build LINE Flex Message"""
-        color = "#ff0000" if state.urgency_level == "" else "#1DB446"
-        return {
-            "type": "bubble",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {"type": "text", "text": "CONFIRM REPORT", "weight": "bold", "size": "xl", "color": color},
-                    {"type": "separator", "margin": "md"},
-                    {
-                        "type": "box",
-                        "layout": "vertical",
-                        "margin": "md",
-                        "contents": [
-                            {"type": "text", "text": f"📍 Location: {state.province}, {state.district}, {state.subdistrict}, {state.address_details}", "wrap": True},
-                            {"type": "text", "text": f"📝 Event: {state.raw_content}", "wrap": True},
-                            {"type": "text", "text": f"🚨 Urgency: {state.urgency_level}", "wrap": True},
-                        ]
-                    }
-                ]
-            },
-            "footer": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {
-                        "type": "button",
-                        "style": "primary",
-                        "color": color,
-                        "action": {
-                            "type": "postback",
-                            "label": "SUBMIT REPORT",
-                            "data": f"action=submit&province={state.province}&dis={state.district}&sub={state.subdistrict}&addr={state.address_details}&content={state.raw_content}&urgency={state.urgency_level}"
-                            
-                        }
-                    },
-                    {
-                        "type": "button",
-                        "style": "secondary",
-                        "margin": "sm",
-                        "action": {
-                            "type": "message",
-                            "label": "Cancel",
-                            "text": "Cancel"
-                        }
-                    }
-                ]
-            }
-        }
-        
+    def generate_flex_message(self, state: ReportState, token: str):
+        """Confirmation Flex message from the precompiled template; the submit button carries only the pending-report token."""
+        return get_report_confirm_message(state, submit_postback_data(token))
 
     def clear_state(self):
         self.messages = []
-        redis_client.delete(f"user:{self.user_id}:messages")
+        redis_client.delete(history_key(self.user_id))
 
     def remove_report(self):
         """Remove the current report and clear state."""
         self.clear_state()
         return {'type': 'text', 'text': "ยกเลิกการรายงานเรียบร้อยแล้ว หากต้องการรายงานใหม่ กรุณาเริ่มต้นใหม่ได้เลยค่ะ"}
 
+    def attach_location(self, latitude: float, longitude: float) -> str:
+        """Link a shared location to this user's current report; returns where it went.
+
+        ``pending``: the completed report still waiting for SUBMIT. ``collecting``: the
+        report being collected. ``new``: no open report, so it starts one carrying only the point.
+        """
+        last_state_dict = self.messages[-1] if self.messages else None
+        location = {"latitude": latitude, "longitude": longitude}
+        if last_state_dict and last_state_dict.get("step") == "complete":
+            if attach_location(last_state_dict.get("pending_token"), latitude, longitude):
+                state, outcome = ReportState.model_validate(last_state_dict).copy(update=location), "pending"
+            else:
+                state, outcome = ReportState(**location), "new"
+        elif last_state_dict:
+            state, outcome = ReportState.model_validate(last_state_dict).copy(update=location), "collecting"
+        else:
+            state, outcome = ReportState(**location), "new"
+        self.update_user_messages(state.model_dump())
+        return outcome
+
     def forward(self, user_message: str):
         # 1. Load History & Determine Context
         
-        intent = self.router(chat_memory=self.messages, new_message=user_message)
+        # Each call falls back to degraded_mode's rules when Gemini is down, slow or the breaker is open
+        with stage("llm_router", logger):
+            intent = llm_guard.call(
+                "router", self.router,
+                lambda: SimpleNamespace(intent=degraded_mode.detect_intent(user_message)),
+                chat_memory=self.messages, new_message=user_message)
         if intent.intent == "remove_report":
             return self.remove_report()
         
@@ -226,11 +326,14 @@ class DisasterBot(dspy.Module):
             previous_question = last_state.last_bot_question or "None"
 
         # 3. Extract Information
-        extraction = self.extractor(
-            current_state=last_state.model_dump_json(),
-            previous_question=previous_question,
-            new_message=user_message
-        )
+        with stage("llm_extractor", logger):
+            extraction = llm_guard.call(
+                "extractor", self.extractor,
+                lambda: degraded_mode.extract(user_message, last_state.model_dump(), last_state.last_bot_question),
+                current_state=last_state.model_dump_json(exclude=PROMPT_EXCLUDE),
+                previous_question=previous_question,
+                new_message=user_message
+            )
         
         # 4. Merge Data (Keep old data if new is None)
         new_state = last_state.copy(update={
@@ -244,13 +347,13 @@ class DisasterBot(dspy.Module):
 
 
         missing_fields = []
-        if not self._has_value(new_state.province): missing_fields.append("จังหวัด (Province)")
-        if not self._has_value(new_state.district): missing_fields.append("อำเภอ (District)")
-        if not self._has_value(new_state.subdistrict): missing_fields.append("ตำบล (Subdistrict)")
+        if not self._has_value(new_state.province): missing_fields.append("province")
+        if not self._has_value(new_state.district): missing_fields.append("district")
+        if not self._has_value(new_state.subdistrict): missing_fields.append("subdistrict")
         
         # Content check
         if not self._has_value(new_state.raw_content) or len(new_state.raw_content) < 3:
-            missing_fields.append("รายละเอียดเหตุการณ์ (Details)")
+            missing_fields.append("content")
 
         # Decide Step
         if len(missing_fields) == 0:
@@ -263,17 +366,22 @@ class DisasterBot(dspy.Module):
         
         if new_state.step != "complete":
             # Generate question specifically for missing fields
-            print(f"DEBUG: Missing fields -> {missing_fields}")
-            question_gen = self.asker(
-                current_knowledge=new_state.model_dump_json(),
-                missing_info=", ".join(missing_fields)
-            )
+            logger.debug("missing fields", extra={"missing_fields": missing_fields})
+            with stage("llm_asker", logger):
+                question_gen = llm_guard.call(
+                    "asker", self.asker,
+                    lambda: SimpleNamespace(question=degraded_mode.next_question(missing_fields)),
+                    current_knowledge=new_state.model_dump_json(exclude=PROMPT_EXCLUDE),
+                    missing_info=", ".join(MISSING_LABELS[f] for f in missing_fields)
+                )
             next_question = question_gen.question
             
             new_state.last_bot_question = next_question
             response = {'type': 'text', 'text': next_question}
         else:
-            response = {'type': 'flex', 'contents': self.generate_flex_json(new_state)}
+            token = save_pending(self.user_id, new_state.model_dump(exclude={"pending_token"}))
+            response = {'type': 'flex', 'message': self.generate_flex_message(new_state, token)}
+            new_state.pending_token = token
 
             new_state.last_bot_question = None
 
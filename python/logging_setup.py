@@ -0,0 +1,132 @@
+"""Structured, non-blocking logging.
+
+Every record is rendered as one JSON line carrying the current webhook event
+ID, a salted hash of the LINE user ID (never the raw ID) and any ``extra``
+fields such as stage timings. Records are formatted on the calling thread and
+handed to a ``QueueHandler``; a single ``QueueListener`` thread does the actual
+stdout writes, so request paths never block on I/O.
+
+Environment:
+    LOG_LEVEL               root level (default INFO)
+    LOG_LEVELS              per-module overrides, e.g. "llm_qa=DEBUG,httpx=WARNING"
+    LOG_DEBUG_SAMPLE_RATE   fraction of DEBUG records kept (default 0.1)
+    LOG_USER_HASH_SALT      salt for user hashes
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+event_id_var = contextvars.ContextVar("event_id", default=None)
+user_hash_var = contextvars.ContextVar("user_hash", default=None)
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def hash_user(user_id) -> str | None:
+    """Stable, non-reversible identifier for a LINE user (or (group, user) pair)."""
+    if not user_id or user_id == "unknown":
+        return None
+    if isinstance(user_id, tuple):
+        user_id = ":".join(user_id)
+    salt = os.getenv("LOG_USER_HASH_SALT", "flood-project")
+    return hashlib.sha256(f"{salt}:{user_id}".encode("utf-8")).hexdigest()[:16]
+
+
+def bind_event(event_id: str | None, user_id=None):
+    """Attach the webhook event ID and user hash to every record logged in this context."""
+    event_id_var.set(event_id)
+    user_hash_var.set(hash_user(user_id))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "event_id": event_id_var.get(),
+            "user_hash": user_hash_var.get(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Keep only a fraction of DEBUG records; higher levels always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def _parse_levels(spec: str) -> dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(stream=None) -> None:
+    """Install the JSON queue handler on the root logger. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(JsonFormatter())
+    queue_handler.addFilter(DebugSampler(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter("%(message)s"))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for name, level in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+@contextmanager
+def stage(name: str, logger: logging.Logger | None = None, **fields):
+    """Time a processing stage and emit a ``stage`` record with its duration."""
+    logger = logger or logging.getLogger("stage")
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration_ms = round((time.perf_counter() - start) * 1000, 3)
+        logger.info("stage %s", name, extra={"stage": name, "duration_ms": duration_ms, "outcome": outcome, **fields})
@@ -0,0 +1,109 @@
+"""Merge bursts of short texts from one user into a single DisasterBot turn.
+
+Every text is appended to ``user:{id}:inbox:{chat}`` in Redis, in the same
+transaction that takes a number from ``user:{id}:inbox:{chat}:seq``, and its
+request then waits ``COALESCE_WINDOW`` seconds (``queue_text``). Only the
+request holding the newest number (or any request once the oldest waiting text is
+``COALESCE_MAX_WAIT`` seconds old) goes on to run a turn; the others return
+without replying. That request drains the inbox under the conversation lock
+(``take_batch``), so texts that arrive while an earlier turn is still running
+join the next turn, and turns never take texts out of order. The state is all
+in Redis, so bursts whose messages land on different workers still merge.
+"""
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+import redis_connection
+from logging_setup import stage
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Quiet period after a text before its turn runs; 0 disables coalescing
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "1.5"))
+# Upper bound on how long the first text of a burst can wait while the user keeps typing
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", "6"))
+
+redis_client = redis_connection.sync_client()
+
+
+def _inbox_key(user_id: str, chat_id: str | None) -> str:
+    return f"user:{user_id}:inbox:{chat_id or user_id}"
+
+
+def queue_text(user_id: str, text: str, reply_token: str, event_timestamp: int | None = None,
+               chat_id: str | None = None) -> bool:
+    """Queue ``text`` and wait out the window.
+
+    Returns True when this request should run a turn (then call ``take_batch``
+    under the conversation lock), False when a later text of the same burst
+    will. ``chat_id`` separates a user's direct chat from the groups they post in.
+    """
+    if COALESCE_WINDOW <= 0:
+        return True
+
+    key = _inbox_key(user_id, chat_id)
+    queued_at = time.time()
+    entry = {"text": text, "reply_token": reply_token, "timestamp": event_timestamp or int(queued_at * 1000),
+             "queued_at": queued_at}
+    ttl = int(COALESCE_MAX_WAIT + COALESCE_WINDOW) + 60
+    # INCR and RPUSH in one MULTI: one round trip, and the list stays in sequence order
+    with redis_client.pipeline() as pipe:
+        pipe.incr(f"{key}:seq")
+        pipe.rpush(key, json.dumps(entry, ensure_ascii=False))
+        pipe.expire(key, ttl)
+        pipe.expire(f"{key}:seq", ttl)
+        seq = pipe.execute()[0]
+
+    with stage("coalesce_wait", logger):
+        time.sleep(COALESCE_WINDOW)
+
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(f"{key}:seq")
+        pipe.lindex(key, 0)
+        latest, oldest = pipe.execute()
+    if int(latest or 0) == seq:
+        return True
+    if oldest is not None and time.time() - json.loads(oldest)["queued_at"] >= COALESCE_MAX_WAIT:
+        return True
+    logger.debug("text left to a later turn", extra={"seq": seq})
+    return False
+
+
+def _merge_inbox(raw: list[bytes]) -> tuple[str, str, int | None] | None:
+    if not raw:
+        return None
+    entries = [json.loads(item) for item in raw]
+    latest = entries[-1]
+    if len(entries) > 1:
+        logger.info("coalesced texts into one turn", extra={"text_count": len(entries)})
+    # Answer on the newest text's reply token, the freshest one
+    return "\n".join(e["text"] for e in entries), latest["reply_token"], latest["timestamp"]
+
+
+def add_take_batch(batch: redis_connection.Batch, user_id: str, chat_id: str | None = None,
+                   default: tuple[str, str, int | None] | None = None) -> redis_connection.Deferred:
+    """Queue the inbox drain on a transactional ``redis_connection.batch``; ``.value`` is as for ``take_batch``."""
+    if COALESCE_WINDOW <= 0:
+        return redis_connection.Deferred(value=default)
+    key = _inbox_key(user_id, chat_id)
+    slot = batch.add("lrange", key, 0, -1, parse=_merge_inbox)
+    batch.add("delete", key)
+    return slot
+
+
+def take_batch(user_id: str, chat_id: str | None = None,
+               default: tuple[str, str, int | None] | None = None) -> tuple[str, str, int | None] | None:
+    """Drain the inbox into ``(merged_text, reply_token, event_timestamp)``.
+
+    Call while holding ``conversation_lock`` so consecutive turns see the texts
+    in the order they were sent. Returns None when an earlier turn already took
+    them, and ``default`` unchanged when coalescing is off.
+    """
+    with redis_connection.batch(redis_client, transaction=True) as batch:
+        slot = add_take_batch(batch, user_id, chat_id, default)
+    return slot.value
@@ -1,10 +1,20 @@
-from linebot.v3.messaging import Configuration, ApiClient, MessagingApiBlob, MessagingApi, ReplyMessageRequest, TextMessage, FlexMessage, FlexContainer
+from linebot.v3.messaging import Configuration, ApiClient, MessagingApiBlob, MessagingApi, ReplyMessageRequest, TextMessage
 from dotenv import load_dotenv
+import logging
 import os
 from flex_generator import get_location_request_message
-from llm_qa import DisasterBot
+from llm_qa import DisasterBot, ConversationBusy, add_history_read, conversation_lock
 from insert_report import insert_db
+from logging_setup import stage
+from reply_dispatcher import ReplyDispatcher
+import message_coalescer
+import redis_connection
+import pending_reports
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Override for local stand-ins (bench/loadtest.py); None keeps https://api.line.me
+LINE_API_HOST = os.getenv("LINE_API_HOST")
 
 
 def download_image(url: str) -> bytes:
@@ -22,166 +32,191 @@ def get_image_data(message) -> bytes | None:
         channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
         if channel_access_token:
             try:
-                configuration = Configuration(access_token=channel_access_token)
+                configuration = Configuration(access_token=channel_access_token, host=LINE_API_HOST)
                 with ApiClient(configuration) as api_client:
                     line_bot_blob_api = MessagingApiBlob(api_client)
                     return line_bot_blob_api.get_message_content(message.id)
-            except Exception as e:
-                print(f"Error getting image content: {e}")
+            except Exception:
+                logger.exception("error getting image content")
                 return None
         else:
-            print("LINE_CHANNEL_ACCESS_TOKEN not found")
+            logger.warning("LINE_CHANNEL_ACCESS_TOKEN not found")
     return None
 
 
 def handle_image(message, source_type, source_id, replytoken, message_id):
     image_data = get_image_data(message)
     if image_data:
-        print(f"Image data retrieved, size: {len(image_data)} bytes")
+        logger.info("image data retrieved", extra={"size_bytes": len(image_data)})
         if source_type == "user":
             user_id = source_id
             # Save the image to a file
             with open(f"data/{message_id}_image.jpg", "wb") as img_file:
                 img_file.write(image_data)
-            print(f"Image saved to data/{message_id}_image.jpg")
+            logger.info("image saved", extra={"message_id": message_id})
         elif source_type == "group":
             group_id, user_id = source_id
             with open(f"data/{group_id}_{user_id}_{message_id}_image.jpg", "wb") as img_file:
                 img_file.write(image_data)
-            print(f"Image saved to data/{group_id}_{user_id}_{message_id}_image.jpg")
+            logger.info("image saved", extra={"message_id": message_id})
     else:
-        print("Failed to retrieve image data")
+        logger.warning("failed to retrieve image data")
 
 def handle_location(message, source_type, source_id, replytoken, message_id):
     if source_type == "user":
         user_id = source_id
         # print(f"Location message from user {user_id}: {message.address} ({message.latitude}, {message.longitude})")
+        # The point belongs to the report being collected (or awaiting SUBMIT), never to a later one
+        reply_text = f"Thank you! We received your location: {message.address}"
+        try:
+            with conversation_lock(user_id) as lock:
+                attached = DisasterBot(user_id, lock=lock).attach_location(message.latitude, message.longitude)
+            logger.info("location attached", extra={"report": attached})
+        except ConversationBusy:
+            logger.warning("conversation busy, location dropped")
+            reply_text = "ระบบกำลังประมวลผลข้อความก่อนหน้าของคุณ กรุณาส่งตำแหน่งอีกครั้งในอีกสักครู่ค่ะ"
         
         channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
         if channel_access_token:
-            configuration = Configuration(access_token=channel_access_token)
+            configuration = Configuration(access_token=channel_access_token, host=LINE_API_HOST)
             with ApiClient(configuration) as api_client:
                 line_bot_api = MessagingApi(api_client)
                 line_bot_api.reply_message(
                     ReplyMessageRequest(
                         reply_token=replytoken,
-                        messages=[TextMessage(text=f"Thank you! We received your location: {message.address}")]
+                        messages=[TextMessage(text=reply_text)]
                     )
                 )
 
-def process_text_message(text, user_id, replytoken):
-    print(f"Processing message with DisasterBot: {text}")
+def process_text_message(text, user_id, replytoken, push_to=None, event_timestamp=None):
+    logger.debug("processing message with DisasterBot", extra={"text_length": len(text)})
+    if not os.getenv("LINE_CHANNEL_ACCESS_TOKEN"):
+        logger.warning("LINE_CHANNEL_ACCESS_TOKEN not found in .env")
+        return
+
+    # A burst of short texts becomes one turn; requests whose text is left to a later turn stop here
+    if not message_coalescer.queue_text(user_id, text, replytoken, event_timestamp, chat_id=push_to):
+        return
+
+    # Reply while the token is fresh, push once the LLM turn has outlived it
+    dispatcher = ReplyDispatcher(replytoken, push_to=push_to, event_timestamp=event_timestamp)
     try:
-        disaster_bot = DisasterBot(user_id)
+        # Serialize turns per user: drain, load, LLM calls and save happen under one lease
+        with conversation_lock(user_id) as lock:
+            # Drain the inbox and read the conversation in a single round trip
+            with stage("conversation_load", logger), \
+                    redis_connection.batch(message_coalescer.redis_client, transaction=True) as turn:
+                batch = message_coalescer.add_take_batch(turn, user_id, chat_id=push_to,
+                                                         default=(text, replytoken, event_timestamp))
+                history = add_history_read(turn, user_id)
+            if batch.value is None:
+                logger.debug("texts already taken by an earlier turn")
+                return
+            text, replytoken, event_timestamp = batch.value
+            dispatcher = ReplyDispatcher(replytoken, push_to=push_to, event_timestamp=event_timestamp)
+            dispatcher.start_processing_notice()
+            disaster_bot = DisasterBot(user_id, lock=lock, messages=history.value)
 
-        response_payload = disaster_bot.forward(text)
+            with stage("llm_turn", logger):
+                response_payload = disaster_bot.forward(text)
         # print(f"DisasterBot response payload: {response_payload}")
-        
-        channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
-        if channel_access_token:
-            configuration = Configuration(access_token=channel_access_token)
-            with ApiClient(configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                
-                messages = []
-                if isinstance(response_payload, str):
-                    messages.append(TextMessage(text=response_payload))
-                elif isinstance(response_payload, dict):
-                    if response_payload.get("type") == "text":
-                        messages.append(TextMessage(text=response_payload.get("text")))
-                    elif response_payload.get("type") == "flex":
-                        flex_content = response_payload.get("contents")
-                        messages.append(FlexMessage(alt_text=response_payload.get("altText", "Flex Message"), contents=FlexContainer.from_dict(flex_content)))
-                
-                if messages:
-                    print(f"Sending reply message: {messages}")
-                    line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=replytoken,
-                            messages=messages
-                        )
-                    )
-                    print("Reply sent successfully")
-                else:
-                    print("No messages to send")
+
+        if isinstance(response_payload, str):
+            dispatcher.add(TextMessage(text=response_payload))
+        elif isinstance(response_payload, dict):
+            if response_payload.get("type") == "text":
+                dispatcher.add(TextMessage(text=response_payload.get("text")))
+            elif response_payload.get("type") == "flex":
+                # Already rendered from a validated template (flex_generator.FlexTemplate)
+                dispatcher.add(response_payload["message"])
+
+        if dispatcher.messages:
+            with stage("line_reply", logger, message_types=[m.type for m in dispatcher.messages],
+                       token_age_s=round(dispatcher.age(), 3)):
+                dispatcher.flush()
         else:
-            print("LINE_CHANNEL_ACCESS_TOKEN not found in .env")
-    except Exception as e:
-        print(f"Error in DisasterBot or sending reply: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        # Attempt to send error message to user
-        channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
-        if channel_access_token:
-            try:
-                configuration = Configuration(access_token=channel_access_token)
-                with ApiClient(configuration) as api_client:
-                    line_bot_api = MessagingApi(api_client)
-                    line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=replytoken,
-                            messages=[TextMessage(text="Sorry, I encountered an error processing your request.")]
-                        )
-                    )
-            except Exception as reply_error:
-                print(f"Failed to send error reply: {reply_error}")
+            logger.info("no messages to send")
+    except ConversationBusy:
+        logger.warning("conversation busy, turn dropped")
+        try:
+            dispatcher.messages = [TextMessage(text="ระบบกำลังประมวลผลข้อความก่อนหน้าของคุณ กรุณาส่งข้อความนี้อีกครั้งในอีกสักครู่ค่ะ")]
+            dispatcher.flush()
+        except Exception:
+            logger.exception("failed to send busy reply")
+    except Exception:
+        logger.exception("error in DisasterBot or sending reply")
 
-def handle_postback(replytoken, data, source_id, email, message_id):
-    # print(f"Postback data: {data}")
-    # Postback data: action=submit&loc=ปทุมธานี,ธัญญบุรี,ลำผัดกูด&addr=ตรงข้ามวัดอัยยิการาม&content=น้ำท่วมชั้น 2 ไฟดับหมดเลย (The second floor is flooded and the power is out.)&urgency=Critical
+        # Attempt to send error message to user; the dispatcher knows whether the token is still usable
+        try:
+            dispatcher.messages = [TextMessage(text="Sorry, I encountered an error processing your request.")]
+            dispatcher.flush()
+        except Exception:
+            logger.exception("failed to send error reply")
 
+POSTBACK_REPLIES = {
+    pending_reports.SUBMITTED: "เราได้รับรายงานของคุณแล้ว ขอบคุณสำหรับข้อมูลค่ะ",
+    pending_reports.DUPLICATE: "รายงานนี้ถูกส่งเรียบร้อยแล้วค่ะ",
+    pending_reports.EXPIRED: "รายงานนี้หมดอายุแล้ว กรุณาแจ้งเหตุใหม่อีกครั้งค่ะ",
+    pending_reports.FORBIDDEN: "เฉพาะผู้แจ้งเหตุเท่านั้นที่สามารถยืนยันรายงานนี้ได้ค่ะ",
+}
 
-    if "action=submit" in data:
-        # Clear the user's state
+
+def handle_postback(replytoken, data, source_id, email, message_id):
+    # Postback data: action=submit&id=<pending report token> (see pending_reports.py)
+    params = pending_reports.parse_postback_data(data)
+
+    if params.get("action") == "submit":
         user_id = source_id
         if isinstance(source_id, tuple): # Handle group source_id (group_id, user_id)
              user_id = source_id[1]
-        
-        report_data = {
-            'province': data.split("province=")[1].split("&")[0] if "province=" in data else "",
-            'district': data.split("dis=")[1].split("&")[0] if "dis=" in data else "",
-            'subdistrict': data.split("sub=")[1].split("&")[0] if "sub=" in data else "",
-            'address_details': data.split("addr=")[1].split("&")[0] if "addr=" in data else "",
-            'content': data.split("content=")[1].split("&")[0] if "content=" in data else "",
-            'urgency_level': data.split("urgency=")[1].split("&")[0] if "urgency=" in data else "",
-            'user_id': user_id,
-            'user_email': email
-        }
-        
-        insert_db(
-            message_id=message_id,
-            province=report_data['province'],
-            district=report_data['district'],
-            sub_district=report_data['subdistrict'],
-            address=report_data['address_details'],
-            content=report_data['content'],
-            urgency=report_data['urgency_level'],
-            reporter_line_id=report_data['user_id'],
-            reporter_email=report_data['user_email']
-        )      
+
+        token = params.get("id", "")
+        status, state = pending_reports.claim_pending(token, user_id)
+        logger.info("report postback", extra={"status": status})
+        if status == pending_reports.SUBMITTED:
+            report = insert_db(
+                message_id=message_id,
+                province=state.get('province'),
+                district=state.get('district'),
+                sub_district=state.get('subdistrict'),
+                address=state.get('address_details'),
+                content=state.get('raw_content'),
+                urgency=state.get('urgency_level'),
+                reporter_line_id=user_id,
+                reporter_email=email,
+                latitude=state.get('latitude'),
+                longitude=state.get('longitude')
+            )
+            if report is None:
+                pending_reports.release_claim(token)
+                reply_text = "ขออภัย ไม่สามารถบันทึกรายงานได้ กรุณากดส่งอีกครั้งค่ะ"
+            else:
+                reply_text = POSTBACK_REPLIES[status]
+        else:
+            reply_text = POSTBACK_REPLIES[status]
+
         channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
         if channel_access_token:
-            configuration = Configuration(access_token=channel_access_token)
+            configuration = Configuration(access_token=channel_access_token, host=LINE_API_HOST)
             with ApiClient(configuration) as api_client:
                 line_bot_api = MessagingApi(api_client)
                 line_bot_api.reply_message(
                     ReplyMessageRequest(
                         reply_token=replytoken,
-                        messages=[TextMessage(text="เราได้รับรายงานของคุณแล้ว ขอบคุณสำหรับข้อมูลค่ะ")] # TODO: Make this a flex message
+                        messages=[TextMessage(text=reply_text)] # TODO: Make this a flex message
                     )
                 )
 
-def handle_text(message, source_type, source_id, replytoken, message_id):
+def handle_text(message, source_type, source_id, replytoken, message_id, event_timestamp=None):
     if source_type == "user":
         user_id = source_id
         text = message.text
-        print(f"Text message from user {user_id}: {text}")
+        logger.debug("text message from user", extra={"text_length": len(text)})
         
         if "branch" in text.lower() or "location" in text.lower():
             channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
             if channel_access_token:
-                configuration = Configuration(access_token=channel_access_token)
+                configuration = Configuration(access_token=channel_access_token, host=LINE_API_HOST)
                 with ApiClient(configuration) as api_client:
                     line_bot_api = MessagingApi(api_client)
                     line_bot_api.reply_message(
@@ -192,38 +227,38 @@ def handle_text(message, source_type, source_id, replytoken, message_id):
                     )
         else:
             # Use DisasterBot for other messages
-            process_text_message(text, user_id, replytoken)
+            process_text_message(text, user_id, replytoken, push_to=user_id, event_timestamp=event_timestamp)
 
     elif source_type == "group":
         group_id, user_id = source_id
         text = message.text
-        print(f"Text message from user {user_id} in group {group_id}: {text}")
+        logger.debug("text message from group member", extra={"text_length": len(text)})
         # Use DisasterBot for group messages too, using user_id to track individual user state
-        process_text_message(text, user_id, replytoken)
+        process_text_message(text, user_id, replytoken, push_to=group_id, event_timestamp=event_timestamp)
 
 
 
-def message_handle(message, source_type, source_id, replytoken, message_id):
+def message_handle(message, source_type, source_id, replytoken, message_id, event_timestamp=None):
     if source_type == "user":
         user_id = source_id
         if message.type == "text":
-            handle_text(message, source_type, source_id, replytoken, message_id)
+            handle_text(message, source_type, source_id, replytoken, message_id, event_timestamp)
         elif message.type == "image":
             handle_image(message, source_type, source_id, replytoken, message_id)
         elif message.type == "location":
             handle_location(message, source_type, source_id, replytoken, message_id)
         else:
-            print(f"Unhandled message type from user {user_id}: {message.type}")
+            logger.info("unhandled message type", extra={"message_type": message.type})
     elif source_type == "group":
         group_id, user_id = source_id
         if message.type == "text":
-            handle_text(message, source_type, source_id, replytoken, message_id)
+            handle_text(message, source_type, source_id, replytoken, message_id, event_timestamp)
         elif message.type == "image":
             handle_image(message, source_type, source_id, replytoken, message_id)
         elif message.type == "location":
-             # Handle location in group if needed, for now just print
-             print(f"Location message from user {user_id} in group {group_id}")
+             # Handle location in group if needed, for now just log
+             logger.info("location message in group")
         else:
-            print(f"Unhandled message type from user {user_id} in group {group_id}: {message.type}")
+            logger.info("unhandled message type", extra={"message_type": message.type, "source_type": source_type})
     else:
-        print(f"Unhandled source type: {source_type}")
+        logger.info("unhandled source type", extra={"source_type": source_type})
@@ -0,0 +1,112 @@
+"""In-process counters, gauges and histograms rendered in Prometheus text format.
+
+Values are per worker process; ``GET /metrics`` reports the worker that
+served the scrape.
+"""
+import threading
+
+_lock = threading.Lock()
+_registry: dict[str, "_Metric"] = {}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict | None = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: dict[tuple, float] = {}
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...]):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with _lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.sums[key] = self.sums.get(key, 0) + value
+
+    def samples(self):
+        for key, counts in sorted(self.counts.items()):
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{_format_labels(key, {'le': bound})} {count}"
+            yield f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {counts[-1]}"
+            yield f"{self.name}_sum{_format_labels(key)} {self.sums[key]}"
+            yield f"{self.name}_count{_format_labels(key)} {counts[-1]}"
+
+
+def _register(metric):
+    with _lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name: str, help_text: str) -> Counter:
+    return _register(Counter(name, help_text))
+
+
+def gauge(name: str, help_text: str) -> Gauge:
+    return _register(Gauge(name, help_text))
+
+
+def histogram(name: str, help_text: str, buckets: tuple[float, ...]) -> Histogram:
+    return _register(Histogram(name, help_text, buckets))
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_registry.values())
+    return "\n".join(m.render() for m in metrics) + "\n"
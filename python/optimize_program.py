@@ -0,0 +1,329 @@
+"""Offline optimization of the DisasterBot program against labelled Thai turns.
+
+    python python/optimize_program.py compile --k 4 [--bootstrap] [--promote]
+    python python/optimize_program.py promote 20261019T120000Z-extractor-predict-labeled4
+    python python/optimize_program.py list
+
+``compile`` reads the labelled turns (``bench/labelled/disasterbot_turns.jsonl``
+by default) and splits them into a train and a held-out dev split. For
+``FieldExtractor`` and ``QuestionGenerator`` separately it builds every
+candidate:
+
+* ``Predict`` or ``ChainOfThought``;
+* zero-shot, ``k`` labelled demos (``LabeledFewShot``), and with
+  ``--bootstrap`` also ``k`` demos bootstrapped by the configured LM
+  (``BootstrapFewShot``).
+
+Each candidate runs against the configured LM on the dev split. The report
+gives field accuracy, latency and prompt/completion tokens per call for every
+candidate, plus tokens per turn for the current program (zero-shot CoT) and
+the winner.
+
+For each signature the winner is the most accurate candidate; among those
+within ``--accuracy-tolerance`` of the best, the one with the fewest tokens
+wins. The winning program is saved as a new version by ``program_store``,
+with the report in its manifest. ``--promote`` (or the ``promote``
+subcommand) makes it the version the API loads at startup.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import sys
+import time
+from difflib import SequenceMatcher
+from pathlib import Path
+from types import SimpleNamespace
+
+import dspy
+
+import degraded_mode
+import program_store
+from llm_qa import MISSING_LABELS, PREDICTOR_KINDS, DisasterProgram, FieldExtractor, QuestionGenerator, lm
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATASET = Path(__file__).resolve().parent.parent / "bench" / "labelled" / "disasterbot_turns.jsonl"
+EXTRACTOR_FIELDS = ("province", "district", "subdistrict", "address_details", "content_update", "urgency_update")
+STATE_FIELDS = ("province", "district", "subdistrict", "address_details", "raw_content", "urgency_level", "step",
+                "last_bot_question")
+NONE_VALUES = {"", "none", "null", "n/a", "unknown", "ไม่ทราบ"}
+
+
+def _state_json(state: dict) -> str:
+    # Same shape as ReportState.model_dump_json(), which is what the bot sends at runtime
+    return json.dumps({k: state.get(k, "collecting" if k == "step" else None) for k in STATE_FIELDS},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+def _label(value) -> str:
+    return "None" if value is None else str(value)
+
+
+def load_dataset(path: Path) -> dict[str, list[dspy.Example]]:
+    """Labelled turns as ``dspy.Example`` per signature (``extractor``, ``asker``)."""
+    examples = {"extractor": [], "asker": []}
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if row["signature"] == "extractor":
+            example = dspy.Example(current_state=_state_json(row["current_state"]),
+                                   previous_question=row["previous_question"], new_message=row["new_message"],
+                                   **{f: _label(row["expected"].get(f)) for f in EXTRACTOR_FIELDS})
+            examples["extractor"].append(example.with_inputs("current_state", "previous_question", "new_message"))
+        else:
+            example = dspy.Example(current_knowledge=_state_json(row["current_knowledge"]),
+                                   missing_info=", ".join(MISSING_LABELS[f] for f in row["missing"]),
+                                   missing=row["missing"], question=row["expected"]["question"])
+            examples["asker"].append(example.with_inputs("current_knowledge", "missing_info"))
+    return examples
+
+
+def split(examples: list, dev_every: int = 3) -> tuple[list, list]:
+    """Every ``dev_every``-th example is held out; the split is stable as the file grows."""
+    train = [e for i, e in enumerate(examples) if i % dev_every != dev_every - 1]
+    dev = [e for i, e in enumerate(examples) if i % dev_every == dev_every - 1]
+    return train, dev
+
+
+# --- Metrics ---
+
+def _value(value) -> str | None:
+    text = "" if value is None else str(value).strip()
+    return None if text.lower() in NONE_VALUES else text
+
+
+def _same_place(field: str, expected, got) -> bool:
+    expected, got = _value(expected), _value(got)
+    if expected is None or got is None:
+        return expected is None and got is None
+    if field == "province":
+        return degraded_mode.normalize_province(expected) == degraded_mode.normalize_province(got)
+    return degraded_mode.LEADING_MARKER.sub("", got).strip() == expected
+
+
+def _similar_text(expected, got) -> bool:
+    expected, got = _value(expected), _value(got)
+    if expected is None or got is None:
+        return expected is None and got is None
+    return expected in got or got in expected or SequenceMatcher(None, expected, got).ratio() >= 0.6
+
+
+def _same_urgency(expected, got) -> bool:
+    expected, got = _value(expected), _value(got)
+    return (expected or "").lower() == (got or "").lower()
+
+
+FIELD_CHECKS = {
+    "province": lambda e, g: _same_place("province", e, g),
+    "district": lambda e, g: _same_place("district", e, g),
+    "subdistrict": lambda e, g: _same_place("subdistrict", e, g),
+    "address_details": _similar_text,
+    "content_update": _similar_text,
+    "urgency_update": _same_urgency,
+}
+
+
+def extractor_fields(example, prediction) -> dict[str, bool]:
+    return {f: check(example[f], getattr(prediction, f, None)) for f, check in FIELD_CHECKS.items()}
+
+
+def extractor_metric(example, prediction, trace=None):
+    correct = extractor_fields(example, prediction)
+    score = sum(correct.values()) / len(correct)
+    # Bootstrapped demos must be fully right
+    return score == 1.0 if trace is not None else score
+
+
+def asker_metric(example, prediction, trace=None):
+    """The question asks for the first missing field, and not for details while the location is incomplete."""
+    question = _value(getattr(prediction, "question", None)) or ""
+    words = dict(degraded_mode.QUESTION_FIELDS)
+    first = example.missing[0]
+    asks_first = any(word in question.lower() for word in words[first])
+    asks_details_early = first != "content" and any(word in question.lower() for word in words["content"])
+    ok = bool(question) and asks_first and not asks_details_early
+    return ok if trace is not None else float(ok)
+
+
+SIGNATURES = {
+    "extractor": (FieldExtractor, extractor_metric),
+    "asker": (QuestionGenerator, asker_metric),
+}
+
+
+# --- Candidates ---
+
+class CountingLM(dspy.BaseLM):
+    """Wraps the configured LM and counts prompt/completion tokens from each response's usage."""
+
+    def __init__(self, inner):
+        super().__init__(model=inner.model, cache=False)
+        self.inner = inner
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        response = self.inner.forward(prompt=prompt, messages=messages, **kwargs)
+        usage = dict(response.usage or {})
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.completion_tokens += usage.get("completion_tokens") or 0
+        return response
+
+
+def candidates(k: int, bootstrap: bool):
+    for kind in ("cot", "predict"):
+        yield f"{kind}-zero", kind, None
+        yield f"{kind}-labeled{k}", kind, "labeled"
+        if bootstrap:
+            yield f"{kind}-bootstrap{k}", kind, "bootstrap"
+
+
+def build(signature, kind: str, demos: str | None, train: list, k: int, metric):
+    student = PREDICTOR_KINDS[kind](signature)
+    if demos == "labeled":
+        return dspy.LabeledFewShot(k=k).compile(student, trainset=train)
+    if demos == "bootstrap":
+        return dspy.BootstrapFewShot(metric=metric, max_bootstrapped_demos=k, max_labeled_demos=k).compile(
+            student, trainset=train)
+    return student
+
+
+def evaluate(name: str, predictor, dev: list, metric, counter: CountingLM) -> dict:
+    scores, latencies, failures = [], [], 0
+    fields = {f: 0 for f in FIELD_CHECKS} if metric is extractor_metric else None
+    prompt_before, completion_before = counter.prompt_tokens, counter.completion_tokens
+    with dspy.context(lm=counter):
+        for example in dev:
+            started = time.perf_counter()
+            try:
+                prediction = predictor(**example.inputs())
+            except Exception:
+                logger.exception("candidate call failed", extra={"candidate": name})
+                failures += 1
+                prediction = SimpleNamespace()
+            latencies.append((time.perf_counter() - started) * 1000)
+            scores.append(float(metric(example, prediction)))
+            if fields is not None:
+                for field, ok in extractor_fields(example, prediction).items():
+                    fields[field] += ok
+    latencies.sort()
+    calls = len(dev)
+    result = {
+        "accuracy": round(sum(scores) / calls, 4),
+        "latency_ms_p50": round(latencies[calls // 2], 1),
+        "latency_ms_mean": round(sum(latencies) / calls, 1),
+        "prompt_tokens_per_call": round((counter.prompt_tokens - prompt_before) / calls, 1),
+        "completion_tokens_per_call": round((counter.completion_tokens - completion_before) / calls, 1),
+        "demos": sum(len(p.demos) for p in predictor.predictors()),
+        "failures": failures,
+    }
+    result["tokens_per_call"] = round(result["prompt_tokens_per_call"] + result["completion_tokens_per_call"], 1)
+    if fields is not None:
+        result["field_accuracy"] = {f: round(n / calls, 3) for f, n in fields.items()}
+    return result
+
+
+def pick_winner(rows: dict, tolerance: float) -> str:
+    best = max(r["accuracy"] for r in rows.values())
+    close = [name for name, r in rows.items() if r["accuracy"] >= best - tolerance]
+    return min(close, key=lambda name: (rows[name]["tokens_per_call"], rows[name]["latency_ms_mean"]))
+
+
+def compile_program(dataset: Path, k: int = 4, bootstrap: bool = False, accuracy_tolerance: float = 0.02,
+                    seed: int = 0) -> tuple[DisasterProgram, dict]:
+    """Evaluate every candidate per signature; the program of the winners and the report."""
+    random.seed(seed)
+    examples = load_dataset(dataset)
+    counter = CountingLM(dspy.settings.lm or lm)
+    report = {"candidates": {}, "winners": {}, "splits": {}}
+    winners = {}
+    for signature_name, (signature, metric) in SIGNATURES.items():
+        train, dev = split(examples[signature_name])
+        report["splits"][signature_name] = {"train": len(train), "dev": len(dev)}
+        rows, built = {}, {}
+        for name, kind, demos in candidates(k, bootstrap):
+            built[name] = (kind, build(signature, kind, demos, train, k, metric))
+            rows[name] = evaluate(name, built[name][1], dev, metric, counter)
+            logger.info("candidate evaluated", extra={"signature": signature_name, "candidate": name, **{
+                key: value for key, value in rows[name].items() if key != "field_accuracy"}})
+        winner = pick_winner(rows, accuracy_tolerance)
+        report["candidates"][signature_name] = rows
+        report["winners"][signature_name] = winner
+        winners[signature_name] = built[winner]
+
+    program = DisasterProgram({name: kind for name, (kind, _) in winners.items()})
+    for name, (_, predictor) in winners.items():
+        setattr(program, name, predictor)
+
+    # Per turn the bot makes one extractor and (until the report is complete) one asker call
+    def per_turn(choice: dict) -> dict:
+        rows = [report["candidates"][s][choice[s]] for s in SIGNATURES]
+        return {"tokens": round(sum(r["tokens_per_call"] for r in rows), 1),
+                "latency_ms": round(sum(r["latency_ms_mean"] for r in rows), 1),
+                "accuracy": {s: report["candidates"][s][choice[s]]["accuracy"] for s in SIGNATURES}}
+
+    report["per_turn"] = {"current": per_turn({s: "cot-zero" for s in SIGNATURES}),
+                          "winner": per_turn(report["winners"])}
+    report["dataset"] = {"path": str(dataset), "sha256": hashlib.sha256(Path(dataset).read_bytes()).hexdigest()}
+    report["settings"] = {"k": k, "bootstrap": bootstrap, "accuracy_tolerance": accuracy_tolerance, "seed": seed,
+                          "lm": counter.model}
+    return program, report
+
+
+def print_report(report: dict):
+    for signature_name, rows in report["candidates"].items():
+        split_sizes = report["splits"][signature_name]
+        print(f"\n{signature_name} (train {split_sizes['train']}, dev {split_sizes['dev']})")
+        print(f"  {'candidate':18s} {'accuracy':>8s} {'p50 ms':>8s} {'prompt tok':>10s} {'compl tok':>9s} {'demos':>5s}")
+        for name, r in rows.items():
+            mark = " *" if name == report["winners"][signature_name] else ""
+            print(f"  {name:18s} {r['accuracy']:8.3f} {r['latency_ms_p50']:8.1f} {r['prompt_tokens_per_call']:10.1f} "
+                  f"{r['completion_tokens_per_call']:9.1f} {r['demos']:5d}{mark}")
+    current, winner = report["per_turn"]["current"], report["per_turn"]["winner"]
+    print(f"\nper turn (extractor + asker): current {current['tokens']} tokens {current['latency_ms']}ms, "
+          f"winner {winner['tokens']} tokens {winner['latency_ms']}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile, compare and promote DisasterBot program artifacts.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("compile", help="evaluate candidates on the labelled turns and save the winner")
+    run.add_argument("--dataset", type=Path, default=DEFAULT_DATASET)
+    run.add_argument("--k", type=int, default=4, help="few-shot demos per predictor")
+    run.add_argument("--bootstrap", action="store_true", help="also bootstrap demos with the LM (extra LM calls)")
+    run.add_argument("--accuracy-tolerance", type=float, default=0.02)
+    run.add_argument("--promote", action="store_true", help="load the winner at the next API start")
+    run.add_argument("--report", type=Path, help="also write the report as JSON here")
+    promote = sub.add_parser("promote", help="make an existing version the one loaded at startup")
+    promote.add_argument("version")
+    sub.add_parser("list", help="saved versions; the current one is marked")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        current = program_store.current_version()
+        for version in program_store.versions():
+            print(f"{'*' if version == current else ' '} {version}")
+        return
+    if args.command == "promote":
+        program_store.promote(args.version)
+        print(f"promoted {args.version}")
+        return
+
+    program, report = compile_program(args.dataset, args.k, args.bootstrap, args.accuracy_tolerance)
+    print_report(report)
+    winners = report["winners"]
+    version = program_store.new_version(f"extractor-{winners['extractor']}-asker-{winners['asker']}")
+    path = program_store.save(version, program.dump_state(), {"kinds": program.kinds, "report": report})
+    print(f"saved {path}")
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    if args.promote:
+        program_store.promote(version)
+        print(f"promoted {version}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
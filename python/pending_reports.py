@@ -0,0 +1,112 @@
+"""Server-side store for completed reports waiting for the SUBMIT postback.
+
+The confirmation button only carries ``action=submit&id=<token>``; the report
+itself lives in Redis under ``pending:<token>`` for ``PENDING_REPORT_TTL``
+seconds. Submitting is a single lookup, and a ``pending:<token>:submitted``
+marker makes repeated taps (or LINE redeliveries) idempotent.
+"""
+import json
+import logging
+import os
+import secrets
+from urllib.parse import parse_qs, urlencode
+
+from dotenv import load_dotenv
+
+import redis_connection
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+PENDING_REPORT_TTL = int(os.getenv("PENDING_REPORT_TTL", 24 * 60 * 60))
+
+redis_client = redis_connection.sync_client()
+
+SUBMITTED = "submitted"
+DUPLICATE = "duplicate"
+EXPIRED = "expired"
+FORBIDDEN = "forbidden"
+
+# Sets the submitted marker and returns the report in one step, so no location
+# can be attached between reading the report and claiming it
+CLAIM = redis_client.register_script("""
+local raw = redis.call('get', KEYS[1])
+if not raw then
+    return false
+end
+if not redis.call('set', KEYS[2], 1, 'NX', 'EX', ARGV[1]) then
+    return 0
+end
+return raw
+""")
+
+# Location updates only land on reports that are still unclaimed
+ATTACH_LOCATION = redis_client.register_script("""
+if redis.call('exists', KEYS[2]) == 1 then
+    return 0
+end
+local raw = redis.call('get', KEYS[1])
+if not raw then
+    return 0
+end
+local pending = cjson.decode(raw)
+pending.state.latitude = tonumber(ARGV[1])
+pending.state.longitude = tonumber(ARGV[2])
+redis.call('set', KEYS[1], cjson.encode(pending), 'KEEPTTL')
+return 1
+""")
+
+
+def _key(token: str) -> str:
+    return f"pending:{token}"
+
+
+def save_pending(user_id: str, state: dict) -> str:
+    """Store a completed ``ReportState`` dict and return the opaque token for the postback."""
+    token = secrets.token_urlsafe(12)
+    redis_client.set(_key(token), json.dumps({"user_id": user_id, "state": state}, ensure_ascii=False),
+                     ex=PENDING_REPORT_TTL)
+    return token
+
+
+def submit_postback_data(token: str) -> str:
+    return urlencode({"action": "submit", "id": token})
+
+
+def parse_postback_data(data: str) -> dict:
+    """Postback ``data`` -> flat dict; values are percent-decoded, never split by hand."""
+    return {key: values[0] for key, values in parse_qs(data, keep_blank_values=True).items()}
+
+
+def claim_pending(token: str, user_id: str) -> tuple[str, dict | None]:
+    """Claim a pending report for submission.
+
+    Returns ``(SUBMITTED, state)`` the first time, ``(DUPLICATE, None)`` for every
+    later claim, ``(EXPIRED, None)`` for unknown or expired tokens and
+    ``(FORBIDDEN, None)`` when another user taps the button (e.g. in a group).
+    """
+    raw = redis_client.get(_key(token)) if token else None
+    if raw is None:
+        return EXPIRED, None
+    # The owner never changes, but the state may have gained a location since this read
+    if json.loads(raw)["user_id"] != user_id:
+        return FORBIDDEN, None
+    raw = CLAIM(keys=[_key(token), f"{_key(token)}:submitted"], args=[PENDING_REPORT_TTL], client=redis_client)
+    if raw is None:
+        return EXPIRED, None
+    if raw == 0:
+        return DUPLICATE, None
+    return SUBMITTED, json.loads(raw)["state"]
+
+
+def attach_location(token: str, latitude: float, longitude: float) -> bool:
+    """Add a shared location to a pending report that has not been submitted yet."""
+    if not token:
+        return False
+    return bool(ATTACH_LOCATION(keys=[_key(token), f"{_key(token)}:submitted"], args=[repr(latitude), repr(longitude)],
+                                client=redis_client))
+
+
+def release_claim(token: str):
+    """Undo ``claim_pending`` when the report could not be stored, so the user can retry."""
+    redis_client.delete(f"{_key(token)}:submitted")
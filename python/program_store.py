@@ -0,0 +1,86 @@
+"""Versioned DisasterBot program artifacts on disk.
+
+``python python/optimize_program.py compile`` saves every winning program
+under ``PROGRAM_DIR`` (default ``data/programs``) as one directory per
+version:
+
+    <PROGRAM_DIR>/<version>/program.json   predictor state (instructions, few-shot demos)
+    <PROGRAM_DIR>/<version>/manifest.json  predictor kinds, dataset hash, LM, candidate report
+    <PROGRAM_DIR>/current                  the version the API loads
+
+``PROGRAM_VERSION`` pins a version instead of ``current``. Artifacts are
+never modified once written; promoting or rolling back only rewrites
+``current``.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+PROGRAM_DIR = Path(os.getenv("PROGRAM_DIR") or Path(os.getenv("DATA_DIR", "data")) / "programs")
+PROGRAM_VERSION = os.getenv("PROGRAM_VERSION") or None
+# Bumped when the layout of program.json/manifest.json changes incompatibly
+FORMAT = 1
+
+
+class ProgramNotFound(Exception):
+    """The requested program version does not exist under ``PROGRAM_DIR``."""
+
+
+def new_version(name: str) -> str:
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{name}"
+
+
+def save(version: str, state: dict, manifest: dict, directory: Path = None) -> Path:
+    directory = Path(directory or PROGRAM_DIR) / version
+    directory.mkdir(parents=True, exist_ok=False)
+    (directory / "program.json").write_text(json.dumps(state, indent=2, ensure_ascii=False) + "\n")
+    manifest = {"format": FORMAT, "version": version, **manifest}
+    (directory / "manifest.json").write_text(json.dumps(manifest, indent=2, ensure_ascii=False) + "\n")
+    return directory
+
+
+def promote(version: str, directory: Path = None):
+    """Make ``version`` the one loaded at startup (written atomically)."""
+    directory = Path(directory or PROGRAM_DIR)
+    if not (directory / version / "manifest.json").exists():
+        raise ProgramNotFound(version)
+    tmp = directory / ".current.tmp"
+    tmp.write_text(version + "\n")
+    os.replace(tmp, directory / "current")
+
+
+def current_version(directory: Path = None) -> str | None:
+    if PROGRAM_VERSION:
+        return PROGRAM_VERSION
+    pointer = Path(directory or PROGRAM_DIR) / "current"
+    if not pointer.exists():
+        return None
+    return pointer.read_text().strip() or None
+
+
+def versions(directory: Path = None) -> list[str]:
+    directory = Path(directory or PROGRAM_DIR)
+    if not directory.is_dir():
+        return []
+    return sorted(p.name for p in directory.iterdir() if (p / "manifest.json").exists())
+
+
+def load(version: str = None, directory: Path = None) -> tuple[dict, dict] | None:
+    """``(manifest, state)`` of ``version`` (default: the current one); None when nothing is promoted."""
+    version = version or current_version(directory)
+    if version is None:
+        return None
+    path = Path(directory or PROGRAM_DIR) / version
+    if not (path / "manifest.json").exists():
+        raise ProgramNotFound(version)
+    manifest = json.loads((path / "manifest.json").read_text())
+    if manifest.get("format") != FORMAT:
+        raise ValueError(f"program {version} has format {manifest.get('format')}, expected {FORMAT}")
+    return manifest, json.loads((path / "program.json").read_text())
@@ -0,0 +1,160 @@
+"""The process-wide Redis connections, configured once.
+
+Every module uses ``sync_client()`` (handlers that run in the thread pool) or
+``async_client()`` (code on the event loop) instead of building its own
+client. Both use bounded connection pools (``REDIS_MAX_CONNECTIONS``), socket
+and connect timeouts, periodic health checks on idle connections, and retry
+connection errors and timeouts with jittered exponential backoff, so a Redis
+restart is ridden out instead of failing every request in flight.
+
+``Batch`` lets several modules queue their commands for one round trip:
+
+    with redis_connection.batch(transaction=True) as b:
+        inbox = b.add("lrange", key, 0, -1, parse=parse_inbox)
+        b.add("delete", key)
+        history = b.add("get", f"user:{user_id}:messages")
+    inbox.value, history.value
+"""
+import logging
+import os
+import threading
+import time
+
+import redis
+import redis.asyncio
+from dotenv import load_dotenv
+from redis.backoff import ExponentialWithJitterBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+# Thread-pool handlers and the event loop each get a pool of this size per worker process
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+# How long a caller waits for a free pooled connection before failing
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_RETRIES = int(os.getenv("REDIS_RETRIES", "3"))
+
+_lock = threading.Lock()
+_sync_client = None
+_async_client = None
+
+
+def _connection_kwargs() -> dict:
+    kwargs = {
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "max_connections": REDIS_MAX_CONNECTIONS,
+    }
+    if not REDIS_URL:
+        kwargs.update(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    return kwargs
+
+
+def _retry(retry_class):
+    # OSError covers refused/reset sockets while (re)connecting, e.g. during a Redis restart
+    return retry_class(ExponentialWithJitterBackoff(base=0.05, cap=1.0), REDIS_RETRIES,
+                       supported_errors=(ConnectionError, TimeoutError, OSError))
+
+
+def sync_client() -> redis.Redis:
+    """The shared blocking client; callers wait up to ``REDIS_POOL_TIMEOUT`` for a pooled connection."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            # With an explicit pool, redis-py takes the retry policy from the pool's connections
+            kwargs = {**_connection_kwargs(), "retry": _retry(Retry)}
+            pool_class = redis.BlockingConnectionPool
+            pool = (pool_class.from_url(REDIS_URL, timeout=REDIS_POOL_TIMEOUT, **kwargs) if REDIS_URL
+                    else pool_class(timeout=REDIS_POOL_TIMEOUT, **kwargs))
+            _sync_client = redis.Redis(connection_pool=pool)
+        return _sync_client
+
+
+def async_client() -> redis.asyncio.Redis:
+    """The shared asyncio client, for code running on the event loop."""
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            from redis.asyncio.retry import Retry as AsyncRetry
+
+            kwargs = {**_connection_kwargs(), "retry": _retry(AsyncRetry)}
+            pool_class = redis.asyncio.BlockingConnectionPool
+            pool = (pool_class.from_url(REDIS_URL, timeout=REDIS_POOL_TIMEOUT, **kwargs) if REDIS_URL
+                    else pool_class(timeout=REDIS_POOL_TIMEOUT, **kwargs))
+            _async_client = redis.asyncio.Redis(connection_pool=pool)
+        return _async_client
+
+
+async def health() -> dict:
+    """Ping through the async pool; ``{"redis": "ok", "latency_ms": ...}`` or ``{"redis": "unavailable"}``."""
+    started = time.perf_counter()
+    try:
+        await async_client().ping()
+    except (ConnectionError, TimeoutError, OSError):
+        logger.warning("redis health check failed")
+        return {"redis": "unavailable"}
+    return {"redis": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+class Deferred:
+    """Result slot of a ``Batch`` command; ``value`` is set when the batch executes."""
+
+    __slots__ = ("parse", "value")
+
+    def __init__(self, parse=None, value=None):
+        self.parse = parse
+        self.value = value
+
+
+class Batch:
+    """Commands queued from several call sites and sent as one pipeline."""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.slots = []
+
+    def add(self, command: str, *args, parse=None, **kwargs) -> Deferred:
+        getattr(self.pipe, command)(*args, **kwargs)
+        slot = Deferred(parse)
+        self.slots.append(slot)
+        return slot
+
+    def execute(self):
+        for slot, result in zip(self.slots, self.pipe.execute()):
+            slot.value = slot.parse(result) if slot.parse else result
+        self.slots = []
+
+
+class batch:
+    """``with batch(client) as b: ...`` executes everything added to ``b`` in one round trip on exit.
+
+    With ``transaction=True`` the commands run as one MULTI/EXEC, so nothing
+    else interleaves (e.g. reading and deleting a list without losing a push).
+    """
+
+    def __init__(self, client: redis.Redis = None, transaction: bool = False):
+        self.client = client
+        self.transaction = transaction
+
+    def __enter__(self) -> Batch:
+        self.pipe = (self.client or sync_client()).pipeline(transaction=self.transaction)
+        self.batch = Batch(self.pipe)
+        return self.batch
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None and self.batch.slots:
+                self.batch.execute()
+        finally:
+            self.pipe.reset()
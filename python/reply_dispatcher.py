@@ -0,0 +1,162 @@
+"""Send a turn's messages by reply while the token is usable, by push otherwise.
+
+LINE reply tokens are single-use and expire shortly after the webhook event
+(about a minute), so a slow ``DisasterBot`` turn can outlive its token. The
+dispatcher collects the turn's messages and, on ``flush``:
+
+* sends the first five with ``reply_message`` if the token is younger than
+  ``REPLY_TOKEN_TTL`` seconds and has not been used;
+* otherwise, or when LINE rejects the reply with a 400 (token expired or
+  already used), pushes them to the user or group instead;
+* pushes any messages beyond the five a single request can carry.
+
+With ``PROCESSING_NOTICE_AFTER`` set, a short "processing" reply goes out on
+the fresh token when the turn is still running after that many seconds, and
+the real answer follows by push.
+
+Each path is counted in ``line_dispatch_total`` (see ``GET /metrics``).
+"""
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from linebot.v3.messaging import (ApiClient, Configuration, MessagingApi, PushMessageRequest,
+                                  ReplyMessageRequest, TextMessage)
+from linebot.v3.messaging.exceptions import ApiException
+
+import metrics
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+LINE_API_HOST = os.getenv("LINE_API_HOST")
+# Keep a margin below LINE's own expiry so the reply is not raced against it
+REPLY_TOKEN_TTL = float(os.getenv("REPLY_TOKEN_TTL", "50"))
+# Seconds before the "processing" reply is sent; 0 disables it
+PROCESSING_NOTICE_AFTER = float(os.getenv("PROCESSING_NOTICE_AFTER", "0"))
+PROCESSING_NOTICE_TEXT = "กำลังประมวลผลข้อมูลของคุณ กรุณารอสักครู่ค่ะ"
+
+MAX_MESSAGES_PER_REQUEST = 5
+
+REPLY = "reply"
+PUSH = "push"
+REPLY_FALLBACK_PUSH = "reply_fallback_push"
+NOTICE = "notice"
+
+dispatch_total = metrics.counter(
+    "line_dispatch_total", "LINE message requests sent, by path (reply, push, reply_fallback_push, notice)")
+dispatch_failures = metrics.counter("line_dispatch_failures_total", "LINE message requests that failed, by path")
+token_age_seconds = metrics.histogram(
+    "line_reply_token_age_seconds", "Age of the reply token when the answer was dispatched",
+    buckets=(1, 2, 5, 10, 20, 30, 50, 60, 120))
+
+
+class ReplyDispatcher:
+    """Collects the messages for one webhook event and delivers them on ``flush``.
+
+    ``push_to`` is the user ID (or group ID for group chats) used when the reply
+    token cannot be; without it, messages the reply cannot carry (a stale token,
+    or more than five) are dropped and logged.
+    ``event_timestamp`` is the webhook event's ``timestamp`` in milliseconds;
+    when missing, the token's age is measured from construction.
+    """
+
+    def __init__(self, reply_token: str, push_to: str | None = None, event_timestamp: int | None = None):
+        self.reply_token = reply_token
+        self.push_to = push_to
+        self.issued_at = event_timestamp / 1000 if event_timestamp else time.time()
+        self.messages = []
+        self._token_used = False
+        self._lock = threading.Lock()
+        self._notice_timer = None
+
+    def age(self) -> float:
+        return time.time() - self.issued_at
+
+    def token_fresh(self) -> bool:
+        return not self._token_used and self.age() < REPLY_TOKEN_TTL
+
+    def add(self, *messages):
+        self.messages.extend(m for m in messages if m is not None)
+
+    def start_processing_notice(self, after: float | None = None):
+        """Send the "processing" reply if ``flush`` has not happened within ``after`` seconds."""
+        after = PROCESSING_NOTICE_AFTER if after is None else after
+        if after <= 0 or not self.push_to:
+            # Without a push target the real answer needs the reply token
+            return
+        self._notice_timer = threading.Timer(after, self._send_notice)
+        self._notice_timer.daemon = True
+        self._notice_timer.start()
+
+    def _send_notice(self):
+        with self._lock:
+            if not self.token_fresh():
+                return
+            self._token_used = True
+            try:
+                self._reply([TextMessage(text=PROCESSING_NOTICE_TEXT)])
+                dispatch_total.inc(path=NOTICE)
+            except Exception:
+                dispatch_failures.inc(path=NOTICE)
+                logger.exception("failed to send processing notice")
+
+    def flush(self):
+        """Deliver the collected messages; safe to call once per event."""
+        if self._notice_timer:
+            self._notice_timer.cancel()
+        with self._lock:
+            messages, self.messages = self.messages, []
+            if not messages:
+                return
+            chunks = [messages[i:i + MAX_MESSAGES_PER_REQUEST]
+                      for i in range(0, len(messages), MAX_MESSAGES_PER_REQUEST)]
+            age = self.age()
+            token_age_seconds.observe(age)
+
+            fresh = self.token_fresh()
+            if fresh:
+                self._token_used = True
+                first = chunks.pop(0)
+                try:
+                    self._reply(first)
+                    dispatch_total.inc(path=REPLY)
+                except ApiException as e:
+                    if e.status != 400 or not self.push_to:
+                        dispatch_failures.inc(path=REPLY)
+                        raise
+                    logger.warning("reply token rejected, pushing instead", extra={"token_age_s": round(age, 3)})
+                    self._push(first, REPLY_FALLBACK_PUSH)
+
+            # Whatever the reply could not carry (all of it, if the token is stale) needs a push target
+            if chunks and not self.push_to:
+                dispatch_failures.inc(path=PUSH)
+                logger.error("no push target for messages the reply token cannot carry, dropping them",
+                             extra={"token_age_s": round(age, 3), "token_fresh": fresh,
+                                    "message_count": sum(len(chunk) for chunk in chunks)})
+                return
+
+            for chunk in chunks:
+                self._push(chunk, PUSH)
+
+    def _api(self):
+        channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+        if not channel_access_token:
+            raise RuntimeError("LINE_CHANNEL_ACCESS_TOKEN not set")
+        return ApiClient(Configuration(access_token=channel_access_token, host=LINE_API_HOST))
+
+    def _reply(self, messages):
+        with self._api() as api_client:
+            MessagingApi(api_client).reply_message(
+                ReplyMessageRequest(reply_token=self.reply_token, messages=messages))
+
+    def _push(self, messages, path: str):
+        try:
+            with self._api() as api_client:
+                MessagingApi(api_client).push_message(PushMessageRequest(to=self.push_to, messages=messages))
+        except Exception:
+            dispatch_failures.inc(path=path)
+            raise
+        dispatch_total.inc(path=path)
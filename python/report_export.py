@@ -0,0 +1,180 @@
+"""Streaming bulk export of the ``reports`` table to CSV, GeoJSON and Parquet.
+
+Rows are read through a server-side cursor (``stream_results``) in chunks of
+``EXPORT_CHUNK_SIZE`` and each chunk is encoded and handed on before the next
+one is fetched, so memory stays flat however large the table is. The same
+generators back ``GET /reports/export/{fmt}`` and the CLI:
+
+    python python/report_export.py csv -o reports.csv --province ปทุมธานี --since 2025-11-01
+
+Reporter LINE IDs and emails are left out unless ``include_reporter`` is set.
+"""
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from insert_report import Report, engine
+from report_query import apply_filters
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+
+EXPORT_COLUMNS = ["id", "message_id", "province", "district", "sub_district", "address", "content",
+                  "urgency", "timestamp", "latitude", "longitude", "flood_zone_id", "flood_risk"]
+REPORTER_COLUMNS = ["reporter_line_id", "reporter_email"]
+
+
+def export_columns(include_reporter: bool = False) -> list[str]:
+    return EXPORT_COLUMNS + REPORTER_COLUMNS if include_reporter else EXPORT_COLUMNS
+
+
+def iter_chunks(filters=None, include_reporter: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Yield lists of row tuples (``export_columns`` order) from a server-side cursor."""
+    table = Report.__table__
+    stmt = select(*(table.c[name] for name in export_columns(include_reporter)))
+    stmt = apply_filters(stmt, filters).order_by(table.c.id)
+    rows = 0
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(stmt)
+        for chunk in result.partitions(chunk_size):
+            rows += len(chunk)
+            yield chunk
+    logger.info("reports exported", extra={"rows": rows})
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def stream_csv(filters=None, include_reporter: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+    columns = export_columns(include_reporter)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so spreadsheet tools open the Thai text as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    for chunk in iter_chunks(filters, include_reporter, chunk_size):
+        writer.writerows([_isoformat(v) for v in row] for row in chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def stream_geojson(filters=None, include_reporter: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+    # Reports without a shared location get a null geometry
+    columns = export_columns(include_reporter)
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    for chunk in iter_chunks(filters, include_reporter, chunk_size):
+        features = []
+        for row in chunk:
+            properties = {name: _isoformat(value) for name, value in zip(columns, row)}
+            longitude, latitude = properties.pop("longitude"), properties.pop("latitude")
+            geometry = None if latitude is None or longitude is None else {
+                "type": "Point", "coordinates": [longitude, latitude]}
+            features.append(json.dumps({"type": "Feature", "id": properties["id"], "geometry": geometry,
+                                        "properties": properties}, ensure_ascii=False))
+        if features:
+            yield (("" if first else ",") + ",".join(features)).encode("utf-8")
+            first = False
+    yield b"]}"
+
+
+class _ChunkSink:
+    """Write-only file object that hands bytes back to the generator between row groups."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def stream_parquet(filters=None, include_reporter: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """One Parquet row group per chunk; the footer is written after the last one."""
+    columns = export_columns(include_reporter)
+    types = {"id": pa.int64(), "timestamp": pa.timestamp("us"), "latitude": pa.float64(), "longitude": pa.float64(),
+             "flood_risk": pa.float64()}
+    schema = pa.schema([(name, types.get(name, pa.string())) for name in columns])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in iter_chunks(filters, include_reporter, chunk_size):
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", stream_csv),
+    "geojson": ("application/geo+json", stream_geojson),
+    "parquet": ("application/vnd.apache.parquet", stream_parquet),
+}
+
+
+def export(fmt: str, filters=None, include_reporter: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Byte chunks of the export; raises ``ValueError`` for an unknown ``fmt``."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}, expected one of {sorted(FORMATS)}")
+    return FORMATS[fmt][1](filters, include_reporter, chunk_size)
+
+
+def main():
+    import argparse
+    import sys
+    from pathlib import Path
+
+    sys.path.append(os.getenv("MODEL_DIR", str(Path(__file__).resolve().parent.parent / "model")))
+    from report_filter import ReportFilter
+
+    parser = argparse.ArgumentParser(description="Export reports to CSV, GeoJSON or Parquet.")
+    parser.add_argument("format", choices=sorted(FORMATS))
+    parser.add_argument("-o", "--out", help="output file (default: stdout)")
+    for field in ReportFilter.model_fields:
+        parser.add_argument(f"--{field.replace('_', '-')}", dest=field)
+    parser.add_argument("--include-reporter", action="store_true", help="add reporter LINE ID and email")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    filters = ReportFilter(**{field: getattr(args, field) for field in ReportFilter.model_fields})
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    try:
+        for data in export(args.format, filters, args.include_reporter, args.chunk_size):
+            out.write(data)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
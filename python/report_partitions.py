@@ -0,0 +1,299 @@
+"""Monthly partitions of ``reports`` and archival of old months to Parquet.
+
+On Postgres ``reports`` is ``PARTITION BY RANGE (timestamp)`` with one
+partition per month, ``reports_YYYY_MM`` (see
+``insert_report.create_partitioned_table``). The planner only scans the
+months that a ``since``/``until`` filter selects. Each partition's indexes
+stay the size of one month, so inserts and recent-data queries cost the same
+however much history there is.
+
+A maintenance thread in the API, run by one worker at a time, does two jobs
+every ``REPORT_MAINTENANCE_INTERVAL`` seconds:
+
+* creates the partitions from the current month to ``REPORT_PARTITION_PREMAKE``
+  months ahead;
+* when ``REPORT_RETENTION_MONTHS`` is set, archives every month older than that.
+
+Archiving writes the month, including reporter fields, to
+``<REPORT_ARCHIVE_DIR>/reports/reports_YYYY_MM.parquet`` (zstd). It checks
+the row count read back from the file, then detaches and drops the
+partition. On databases without partitioning (SQLite in the benchmarks), the
+month's rows are deleted instead.
+
+    python python/report_partitions.py ensure --since 2024-01
+    python python/report_partitions.py archive --before 2025-01
+    python python/report_partitions.py migrate   # convert an existing unpartitioned table
+
+``migrate`` copies the rows of an existing unpartitioned ``reports`` table into
+a new partitioned one. It holds an exclusive lock for the whole copy, so run
+it in a maintenance window with the API stopped.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from sqlalchemy import func, select, text
+
+import insert_report
+import report_export
+from insert_report import Report, engine
+from redis_connection import sync_client
+
+sys.path.append(os.getenv("MODEL_DIR", str(Path(__file__).resolve().parent.parent / "model")))
+from report_filter import ReportFilter  # noqa: E402
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+redis_client = sync_client()
+
+REPORT_PARTITION_PREMAKE = int(os.getenv("REPORT_PARTITION_PREMAKE", "3"))
+# 0 keeps every month in the database
+REPORT_RETENTION_MONTHS = int(os.getenv("REPORT_RETENTION_MONTHS", "0"))
+REPORT_ARCHIVE_DIR = Path(os.getenv("REPORT_ARCHIVE_DIR") or Path(os.getenv("DATA_DIR", "data")) / "archive")
+REPORT_MAINTENANCE_INTERVAL = float(os.getenv("REPORT_MAINTENANCE_INTERVAL", "3600"))
+
+TABLE = Report.__tablename__
+PARTITION_NAME = re.compile(rf"^{TABLE}_(\d{{4}})_(\d{{2}})$")
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_{month:%Y_%m}"
+
+
+def archive_path(month: date, directory: Path = None) -> Path:
+    return Path(directory or REPORT_ARCHIVE_DIR) / TABLE / f"{partition_name(month)}.parquet"
+
+
+def partitioned() -> bool:
+    with engine.connect() as conn:
+        return insert_report.is_partitioned(conn)
+
+
+def partitions() -> list[date]:
+    """Months that have a partition, oldest first; empty when ``reports`` is not partitioned."""
+    if engine.dialect.name != "postgresql":
+        return []
+    with engine.connect() as conn:
+        names = conn.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                  "WHERE i.inhparent = to_regclass(:t)"), {"t": TABLE}).scalars().all()
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def ensure_partitions(since=None, until=None, conn=None) -> list[str]:
+    """Create the missing monthly partitions from ``since`` through ``until`` (default: now to the premake horizon)."""
+    if conn is None:
+        if not partitioned():
+            return []
+        with engine.begin() as conn:
+            return ensure_partitions(since, until, conn)
+    first = month_start(since or datetime.utcnow())
+    last = month_start(until) if until else add_months(month_start(datetime.utcnow()), REPORT_PARTITION_PREMAKE)
+    existing = {name for name in conn.execute(
+        text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+             "WHERE i.inhparent = to_regclass(:t)"), {"t": TABLE}).scalars()}
+    created = []
+    month = first
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} "
+                              f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"))
+            created.append(name)
+        month = add_months(month, 1)
+    if created:
+        logger.info("partitions created", extra={"partitions": created})
+    return created
+
+
+def _month_filter(month: date) -> ReportFilter:
+    return ReportFilter(since=datetime.combine(month, datetime.min.time()),
+                        until=datetime.combine(add_months(month, 1), datetime.min.time()))
+
+
+def _count(month: date) -> int:
+    filters = _month_filter(month)
+    table = Report.__table__
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)
+                            .where(table.c.timestamp >= filters.since, table.c.timestamp < filters.until)).scalar()
+
+
+def archive_month(month: date, directory: Path = None) -> dict:
+    """Write one month to Parquet, check it, then drop the month from the database."""
+    month = month_start(month)
+    if month >= month_start(datetime.utcnow()):
+        raise ValueError(f"refusing to archive the current or a future month ({month:%Y-%m})")
+    path = archive_path(month, directory)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    expected = _count(month)
+    started = time.perf_counter()
+    tmp = path.with_suffix(".parquet.tmp")
+    with open(tmp, "wb") as f:
+        for chunk in report_export.export("parquet", _month_filter(month), include_reporter=True):
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    written = pq.read_metadata(tmp).num_rows
+    if written != expected:
+        tmp.unlink()
+        raise RuntimeError(f"archive of {month:%Y-%m} has {written} rows, expected {expected}; nothing dropped")
+    os.replace(tmp, path)
+
+    # A late write to the month after the export rolls the drop back; the file is rewritten next time
+    with engine.begin() as conn:
+        if insert_report.is_partitioned(conn):
+            name = partition_name(month)
+            if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar():
+                conn.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+                dropped = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+                if dropped == written:
+                    conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+                    conn.execute(text(f"DROP TABLE {name}"))
+            else:
+                dropped = written
+        else:
+            filters = _month_filter(month)
+            table = Report.__table__
+            dropped = conn.execute(table.delete().where(table.c.timestamp >= filters.since,
+                                                        table.c.timestamp < filters.until)).rowcount
+        if dropped != written:
+            raise RuntimeError(f"{dropped} rows in {month:%Y-%m} but {written} archived; nothing dropped")
+    summary = {"month": f"{month:%Y-%m}", "rows": written, "path": str(path), "bytes": path.stat().st_size,
+               "seconds": round(time.perf_counter() - started, 2)}
+    logger.info("reports archived", extra=summary)
+    return summary
+
+
+def archive_before(before, directory: Path = None) -> list[dict]:
+    """Archive every month that starts before ``before`` and still has rows (or a partition)."""
+    cutoff = month_start(before)
+    if partitioned():
+        # Empty partitions are archived too, so every dropped month has its file
+        return [archive_month(month, directory) for month in partitions() if month < cutoff]
+    else:
+        table = Report.__table__
+        with engine.connect() as conn:
+            oldest = conn.execute(select(func.min(table.c.timestamp))).scalar()
+        months = []
+        month = month_start(oldest) if oldest else cutoff
+        while month < cutoff:
+            months.append(month)
+            month = add_months(month, 1)
+    return [archive_month(month, directory) for month in months if _count(month)]
+
+
+def archive_expired(retention_months: int = None, directory: Path = None) -> list[dict]:
+    retention_months = REPORT_RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months <= 0:
+        return []
+    return archive_before(add_months(month_start(datetime.utcnow()), -retention_months), directory)
+
+
+def maintain() -> dict | None:
+    """Create upcoming partitions and archive expired months, unless another worker did so this interval."""
+    if not redis_client.set(f"{TABLE}:maintenance", os.getpid(), nx=True, ex=max(int(REPORT_MAINTENANCE_INTERVAL), 1)):
+        return None
+    return {"created": ensure_partitions(), "archived": archive_expired()}
+
+
+def _watch():
+    while True:
+        try:
+            maintain()
+        except Exception:
+            logger.exception("report partition maintenance failed")
+        time.sleep(REPORT_MAINTENANCE_INTERVAL)
+
+
+def start_maintenance() -> threading.Thread:
+    thread = threading.Thread(target=_watch, name="report-partitions", daemon=True)
+    thread.start()
+    return thread
+
+
+def migrate(keep: bool = False) -> dict:
+    """Move an unpartitioned ``reports`` table into a new partitioned one (one transaction)."""
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("partitioning needs Postgres")
+    old = f"{TABLE}_unpartitioned"
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        if insert_report.is_partitioned(conn):
+            return {"migrated": 0}
+        conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {old}"))
+        # Index names are schema-wide; free them for the new table's indexes
+        for index in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": old}).scalars():
+            conn.execute(text(f"ALTER INDEX {index} RENAME TO {index}_unpartitioned"))
+        insert_report.create_partitioned_table(conn)
+        oldest, newest = conn.execute(text(f'SELECT min("timestamp"), max("timestamp") FROM {old}')).one()
+        now = datetime.utcnow()
+        ensure_partitions(min(oldest or now, now), add_months(month_start(max(newest or now, now)),
+                                                              REPORT_PARTITION_PREMAKE), conn)
+        names = [column.name for column in Report.__table__.columns]
+        columns = ", ".join(f'"{name}"' for name in names)
+        values = ", ".join("coalesce(\"timestamp\", now() AT TIME ZONE 'utc')" if name == "timestamp" else f'"{name}"'
+                           for name in names)
+        rows = conn.execute(text(f"INSERT INTO {TABLE} ({columns}) SELECT {values} FROM {old}")).rowcount
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+                          f"coalesce((SELECT max(id) FROM {TABLE}), 0) + 1, false)"))
+        if not keep:
+            conn.execute(text(f"DROP TABLE {old}"))
+    # Trigram search indexes for the new parent
+    insert_report.add_search_indexes()
+    summary = {"migrated": rows, "kept": old if keep else None, "seconds": round(time.perf_counter() - started, 2)}
+    logger.info("reports table partitioned", extra=summary)
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def parse_month(value: str) -> date:
+        return datetime.strptime(value, "%Y-%m").date()
+
+    parser = argparse.ArgumentParser(description="Monthly partitions and archival of the reports table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure = commands.add_parser("ensure", help="create missing monthly partitions")
+    ensure.add_argument("--since", type=parse_month, help="first month, YYYY-MM (default: this month)")
+    ensure.add_argument("--until", type=parse_month, help="last month, YYYY-MM (default: the premake horizon)")
+    archive = commands.add_parser("archive", help="archive old months to Parquet and drop them")
+    archive.add_argument("--before", type=parse_month,
+                         help="archive months before YYYY-MM (default: REPORT_RETENTION_MONTHS ago)")
+    archive.add_argument("--dir", type=Path, help=f"archive directory (default: {REPORT_ARCHIVE_DIR})")
+    commands.add_parser("list", help="list monthly partitions")
+    migrate_parser = commands.add_parser("migrate", help="convert an unpartitioned reports table")
+    migrate_parser.add_argument("--keep", action="store_true", help=f"keep the old table as {TABLE}_unpartitioned")
+    args = parser.parse_args()
+
+    if args.command == "ensure":
+        print(ensure_partitions(args.since, args.until))
+    elif args.command == "archive":
+        for result in (archive_before(args.before, args.dir) if args.before else archive_expired(directory=args.dir)):
+            print(result)
+    elif args.command == "list":
+        for month in partitions():
+            print(partition_name(month))
+    else:
+        print(migrate(args.keep))
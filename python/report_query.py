@@ -0,0 +1,18 @@
+"""Shared filtering for queries over the ``reports`` table."""
+from insert_report import Report
+
+
+def apply_filters(stmt, filters):
+    """Narrow a ``select`` over ``reports`` by a ``ReportFilter`` (unset fields are ignored)."""
+    if filters is None:
+        return stmt
+    table = Report.__table__
+    for field in ("province", "district", "sub_district", "urgency"):
+        value = getattr(filters, field)
+        if value:
+            stmt = stmt.where(table.c[field] == value)
+    if filters.since:
+        stmt = stmt.where(table.c.timestamp >= filters.since)
+    if filters.until:
+        stmt = stmt.where(table.c.timestamp < filters.until)
+    return stmt
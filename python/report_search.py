@@ -0,0 +1,92 @@
+"""Substring and fuzzy search over report ``content`` and ``address``.
+
+On Postgres the query is matched with ``ILIKE '%q%'`` (substring) and with
+pg_trgm word similarity (``%>``, typos and spelling variants). Both use the
+trigram GIN indexes created by ``insert_report.add_search_indexes``.
+Trigrams need no word segmentation, so they work for Thai as long as the
+database uses a UTF-8 ``LC_CTYPE`` (under the C locale pg_trgm ignores Thai
+characters). Results are ranked:
+1. substring hits first;
+2. then by the best word similarity of the query to ``content`` or ``address``;
+3. then newest first.
+
+``ReportFilter`` narrows the search the same way it narrows exports.
+Other databases (SQLite in the benchmarks) get the substring match only, as a
+scan.
+
+    python python/report_search.py ไฟดับ --province ปทุมธานี --urgency High
+"""
+import logging
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import case, func, literal, or_, select, text
+
+from insert_report import Report, engine
+from report_query import apply_filters
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Minimum word similarity for a fuzzy match (pg_trgm.word_similarity_threshold, 0-1)
+SEARCH_SIMILARITY = float(os.getenv("SEARCH_SIMILARITY", "0.5"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "500"))
+
+RESULT_COLUMNS = ["id", "province", "district", "sub_district", "address", "content", "urgency", "timestamp",
+                  "flood_zone_id", "flood_risk"]
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_statement(query: str, filters=None, fuzzy: bool = True, limit: int = 50, offset: int = 0,
+                     dialect: str = None):
+    """The ranked ``select`` for ``query``; ``fuzzy`` adds pg_trgm similarity matches on Postgres."""
+    table = Report.__table__
+    pattern = f"%{_escape_like(query)}%"
+    substring = or_(table.c.content.ilike(pattern, escape="\\"), table.c.address.ilike(pattern, escape="\\"))
+    if (dialect or engine.dialect.name) == "postgresql":
+        similarity = func.greatest(func.word_similarity(query, func.coalesce(table.c.content, "")),
+                                   func.word_similarity(query, func.coalesce(table.c.address, "")))
+        score = case((substring, 1.0), else_=0.0) + similarity
+        # Each branch is answered by a trigram index; Postgres combines them with a BitmapOr
+        match = (or_(substring, table.c.content.op("%>")(query), table.c.address.op("%>")(query))
+                 if fuzzy else substring)
+    else:
+        score, match = literal(1.0), substring
+    stmt = select(*(table.c[name] for name in RESULT_COLUMNS), score.label("score")).where(match)
+    return (apply_filters(stmt, filters)
+            .order_by(score.desc(), table.c.timestamp.desc(), table.c.id.desc())
+            .limit(min(limit, SEARCH_MAX_RESULTS)).offset(offset))
+
+
+def search(query: str, filters=None, fuzzy: bool = True, limit: int = 50, offset: int = 0) -> list[dict]:
+    """Ranked reports matching ``query``, newest first among equal scores; reporter fields are never returned."""
+    query = query.strip()
+    stmt = search_statement(query, filters, fuzzy, limit, offset)
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql" and fuzzy:
+            # Transaction-local, so pooled connections keep the server default
+            conn.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+                         {"t": str(SEARCH_SIMILARITY)})
+        rows = conn.execute(stmt).mappings().all()
+    logger.info("reports searched", extra={"query_length": len(query), "fuzzy": fuzzy, "results": len(rows)})
+    return [dict(row, score=round(float(row["score"]), 4)) for row in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from report_filter import ReportFilter
+
+    parser = argparse.ArgumentParser(description="Search report content and addresses.")
+    parser.add_argument("query")
+    parser.add_argument("--province")
+    parser.add_argument("--urgency")
+    parser.add_argument("--exact", action="store_true", help="substring matches only")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    for row in search(args.query, ReportFilter(province=args.province, urgency=args.urgency),
+                      fuzzy=not args.exact, limit=args.limit):
+        print(f"{row['score']:.3f}  #{row['id']} {row['province']} {row['urgency']}  {row['content']} | {row['address']}")
@@ -0,0 +1,292 @@
+"""Offline road routing between facilities (shelters, rescue units) and reports.
+
+Road graphs are prebuilt per province with osmnx (``python python/routing.py
+build "Pathum Thani, Thailand" ปทุมธานี``) and stored as ``<province>.pkl``
+or ``<province>.graphml`` under ``GRAPH_DIR``; nothing is downloaded at
+runtime. A loaded graph is turned into plain adjacency lists plus a nearest-node
+index and kept in an LRU cache of ``ROUTING_GRAPH_CACHE_SIZE`` provinces.
+
+Flooded road segments are blocked at runtime in the Redis set
+``routing:blocked:<province>`` (shared by all workers) and skipped while routing.
+
+``nearest_facilities`` answers "nearest facility by road" for many points at
+once with a single multi-source Dijkstra seeded from every facility, instead
+of one shortest-path query per (point, facility) pair.
+"""
+import heapq
+import logging
+import math
+import os
+import pickle
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from shapely import STRtree, points
+
+import redis_connection
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+GRAPH_DIR = Path(os.getenv("GRAPH_DIR") or Path(os.getenv("DATA_DIR", "data")) / "graphs")
+ROUTING_GRAPH_CACHE_SIZE = int(os.getenv("ROUTING_GRAPH_CACHE_SIZE", "4"))
+GRAPH_SUFFIXES = (".pkl", ".gpickle", ".graphml")
+
+# Rescue units drive from the facility to the report; people walk from the report to a shelter
+TO_REPORTS = "to_reports"
+FROM_REPORTS = "from_reports"
+
+EARTH_RADIUS_M = 6_371_008.8
+
+redis_client = redis_connection.sync_client()
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class RoadNetwork:
+    """A province road graph as adjacency lists over node indices, with a nearest-node index.
+
+    Parallel edges collapse to the shortest one; edge weights are the osmnx
+    ``length`` attribute in metres.
+    """
+
+    def __init__(self, province: str, graph):
+        self.province = province
+        self.node_ids = list(graph.nodes)
+        self.index = {node: i for i, node in enumerate(self.node_ids)}
+        self.lons = np.array([float(graph.nodes[n]["x"]) for n in self.node_ids])
+        self.lats = np.array([float(graph.nodes[n]["y"]) for n in self.node_ids])
+
+        shortest = [{} for _ in self.node_ids]
+        for u, v, data in graph.edges(data=True):
+            ui, vi = self.index[u], self.index[v]
+            length = float(data.get("length", 0.0))
+            if length < shortest[ui].get(vi, math.inf):
+                shortest[ui][vi] = length
+        self.forward = [list(edges.items()) for edges in shortest]
+        self.edge_count = sum(len(edges) for edges in self.forward)
+        self._reverse = None
+
+        # Degrees of longitude shrink with latitude; scale them so nearest-node lookups are roughly metric
+        self._lon_scale = math.cos(math.radians(float(self.lats.mean()))) if len(self.lats) else 1.0
+        self._tree = STRtree(points(self.lons * self._lon_scale, self.lats))
+
+    @property
+    def reverse(self):
+        if self._reverse is None:
+            reverse = [[] for _ in self.node_ids]
+            for u, edges in enumerate(self.forward):
+                for v, length in edges:
+                    reverse[v].append((u, length))
+            self._reverse = reverse
+        return self._reverse
+
+    def nearest_nodes(self, lats, lons) -> tuple[np.ndarray, np.ndarray]:
+        """Node index nearest to each point, and the straight-line snap distance in metres."""
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        if not len(lats):
+            return np.empty(0, dtype=int), np.empty(0)
+        query, found = self._tree.query_nearest(points(lons * self._lon_scale, lats), all_matches=False)
+        nodes = np.empty(len(lats), dtype=int)
+        nodes[query] = found
+        return nodes, haversine_m(lats, lons, self.lats[nodes], self.lons[nodes])
+
+    def blocked_indices(self, edges) -> set[tuple[int, int]]:
+        index = self.index
+        return {(index[u], index[v]) for u, v in edges if u in index and v in index}
+
+    def multi_source_dijkstra(self, sources, targets, reverse: bool = False, blocked=frozenset(),
+                              cutoff: float | None = None, with_paths: bool = False):
+        """One Dijkstra from all ``sources`` at once; stops when every target is settled.
+
+        Returns ``(source_position, distance, path)`` per target, where the
+        position indexes ``sources`` and ``path`` lists node indices in travel
+        order (``None`` when unreachable or beyond ``cutoff``).
+        """
+        adjacency = self.reverse if reverse else self.forward
+        n = len(self.node_ids)
+        dist = [math.inf] * n
+        origin = [-1] * n
+        pred = [-1] * n if with_paths else None
+        settled = bytearray(n)
+        heap = []
+        for position, node in enumerate(sources):
+            if origin[node] == -1:
+                dist[node], origin[node] = 0.0, position
+                heap.append((0.0, node))
+        heapq.heapify(heap)
+        remaining = {t for t in targets}
+        pop, push = heapq.heappop, heapq.heappush
+
+        while heap and remaining:
+            d, u = pop(heap)
+            if settled[u]:
+                continue
+            if cutoff is not None and d > cutoff:
+                break
+            settled[u] = 1
+            remaining.discard(u)
+            for v, length in adjacency[u]:
+                if settled[v]:
+                    continue
+                if blocked and ((v, u) if reverse else (u, v)) in blocked:
+                    continue
+                nd = d + length
+                if nd < dist[v]:
+                    dist[v], origin[v] = nd, origin[u]
+                    if with_paths:
+                        pred[v] = u
+                    push(heap, (nd, v))
+
+        results = []
+        for t in targets:
+            if not settled[t]:
+                results.append((None, None, None))
+                continue
+            path = None
+            if with_paths:
+                path, node = [t], t
+                while pred[node] != -1:
+                    node = pred[node]
+                    path.append(node)
+                # Built from the target back to the source; the reverse graph already walks that way
+                if not reverse:
+                    path.reverse()
+            results.append((origin[t], dist[t], path))
+        return results
+
+
+def graph_path(province: str) -> Path:
+    if not province or "/" in province or "\\" in province or province.startswith("."):
+        raise ValueError(f"invalid province name {province!r}")
+    for suffix in GRAPH_SUFFIXES:
+        path = GRAPH_DIR / f"{province}{suffix}"
+        if path.exists():
+            return path
+    raise FileNotFoundError(f"no road graph for {province!r} in {GRAPH_DIR}")
+
+
+@lru_cache(maxsize=ROUTING_GRAPH_CACHE_SIZE)
+def load_network(province: str) -> RoadNetwork:
+    path = graph_path(province)
+    if path.suffix == ".graphml":
+        import osmnx as ox
+        graph = ox.load_graphml(path)
+    else:
+        # Graphs are built locally by the build command below; never load pickles from elsewhere
+        with open(path, "rb") as f:
+            graph = pickle.load(f)
+    network = RoadNetwork(province, graph)
+    logger.info("road graph loaded", extra={"province": province, "nodes": len(network.node_ids),
+                                            "edges": network.edge_count})
+    return network
+
+
+def _blocked_key(province: str) -> str:
+    return f"routing:blocked:{province}"
+
+
+def _edge_members(edges, both_directions: bool) -> list[str]:
+    members = []
+    for u, v in edges:
+        members.append(f"{u}:{v}")
+        if both_directions:
+            members.append(f"{v}:{u}")
+    return members
+
+
+def block_edges(province: str, edges, both_directions: bool = True) -> int:
+    """Mark road segments (pairs of graph node IDs) as impassable; returns how many were newly blocked."""
+    members = _edge_members(edges, both_directions)
+    return redis_client.sadd(_blocked_key(province), *members) if members else 0
+
+
+def unblock_edges(province: str, edges, both_directions: bool = True) -> int:
+    members = _edge_members(edges, both_directions)
+    return redis_client.srem(_blocked_key(province), *members) if members else 0
+
+
+def blocked_edges(province: str) -> set[tuple[int, int]]:
+    blocked = set()
+    for member in redis_client.smembers(_blocked_key(province)):
+        u, _, v = member.decode().partition(":")
+        blocked.add((int(u), int(v)))
+    return blocked
+
+
+def nearest_facilities(province: str, facilities, targets, direction: str = TO_REPORTS,
+                       cutoff_m: float | None = None, with_paths: bool = False) -> list[dict | None]:
+    """Nearest facility by road for each target.
+
+    ``facilities`` and ``targets`` are ``(lat, lon)`` pairs. Returns one dict
+    per target (``facility`` index, ``distance_m``, ``snap_m`` and, with
+    ``with_paths``, ``path`` as ``[lat, lon]`` pairs), or None when no facility
+    is reachable.
+    """
+    if direction not in (TO_REPORTS, FROM_REPORTS):
+        raise ValueError(f"direction must be {TO_REPORTS!r} or {FROM_REPORTS!r}")
+    network = load_network(province)
+    if not facilities or not targets:
+        return [None] * len(targets)
+    facility_nodes, _ = network.nearest_nodes(*zip(*facilities))
+    target_nodes, target_snap = network.nearest_nodes(*zip(*targets))
+    blocked = network.blocked_indices(blocked_edges(province))
+
+    results = network.multi_source_dijkstra(
+        [int(n) for n in facility_nodes], [int(n) for n in target_nodes],
+        reverse=direction == FROM_REPORTS, blocked=blocked, cutoff=cutoff_m, with_paths=with_paths)
+    answers = []
+    for (facility, distance, path), snap in zip(results, target_snap):
+        if facility is None:
+            answers.append(None)
+            continue
+        answer = {"facility": facility, "distance_m": round(distance, 1), "snap_m": round(float(snap), 1)}
+        if with_paths:
+            answer["path"] = [[float(network.lats[n]), float(network.lons[n])] for n in path]
+        answers.append(answer)
+    return answers
+
+
+def report_locations(filters) -> list[tuple[int, float, float]]:
+    """``(id, latitude, longitude)`` of matching reports that carry a shared location."""
+    # Imported here so graph loading and routing work without a database
+    from sqlalchemy import select
+
+    from insert_report import Report, engine
+    from report_query import apply_filters
+
+    table = Report.__table__
+    stmt = select(table.c.id, table.c.latitude, table.c.longitude).where(
+        table.c.latitude.is_not(None), table.c.longitude.is_not(None))
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(apply_filters(stmt, filters).order_by(table.c.id))]
+
+
+def build_graph(place: str, province: str):
+    """Download the drivable network for ``place`` once (needs internet) and save it for offline use."""
+    import osmnx as ox
+
+    graph = ox.graph_from_place(place, network_type="drive")
+    GRAPH_DIR.mkdir(parents=True, exist_ok=True)
+    with open(GRAPH_DIR / f"{province}.pkl", "wb") as f:
+        pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+    ox.save_graphml(graph, GRAPH_DIR / f"{province}.graphml")
+    logger.info("road graph saved", extra={"province": province, "nodes": graph.number_of_nodes()})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prebuild per-province road graphs for offline routing.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="download a province's drivable road network with osmnx")
+    build.add_argument("place", help='osmnx place query, e.g. "Pathum Thani, Thailand"')
+    build.add_argument("province", help="province name as stored on reports, e.g. ปทุมธานี")
+    args = parser.parse_args()
+    build_graph(args.place, args.province)